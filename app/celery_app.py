@@ -1,9 +1,23 @@
 from celery import Celery
+from celery.signals import worker_process_init
 from datetime import datetime, timezone
 
 from app.config import settings
+from app.llm_models.early_stop import early_stop_stats
+from app.llm_models.grammars import output_stats
+from app.llm_models.prefix_cache import stats_delta
+from app.llm_models.shared_llms import (
+    coalesce_stats,
+    draft_stats,
+    llm_pool_stats,
+    prefill_stats,
+    stage_cache_stats,
+)
+from app.llm_models.stage_cache import bypassed
 from app.models_registery import MODEL_REGISTRY
 from app.utils.monitor import get_system_stats
+from app.utils.task_events import TaskEventPublisher
+from app.utils.threads import apply as apply_thread_plan
 from app.utils.file_ops import save_result
 from app.db import SessionLocal
 from app.models import EvaluationJob
@@ -20,11 +34,38 @@ celery.conf.update(
     result_serializer="json",
     timezone="UTC",
     enable_utc=True,
+    # The thread budget splits the host between exactly this many children.
+    worker_concurrency=settings.worker_concurrency or None,
 )
 
+
+@worker_process_init.connect
+def _apply_thread_budget(**kwargs):
+    from billiard.process import current_process
+
+    apply_thread_plan(getattr(current_process(), "index", None) or 0)
+
+
+def collect_payload(result, on_event=None):
+    """Pipelines return a dict or yield stage events; fold the events into one payload.
+
+    ``on_event`` is called with every event as it arrives, progress included.
+    """
+    if isinstance(result, dict):
+        return result
+    payload = {}
+    for event in result:
+        if on_event is not None:
+            on_event(event)
+        if not event.get("stage", "").endswith("_progress"):
+            payload.update(event)
+    return payload
+
+
 @celery.task(bind=True, name="run_model")
-def run_model(self, prompt: str, model_name: str, prompt_id: int):
+def run_model(self, prompt: str, model_name: str, prompt_id: int, bypass_cache: bool = False):
     db = SessionLocal()
+    events = TaskEventPublisher(self.request.id)
     try:
         job = db.query(EvaluationJob).filter_by(task_id=self.request.id).first()
         if not job:
@@ -47,15 +88,43 @@ def run_model(self, prompt: str, model_name: str, prompt_id: int):
             raise ValueError(f"Model '{model_name}' is not registered.")
 
         stats_before = get_system_stats()
+        prefill_before = prefill_stats()
+        speculative_before = draft_stats()
+        outputs_before = output_stats()
+        coalesce_before = coalesce_stats()
+        stage_cache_before = stage_cache_stats()
+        early_stop_before = early_stop_stats()
 
         # Execute model function
-        result_payload = func(prompt)
+        with bypassed(bypass_cache):
+            result_payload = collect_payload(func(prompt), on_event=events.publish)
 
         if not isinstance(result_payload, dict):
             raise ValueError("Model function must return a dict payload.")
 
         stats_after = get_system_stats()
-        merged_result = {**result_payload, "system_stats_before": stats_before, "system_stats_after": stats_after}
+        merged_result = {
+            **result_payload,
+            "system_stats_before": stats_before,
+            "system_stats_after": stats_after,
+            "llm_pool": llm_pool_stats(),
+            # Per model (= per stage): prompt tokens and prefill tokens served from the prefix cache.
+            # With model hosts these two are host-wide, so concurrent jobs are included.
+            "prefill": stats_delta(prefill_before, prefill_stats()),
+            # Per model: drafted tokens proposed / accepted by the target
+            "speculative": stats_delta(speculative_before, draft_stats()),
+            # Per model: calls, and calls (streamed ones separately) served by an identical in-flight call
+            "coalesced": stats_delta(coalesce_before, coalesce_stats()),
+            # Per structured stage: grammar-constrained calls, output tokens, outputs cut at
+            # max_tokens and outputs that parse
+            "outputs": stats_delta(outputs_before, output_stats()),
+            # Per model: stage calls served from the stage cache (hits) and the tokens / seconds
+            # of generation they saved; "bypassed" counts calls of a bypass_cache run
+            "stage_cache": stats_delta(stage_cache_before, stage_cache_stats()),
+            # Per model: streamed stages ended as soon as their artifact was complete, tokens
+            # decoded and the max_tokens budget left undecoded by those early stops
+            "early_stop": stats_delta(early_stop_before, early_stop_stats()),
+        }
 
         # Persist result artifact and store path
         result_path = save_result(model_name=model_name, prompt=prompt, result=merged_result)
@@ -66,10 +135,12 @@ def run_model(self, prompt: str, model_name: str, prompt_id: int):
         job.time_taken = merged_result.get("time_taken")
         job.completed_at = datetime.now(timezone.utc)
         db.commit()
+        events.close({"stage": "done", "state": "SUCCESS", "time_taken": job.time_taken})
 
         return {"model": model_name, "prompt": prompt, "task_id": self.request.id}
 
     except Exception as e:
+        events.close({"stage": "error", "state": "FAILURE", "detail": str(e)})
         try:
             db.rollback()
             job = db.query(EvaluationJob).filter_by(task_id=self.request.id).first()
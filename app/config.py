@@ -20,12 +20,109 @@ class Settings(BaseSettings):
     database_url: str = Field(alias="DATABASE_URL")
     environment: str = Field("production", alias="ENVIRONMENT")
 
-    @field_validator("models", mode="before")
+    # Live task events (GET /stream/{task_id}): a Redis stream per task, see app/utils/task_events.py
+    task_events_url: str = Field("", alias="TASK_EVENTS_URL")  # empty = BROKER_URL
+    task_events_batch_ms: int = Field(50, alias="TASK_EVENTS_BATCH_MS")  # progress tokens per event
+    task_events_ttl_seconds: int = Field(3600, alias="TASK_EVENTS_TTL_SECONDS")  # resumable this long
+    task_events_max_len: int = Field(10000, alias="TASK_EVENTS_MAX_LEN")
+
+    # Direct mode: PIPELINE_MODE=direct lets POST /direct/{model} run pipelines in the API process
+    pipeline_mode: str = Field("celery", alias="PIPELINE_MODE")  # celery | direct
+    direct_workers: int = Field(4, alias="DIRECT_WORKERS")  # threads running the blocking steps
+    # Requests using one model at a time; 0 = 1 in-process, LLM_HOST_SLOTS with model hosts
+    direct_model_concurrency: int = Field(0, alias="DIRECT_MODEL_CONCURRENCY")
+
+    # Host CPU budget: worker processes split the cores; llama.cpp, torch and FAISS size to one share
+    cpu_cores: int = Field(0, alias="CPU_CORES")  # cores given to the workers; 0 = all available
+    worker_concurrency: int = Field(0, alias="WORKER_CONCURRENCY")  # Celery prefork children; 0 = one per CPU
+    cpu_pin_workers: bool = Field(False, alias="CPU_PIN_WORKERS")  # pin each child to its own cores
+    llm_threads: int = Field(0, alias="LLM_THREADS")  # llama.cpp n_threads; 0 = from the budget
+    llm_threads_batch: int = Field(0, alias="LLM_THREADS_BATCH")  # n_threads_batch; 0 = from the budget
+    llm_batch: int = Field(512, alias="LLM_BATCH")  # n_batch
+
+    # LLM pool: models load on first use; idle ones are evicted (LRU) to stay under the budget
+    llm_pool_budget_mb: int = Field(0, alias="LLM_POOL_BUDGET_MB")  # 0 = unlimited
+    llm_pool_wait_seconds: float = Field(30.0, alias="LLM_POOL_WAIT_SECONDS")
+    llm_use_mlock: bool = Field(True, alias="LLM_USE_MLOCK")
+    # GGUF quantization (F32, BF16, Q8_0, Q4_K_M, ...): LLM_QUANT for every model,
+    # LLM_QUANTS=coder:Q8_0,generator:Q4_K_M per model; empty = the shipped files
+    llm_quant: str = Field("", alias="LLM_QUANT")
+    llm_quants: Any = Field(default_factory=dict, alias="LLM_QUANTS")
+    # Speculative decoding per model: LLM_SPECULATIVE=generator:lookup,compressor:lookup,coder:draft
+    # (lookup = prompt n-gram copy, draft = LLM_DRAFT_MODEL). Needs logits for the whole context:
+    # +n_ctx * n_vocab * 4 bytes per model (~1.2 GB for Qwen at 2048).
+    llm_speculative: Any = Field(default_factory=dict, alias="LLM_SPECULATIVE")
+    llm_spec_tokens: int = Field(10, alias="LLM_SPEC_TOKENS")  # drafted tokens per step
+    llm_spec_ngram: int = Field(3, alias="LLM_SPEC_NGRAM")  # lookup: longest n-gram matched
+    llm_draft_model: str = Field("base", alias="LLM_DRAFT_MODEL")  # MODEL_FILES entry; quant via LLM_QUANTS
+    # KV state of the static prompt prefixes, restored instead of re-evaluated on every call
+    llm_prefix_cache: bool = Field(True, alias="LLM_PREFIX_CACHE")
+    llm_prefix_cache_entries: int = Field(16, alias="LLM_PREFIX_CACHE_ENTRIES")  # in memory, all models
+    llm_prefix_cache_dir: str = Field("", alias="LLM_PREFIX_CACHE_DIR")  # empty = memory only
+    # Model hosts: one process per model serves every worker over a Unix socket in this dir
+    # (`python -m app.llm_models.host`); empty = each process loads the models it uses.
+    # Every slot is a context (KV cache) over shared weights; size LLM_THREADS for all slots.
+    llm_host_dir: str = Field("", alias="LLM_HOST_DIR")
+    llm_host_slots: int = Field(1, alias="LLM_HOST_SLOTS")  # concurrent requests per model
+    # Identical concurrent LLM calls (same model, prompt and sampling parameters) share one generation
+    llm_coalesce: bool = Field(True, alias="LLM_COALESCE")
+    # Cassettes (app/llm_models/cassette.py): LLM_CASSETTE_MODE=record appends every LLM call
+    # (prompt, output chunks, time to first token, per-token gaps) to LLM_CASSETTE; replay with
+    # ENVIRONMENT=local serves those outputs at the recorded pace times LLM_REPLAY_LOAD_FACTOR
+    llm_cassette: str = Field("", alias="LLM_CASSETTE")
+    llm_cassette_mode: str = Field("", alias="LLM_CASSETTE_MODE")  # "" | record | replay
+    llm_replay_load_factor: float = Field(1.0, alias="LLM_REPLAY_LOAD_FACTOR")  # 2.0 = twice as slow
+    # Grammar-constrained sampling per stage: LLM_GRAMMAR=generator,compressor
+    # (Wokwi diagram JSON / IR scaffold, see app/llm_models/grammars.py)
+    llm_grammar: Any = Field(default_factory=list, alias="LLM_GRAMMAR")
+    # Stage-result cache: finished LLM stage outputs keyed by model file, rendered prompt, sampling
+    # parameters and (RAG stages) index generation; empty dir = off. /run {"bypass_cache": true} skips it.
+    stage_cache_dir: str = Field("", alias="STAGE_CACHE_DIR")
+    stage_cache_size_limit: int = Field(2**30, alias="STAGE_CACHE_SIZE_LIMIT")  # bytes; LRU eviction beyond
+
+    # RAG vector index: flat | ivf_flat | hnsw | cosine
+    rag_index_type: str = Field("flat", alias="RAG_INDEX_TYPE")
+    rag_ivf_nlist: int = Field(0, alias="RAG_IVF_NLIST")  # 0 = derive from node count
+    rag_ivf_nprobe: int = Field(8, alias="RAG_IVF_NPROBE")
+    rag_hnsw_m: int = Field(32, alias="RAG_HNSW_M")
+    rag_hnsw_ef_construction: int = Field(80, alias="RAG_HNSW_EF_CONSTRUCTION")
+    rag_hnsw_ef_search: int = Field(64, alias="RAG_HNSW_EF_SEARCH")
+    # Vector precision of the saved embeddings and the index: float32 | float16 | int8 | pq
+    rag_vector_precision: str = Field("float32", alias="RAG_VECTOR_PRECISION")
+    rag_pq_m: int = Field(48, alias="RAG_PQ_M")  # PQ sub-quantizers (bytes per vector); must divide 384
+    # Re-score PQ hits from the saved float16 vectors so scores stay exact
+    rag_rescore: bool = Field(True, alias="RAG_RESCORE")
+
+    # RAG encoder backend: torch | onnx (needs optimum[onnxruntime]; see app/rag/encoder.py)
+    rag_embed_backend: str = Field("torch", alias="RAG_EMBED_BACKEND")
+    rag_embed_model_dir: str = Field("", alias="RAG_EMBED_MODEL_DIR")  # exported model, onnx only
+    rag_embed_onnx_file: str = Field("onnx/model.onnx", alias="RAG_EMBED_ONNX_FILE")
+    rag_embed_threads: int = Field(0, alias="RAG_EMBED_THREADS")  # intra-op threads; 0 = from the budget
+    rag_embed_batch_size: int = Field(128, alias="RAG_EMBED_BATCH_SIZE")
+
+    # Query-embedding cache: per-process LRU plus an optional host-wide disk tier
+    rag_embed_cache_size: int = Field(2048, alias="RAG_EMBED_CACHE_SIZE")
+    rag_embed_cache_dir: str = Field("", alias="RAG_EMBED_CACHE_DIR")  # empty = memory only
+    rag_embed_cache_disk_limit: int = Field(2**30, alias="RAG_EMBED_CACHE_DISK_LIMIT")
+
+    # Ingested chunks land in delta segments; compact once this many pile up
+    rag_compact_segments: int = Field(32, alias="RAG_COMPACT_SEGMENTS")
+    # Seconds between checks of the store generation written by other processes
+    rag_reload_interval: float = Field(1.0, alias="RAG_RELOAD_INTERVAL")
+
+    @field_validator("models", "llm_grammar", mode="before")
     def split_models(cls, v):
         if isinstance(v, str):
             return [m.strip() for m in v.split(",") if m.strip()]
         return v
 
+    @field_validator("llm_quants", "llm_speculative", mode="before")
+    def split_pairs(cls, v):
+        if isinstance(v, str):
+            pairs = (item.split(":", 1) for item in v.split(",") if ":" in item)
+            return {name.strip(): quant.strip() for name, quant in pairs}
+        return v
+
 
 settings = Settings()
 print(settings)
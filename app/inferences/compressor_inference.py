@@ -1,12 +1,14 @@
-from app.llm_models.shared_llms import compressor_llm_2048
+from app.llm_models.grammars import grammar_for, record_output
+from app.llm_models.prefix_cache import system_prefix
+from app.llm_models.shared_llms import compressor_llm_2048, stage_call
 
+MAX_TOKENS = 1024
 
+# The user prompt and the code are sent once, in the user message.
 COMPRESSOR_PROMPT = (
     "You are an **experienced Arduino Systems Engineer**.\n"
-    "Given:\n"
-    "  • User prompt: {user_prompt}\n"
-    "  • Arduino code:\n{code}\n\n"
-    "Generate a **compressed hardware spec** in *Wokwi* nomenclature using **_exactly_** "
+    "Given the user prompt and the Arduino code in the user message, "
+    "generate a **compressed hardware spec** in *Wokwi* nomenclature using **_exactly_** "
     "this scaffold (do not add / remove headers or blank lines):\n"
     "<<=components=>>\n"
     "<<=connections=>>\n"
@@ -19,11 +21,8 @@ COMPRESSOR_PROMPT = (
 )
 COMPRESSOR_PROMPT_WITH_CONTEXT = (
     "You are an **experienced Arduino Systems Engineer**.\n"
-    "Given:\n"
-    "  • User prompt: {user_prompt}\n"
-    "  • Arduino code:\n{code}\n\n"
-    "**Only refer to this if directly relevant. Ignore it otherwise.**\n\n"
-    "Generate a **compressed hardware spec** in *Wokwi* nomenclature using **_exactly_** "
+    "Given the user prompt and the Arduino code in the user message, "
+    "generate a **compressed hardware spec** in *Wokwi* nomenclature using **_exactly_** "
     "this scaffold (do not add / remove headers or blank lines):\n"
     "<<=components=>>\n"
     "<<=connections=>>\n"
@@ -33,38 +32,45 @@ COMPRESSOR_PROMPT_WITH_CONTEXT = (
     "• **attrs** - optional key-value extras, one per line as `<id> <key>:<value>`\n"
     "Capture every pin / wiring detail needed to reproduce the circuit, "
     "omit text that is not required for the diagram.\n "
+    "**Only refer to the reference context if directly relevant. Ignore it otherwise.**\n\n"
     "**REFERENCE CONTEXT (Optional):**"
     "If relevant, you may refer to the following example for inspiration. However, do NOT copy it or include any of its logic unless it directly applies to the user request:"
     "<<< {context} >>>"
 )
+COMPRESSOR_USER_BLOCK = "User prompt: {user_prompt}\n\nArduino code:\n{code}"
 
 
-def compress_to_ir_stream(llm, prompt: str, code: str, context: str):
-    if context != "":
-        message = COMPRESSOR_PROMPT_WITH_CONTEXT.format(
-            user_prompt=prompt, code=code, context=context
-        ).strip()
-    else:
-        message = COMPRESSOR_PROMPT.format(
-            user_prompt=prompt,
-            code=code,
-        ).strip()
+def compress_to_ir_stream(llm, prompt: str, code: str, context: str, cache_scope: str = ""):
+    template = COMPRESSOR_PROMPT_WITH_CONTEXT if context != "" else COMPRESSOR_PROMPT
+    message = template.format(context=context).strip()
 
-    user_block = f"{prompt}\n\n{code}"
+    user_block = COMPRESSOR_USER_BLOCK.format(user_prompt=prompt, code=code)
     chat_input = (
         f"<|im_start|>system\n{message}\n<|im_end|>\n"
         f"<|im_start|>user\n{user_block}\n<|im_end|>\n"
         f"<|im_start|>assistant\n"
     )
 
-    for chunk in llm(prompt=chat_input, max_tokens=1024, stream=True):
+    for chunk in stage_call(
+        llm,
+        chat_input,
+        scope=cache_scope,
+        until="ir",
+        prefix=system_prefix(template),
+        max_tokens=MAX_TOKENS,
+        stop=["<|im_end|>"],
+        grammar=grammar_for("compressor"),
+        stream=True,
+    ):
         yield chunk.get("choices", [{}])[0].get("text", "")
 
 
-def generate(user_prompt: str, code: str, context: str):
-    output = ""
+def generate(user_prompt: str, code: str, context: str, cache_scope: str = ""):
+    pieces = []
     yield {"stage": "ir_start"}
-    for token in compress_to_ir_stream(compressor_llm_2048, user_prompt, code, context):
+    for token in compress_to_ir_stream(compressor_llm_2048, user_prompt, code, context, cache_scope):
         yield {"stage": "ir_progress", "token": token}
-        output += token
+        pieces.append(token)
+    output = "".join(pieces)
+    record_output("compressor", output, len(pieces), MAX_TOKENS)
     yield {"stage": "ir_done", "ir": output}
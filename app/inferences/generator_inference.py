@@ -1,5 +1,8 @@
-from app.llm_models.shared_llms import generator_llm_2048
+from app.llm_models.grammars import grammar_for, record_output
+from app.llm_models.prefix_cache import system_prefix
+from app.llm_models.shared_llms import generator_llm_2048, stage_call
 
+MAX_TOKENS = 1024
 
 EXAMPLE_JSON = (
     '{"parts":[{"id":"esp","type":"wokwi-esp8266"},'
@@ -38,7 +41,7 @@ GENERATOR_PROMPT_WITH_CONTEXT = (
     "<<< {context} >>>\n"
 )
 
-def generate_json_stream(llm, specification: str, context: str):
+def generate_json_stream(llm, specification: str, context: str, cache_scope: str = ""):
     # if context != "":
     #     message = GENERATOR_PROMPT_WITH_CONTEXT.format(
     #         specification=specification, context=context
@@ -49,14 +52,26 @@ def generate_json_stream(llm, specification: str, context: str):
     print(message)
     chat_input = f"<|im_start|>system\n{message}\n<|im_end|>\n<|im_start|>assistant\n"
 
-    for chunk in llm(prompt=chat_input, max_tokens=1024, stream=True):
+    for chunk in stage_call(
+        llm,
+        chat_input,
+        scope=cache_scope,
+        until="json",
+        prefix=system_prefix(GENERATOR_PROMPT),
+        max_tokens=MAX_TOKENS,
+        stop=["<|im_end|>"],
+        grammar=grammar_for("generator"),
+        stream=True,
+    ):
         yield chunk.get("choices", [{}])[0].get("text", "")
 
 
-def generate(ir: str, context: str):
-    output = ""
+def generate(ir: str, context: str, cache_scope: str = ""):
+    pieces = []
     yield {"stage": "json_start"}
-    for token in generate_json_stream(generator_llm_2048, ir, context):
+    for token in generate_json_stream(generator_llm_2048, ir, context, cache_scope):
         yield {"stage": "json_progress", "token": token}
-        output += token
+        pieces.append(token)
+    output = "".join(pieces)
+    record_output("generator", output, len(pieces), MAX_TOKENS)
     yield {"stage": "json_done", "output": output}
@@ -0,0 +1,84 @@
+import argparse
+import multiprocessing
+import time
+from typing import Dict
+
+from app.llm_models.bench_quant import STOP, chat_inputs
+from app.llm_models.grammars import GRAMMARS, PARSERS
+
+# ===========================================
+# Grammar-constrained vs free decoding on the structured stages.
+#
+#   python -m app.llm_models.bench_grammar --models compressor,generator --max-tokens 1024
+#
+# Each (model, mode) runs the bench_quant inputs of that stage greedily in a
+# fresh process. Reported:
+#   tokens     output tokens per input
+#   saved      output tokens per input saved against the free run
+#   cut        inputs that ran to --max-tokens
+#   gen_tok/s  output tokens after the first / time from first to last token
+#   seconds    wall time per input
+#   parse      share of outputs that pass the stage's parse check
+# ===========================================
+MODES = ("free", "grammar")
+
+
+def run_case(name: str, mode: str, max_tokens: int) -> Dict:
+    from llama_cpp import LlamaGrammar
+
+    from app.llm_models.shared_llms import load_model
+
+    llm = load_model(name)
+    grammar = LlamaGrammar.from_string(GRAMMARS[name], verbose=False) if mode == "grammar" else None
+    inputs = chat_inputs(name)
+    tokens = cut = parsed = 0
+    gen_tokens, gen_s, wall = 0, 0.0, 0.0
+    for chat_input in inputs:
+        llm.reset()
+        pieces = []
+        t0 = time.perf_counter()
+        first = finish = None
+        for chunk in llm(chat_input, max_tokens=max_tokens, stop=STOP, grammar=grammar, stream=True, temperature=0.0):
+            if first is None:
+                first = time.perf_counter()
+            pieces.append(chunk["choices"][0]["text"])
+            finish = chunk["choices"][0].get("finish_reason") or finish
+        end = time.perf_counter()
+        first = first or end
+        wall += end - t0
+        gen_s += end - first
+        gen_tokens += max(0, len(pieces) - 1)
+        tokens += len(pieces)
+        cut += finish == "length"
+        parsed += PARSERS[name]("".join(pieces))
+
+    return {
+        "tokens": tokens / len(inputs),
+        "cut": cut,
+        "gen_tps": gen_tokens / gen_s if gen_s else 0.0,
+        "seconds": wall / len(inputs),
+        "parse_rate": parsed / len(inputs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grammar-constrained decoding on the structured stages.")
+    parser.add_argument("--models", default=",".join(GRAMMARS), help=f"Subset of {', '.join(GRAMMARS)}.")
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    args = parser.parse_args()
+
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{'model':>10} {'mode':>7} {'tokens':>7} {'saved':>7} {'cut':>4} {'gen_tok/s':>9} "
+          f"{'seconds':>8} {'parse':>6}")
+    for name in (m.strip() for m in args.models.split(",") if m.strip()):
+        free = None
+        for mode in MODES:
+            with spawn.Pool(1) as worker:
+                row = worker.apply(run_case, (name, mode, args.max_tokens))
+            free = free or row
+            print(f"{name:>10} {mode:>7} {row['tokens']:>7.1f} {free['tokens'] - row['tokens']:>7.1f} "
+                  f"{row['cut']:>4} {row['gen_tps']:>9.2f} {row['seconds']:>8.2f} {row['parse_rate']:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
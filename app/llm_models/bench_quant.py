@@ -0,0 +1,139 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+from typing import Dict, List
+
+from app.llm_models.grammars import is_ir, is_wokwi_json
+from app.llm_models.shared_llms import MODEL_FILES, load_llama, model_path
+from app.llm_models.simulated_llms import SIMULATED_RESPONSES
+from app.services.baseline_service import SYSTEM_PROMPT, strip_assistant_output
+from app.services.chained_service import (
+    CODER_PROMPT,
+    COMPRESSOR_PROMPT,
+    COMPRESSOR_USER_BLOCK,
+    GENERATOR_PROMPT,
+)
+
+# ===========================================
+# Throughput / quality benchmark for GGUF quantizations.
+#
+#   python -m app.llm_models.bench_quant --models baseline,generator --quants F32,Q8_0,Q4_K_M
+#
+# Every (model, quantization) pair runs the same fixed inputs greedily in a
+# fresh process, so peak RSS belongs to that model alone. Reported:
+#   prompt_tok/s  prompt tokens / time to first token
+#   gen_tok/s     tokens after the first / time from first to last token
+#   peak_MiB      max RSS of the process (weights + KV cache + runtime)
+#   parse         share of outputs that pass the stage's parse check
+# ===========================================
+PROMPTS = [
+    "Blink an LED on pin 13 of an Arduino Uno every second.",
+    "Read a DHT22 on an ESP32 and print temperature and humidity every 2 seconds.",
+    "Turn on a buzzer when an HC-SR04 ultrasonic sensor sees something closer than 20 cm.",
+    "Show the value of a potentiometer on a 16x2 I2C LCD connected to an Arduino Uno.",
+    "Sweep a servo from 0 to 180 degrees when a push button is pressed.",
+]
+SPECS = [
+    SIMULATED_RESPONSES["compressor"],
+    "<<=components=>>\nuno:wokwi-arduino-uno\nled1:wokwi-led\nr1:wokwi-resistor\n"
+    "<<=connections=>>\nuno:13 r1:1\nr1:2 led1:A\nled1:C uno:GND.1\n<<=attrs=>>\nr1 value:220",
+]
+STOP = ["<|im_end|>"]
+
+
+def _system(message: str) -> str:
+    return f"<|im_start|>system\n{message.strip()}\n<|im_end|>\n<|im_start|>assistant\n"
+
+
+def chat_inputs(name: str) -> List[str]:
+    """The fixed inputs of a model, built with the prompts its pipeline uses."""
+    if name == "coder":
+        return [_system(CODER_PROMPT.format(user_prompt=p)) for p in PROMPTS]
+    if name == "compressor":
+        code = SIMULATED_RESPONSES["coder"]
+        return [
+            f"<|im_start|>system\n{COMPRESSOR_PROMPT.strip()}\n<|im_end|>\n"
+            f"<|im_start|>user\n{COMPRESSOR_USER_BLOCK.format(user_prompt=p, code=code)}\n<|im_end|>\n"
+            f"<|im_start|>assistant\n"
+            for p in PROMPTS
+        ]
+    if name == "generator":
+        return [_system(GENERATOR_PROMPT.format(specification=spec)) for spec in SPECS]
+    return [_system(SYSTEM_PROMPT.format(user_prompt=p)) for p in PROMPTS]
+
+
+def parses(name: str, text: str) -> bool:
+    if name == "coder":
+        return "setup(" in text and "loop(" in text
+    if name == "compressor":
+        return is_ir(text)
+    if name == "generator":
+        return is_wokwi_json(text.strip())
+    code, diagram = strip_assistant_output(text)
+    return bool(code) and is_wokwi_json(diagram)
+
+
+def run_case(name: str, quant: str, max_tokens: int, threads: int) -> Dict:
+    """Runs in a child process; returns the aggregated timings of every input."""
+    start = time.perf_counter()
+    llm = load_llama(model_path(name, quant), **({"n_threads": threads} if threads else {}))
+    load_s = time.perf_counter() - start
+
+    prompt_tokens = gen_tokens = parsed = 0
+    prompt_s = gen_s = 0.0
+    inputs = chat_inputs(name)
+    for chat_input in inputs:
+        llm.reset()  # no KV reuse between inputs, so every prompt is evaluated in full
+        prompt_tokens += len(llm.tokenize(chat_input.encode("utf-8")))
+        pieces = []
+        t0 = time.perf_counter()
+        first = None
+        for chunk in llm(chat_input, max_tokens=max_tokens, stop=STOP, stream=True, temperature=0.0):
+            if first is None:
+                first = time.perf_counter()
+            pieces.append(chunk["choices"][0]["text"])
+        end = time.perf_counter()
+        first = first or end
+        prompt_s += first - t0
+        gen_s += end - first
+        gen_tokens += max(0, len(pieces) - 1)
+        parsed += parses(name, "".join(pieces))
+
+    return {
+        "load_s": load_s,
+        "prompt_tps": prompt_tokens / prompt_s if prompt_s else 0.0,
+        "gen_tps": gen_tokens / gen_s if gen_s else 0.0,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "parse_rate": parsed / len(inputs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GGUF quantizations of the pipeline models.")
+    parser.add_argument("--models", default="baseline,generator",
+                        help=f"Comma-separated subset of {', '.join(MODEL_FILES)}.")
+    parser.add_argument("--quants", default="F32,Q8_0,Q4_K_M")
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    parser.add_argument("--threads", type=int, default=0, help="llama.cpp threads; 0 = its default.")
+    args = parser.parse_args()
+
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{'model':>10} {'quant':>7} {'file_MiB':>9} {'load_s':>7} {'prompt_tok/s':>12} "
+          f"{'gen_tok/s':>9} {'peak_MiB':>9} {'parse':>6}")
+    for name in (m.strip() for m in args.models.split(",") if m.strip()):
+        for quant in (q.strip() for q in args.quants.split(",") if q.strip()):
+            path = model_path(name, quant)
+            if not os.path.exists(path):
+                print(f"{name:>10} {quant:>7}  missing {path}")
+                continue
+            with spawn.Pool(1) as worker:
+                row = worker.apply(run_case, (name, quant, args.max_tokens, args.threads))
+            print(f"{name:>10} {quant:>7} {os.path.getsize(path) / 2**20:>9.0f} {row['load_s']:>7.2f} "
+                  f"{row['prompt_tps']:>12.1f} {row['gen_tps']:>9.2f} {row['peak_rss'] / 2**20:>9.0f} "
+                  f"{row['parse_rate']:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
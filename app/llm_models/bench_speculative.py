@@ -0,0 +1,77 @@
+import argparse
+import multiprocessing
+import time
+from typing import Dict
+
+from app.llm_models.bench_quant import STOP, chat_inputs
+
+# ===========================================
+# Speculative decoding vs plain decoding on the chained stages.
+#
+#   python -m app.llm_models.bench_speculative --models compressor,generator --modes off,lookup,draft
+#
+# Each (model, mode) runs the bench_quant inputs of that stage greedily in a
+# fresh process. Reported:
+#   gen_tok/s  output tokens after the first / time from first to last token
+#   ttft_s     time to first token (prompt eval; draft needs logits_all, which
+#              makes it slower)
+#   accept     accepted / proposed draft tokens
+#   tok/step   output tokens per target decode step (1.0 = no speed-up)
+#   same       share of outputs identical to the first mode's (list `off` first)
+# ===========================================
+
+
+def run_case(name: str, mode: str, max_tokens: int) -> Dict:
+    from app.llm_models.shared_llms import load_model
+    from app.llm_models.speculative import speculative_stats
+
+    llm = load_model(name, speculative="" if mode == "off" else mode)
+    outputs, gen_tokens, ttft, gen_s = [], 0, 0.0, 0.0
+    for chat_input in chat_inputs(name):
+        llm.reset()
+        pieces = []
+        t0 = time.perf_counter()
+        first = None
+        for chunk in llm(chat_input, max_tokens=max_tokens, stop=STOP, stream=True, temperature=0.0):
+            if first is None:
+                first = time.perf_counter()
+            pieces.append(chunk["choices"][0]["text"])
+        end = time.perf_counter()
+        first = first or end
+        ttft += first - t0
+        gen_s += end - first
+        gen_tokens += max(0, len(pieces) - 1)
+        outputs.append("".join(pieces))
+
+    stats = speculative_stats().get(name, {"calls": 0, "proposed": 0, "accepted": 0})
+    return {
+        "outputs": outputs,
+        "gen_tps": gen_tokens / gen_s if gen_s else 0.0,
+        "ttft": ttft / len(outputs),
+        "accept": stats["accepted"] / stats["proposed"] if stats["proposed"] else 0.0,
+        "per_step": (gen_tokens + len(outputs)) / stats["calls"] if stats["calls"] else 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speculative decoding on the chained stages.")
+    parser.add_argument("--models", default="coder,compressor,generator")
+    parser.add_argument("--modes", default="off,lookup,draft", help="Subset of off, lookup, draft.")
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    args = parser.parse_args()
+
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{'model':>10} {'mode':>7} {'gen_tok/s':>9} {'ttft_s':>7} {'accept':>7} {'tok/step':>8} {'same':>5}")
+    for name in (m.strip() for m in args.models.split(",") if m.strip()):
+        plain = None
+        for mode in (m.strip() for m in args.modes.split(",") if m.strip()):
+            with spawn.Pool(1) as worker:
+                row = worker.apply(run_case, (name, mode, args.max_tokens))
+            plain = plain or row["outputs"]
+            same = sum(a == b for a, b in zip(row["outputs"], plain)) / len(plain)
+            print(f"{name:>10} {mode:>7} {row['gen_tps']:>9.2f} {row['ttft']:>7.2f} {row['accept']:>7.2f} "
+                  f"{row['per_step']:>8.2f} {same:>5.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+# ======================
+# Cassettes
+# A cassette is a JSON-lines file with one record per model call:
+#   {"model", "prompt", "params", "stream", "ttft", "gaps", "chunks", "finish_reason"}
+# ttft is the time from the call to the first chunk, gaps the time between
+# consecutive chunks (seconds), chunks the streamed texts (~ one token each).
+# Recording appends from every worker; replay serves the recorded outputs
+# with the recorded timing so ENVIRONMENT=local load tests queue and scale
+# like the real models.
+# ======================
+RECORDED_PARAMS = ("max_tokens", "temperature", "top_p", "top_k", "stop", "seed")
+
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            # One O_APPEND write per record keeps lines from different workers whole.
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, line.encode("utf-8"))
+            finally:
+                os.close(fd)
+
+    def records(self) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def _completion(name: str, text: str, finish_reason: str, n_chunks: int) -> Dict:
+    return {
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": name,
+        "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}],
+        "usage": {"completion_tokens": n_chunks},
+    }
+
+
+class RecordingLlama:
+    """Wraps a model proxy and appends every completed call to a cassette.
+
+    Non-streamed calls are run streamed so per-token timing can be taken;
+    the result is assembled into the usual completion dict (its usage only
+    counts completion tokens). A stream closed early (e.g. by early stopping
+    at the end of its artifact) is recorded with the chunks produced so far
+    and finish_reason "stop".
+    """
+
+    def __init__(self, llm, name: str, cassette: Cassette):
+        self.llm = llm
+        self.name = name
+        self.cassette = cassette
+
+    def __call__(self, prompt: str = "", *args, **kwargs):
+        prompt = kwargs.pop("prompt", prompt)
+        stream = bool(kwargs.pop("stream", False))
+        chunks = self._record(prompt, stream, args, kwargs)
+        if stream:
+            return chunks
+        pieces, finish_reason = [], None
+        for chunk in chunks:
+            pieces.append(chunk["choices"][0]["text"])
+            finish_reason = chunk["choices"][0].get("finish_reason") or finish_reason
+        return _completion(self.name, "".join(pieces), finish_reason, len(pieces))
+
+    def _record(self, prompt: str, stream: bool, args, kwargs) -> Iterator:
+        start = last = time.perf_counter()
+        ttft, gaps, texts, finish_reason = None, [], [], None
+        chunks = self.llm(prompt, *args, stream=True, **kwargs)
+        try:
+            for chunk in chunks:
+                now = time.perf_counter()
+                if ttft is None:
+                    ttft = now - start
+                else:
+                    gaps.append(now - last)
+                last = now
+                texts.append(chunk["choices"][0]["text"])
+                finish_reason = chunk["choices"][0].get("finish_reason") or finish_reason
+                yield chunk
+        except GeneratorExit:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            if texts:
+                self._append(prompt, stream, kwargs, ttft, gaps, texts, "stop")
+            raise
+        self._append(prompt, stream, kwargs, ttft if ttft is not None else last - start, gaps, texts, finish_reason)
+
+    def _append(self, prompt: str, stream: bool, kwargs, ttft: float, gaps, texts, finish_reason):
+        self.cassette.append({
+            "model": self.name,
+            "prompt": prompt,
+            "params": {key: kwargs[key] for key in RECORDED_PARAMS if key in kwargs},
+            "stream": stream,
+            "ttft": ttft,
+            "gaps": gaps,
+            "chunks": texts,
+            "finish_reason": finish_reason,
+        })
+
+    def __getattr__(self, attr: str):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return getattr(self.llm, attr)
+
+    def __repr__(self) -> str:
+        return f"RecordingLlama({self.llm!r})"
+
+
+class ReplayLlama:
+    """Stands in for model ``name``, replaying its calls from a cassette.
+
+    A prompt that was recorded replays its own recordings in turn; any other
+    prompt replays one of the model's recordings chosen by prompt hash, so
+    load tests with new prompts still follow the recorded output lengths
+    and timing. Every delay is multiplied by ``load_factor``.
+    """
+
+    def __init__(self, name: str, records: List[Dict], load_factor: float = 1.0):
+        self.model_name = name
+        self.load_factor = load_factor
+        self._records = records
+        self._by_prompt: Dict[str, List[Dict]] = defaultdict(list)
+        for record in records:
+            self._by_prompt[record["prompt"]].append(record)
+        self._turns: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _pick(self, prompt: str) -> Dict:
+        matches = self._by_prompt.get(prompt)
+        if not matches:
+            return self._records[zlib.crc32(prompt.encode("utf-8")) % len(self._records)]
+        with self._lock:
+            turn = self._turns[prompt]
+            self._turns[prompt] += 1
+        return matches[turn % len(matches)]
+
+    def __call__(self, prompt: str, max_tokens=1024, stream=False, stop=None, grammar=None, **kwargs):
+        record = self._pick(prompt)
+        chunks = record["chunks"][:max_tokens] if max_tokens else record["chunks"]
+        if stream:
+            return self._stream(record, chunks)
+        time.sleep((record["ttft"] + sum(record["gaps"][: max(0, len(chunks) - 1)])) * self.load_factor)
+        return _completion(self.model_name, "".join(chunks), record["finish_reason"], len(chunks))
+
+    def _stream(self, record: Dict, chunks: List[str]) -> Iterator:
+        delays = [record["ttft"]] + record["gaps"]
+        for i, text in enumerate(chunks):
+            time.sleep(delays[i] * self.load_factor if i < len(delays) else 0.0)
+            finish_reason = record["finish_reason"] if i == len(chunks) - 1 else None
+            yield {"choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}]}
+
+
+def replay_models(path: str, load_factor: float = 1.0) -> Dict[str, ReplayLlama]:
+    """A ``ReplayLlama`` for every model that has records in the cassette at ``path``."""
+    by_model: Dict[str, List[Dict]] = defaultdict(list)
+    for record in Cassette(path).records():
+        by_model[record["model"]].append(record)
+    return {name: ReplayLlama(name, records, load_factor) for name, records in by_model.items()}
+
+
+# ======================
+# Summary
+#
+#   python -m app.llm_models.cassette cassettes/prod.jsonl
+#
+# Per model: calls, output tokens per call and the timing distributions a
+# replay reproduces.
+# ======================
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the calls recorded in a cassette.")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    by_model: Dict[str, List[Dict]] = defaultdict(list)
+    for record in Cassette(args.path).records():
+        by_model[record["model"]].append(record)
+    print(f"{'model':>10} {'calls':>6} {'tokens':>7} {'ttft_p50':>8} {'ttft_p95':>8} "
+          f"{'tok/s_p50':>9} {'total_p95':>9}")
+    for name, records in sorted(by_model.items()):
+        ttft = [r["ttft"] for r in records]
+        total = [r["ttft"] + sum(r["gaps"]) for r in records]
+        rates = [len(r["gaps"]) / sum(r["gaps"]) for r in records if sum(r["gaps"]) > 0]
+        tokens = np.mean([len(r["chunks"]) for r in records])
+        print(f"{name:>10} {len(records):>6} {tokens:>7.1f} {np.percentile(ttft, 50):>8.2f} "
+              f"{np.percentile(ttft, 95):>8.2f} {np.percentile(rates, 50) if rates else 0.0:>9.1f} "
+              f"{np.percentile(total, 95):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import pickle
+import threading
+from typing import Any, Callable, Dict, Iterator, List
+
+COUNTERS = ("calls", "coalesced", "coalesced_streams")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        # Streams: chunks produced so far, read by every attached caller.
+        self.source: Iterator = None
+        self.chunks: List[Any] = []
+        self.readers = 0
+        self.fetch_lock = threading.Lock()
+
+
+class Coalescer:
+    """Single-flight for model calls: identical concurrent calls share one generation.
+
+    Calls are identical when model name, arguments, keyword arguments and
+    prefix pickle to the same bytes (calls that do not pickle run alone). A
+    call arriving while an identical one runs waits for that result; a
+    streamed one replays the chunks produced so far and then follows the
+    live ones. Flights end with their generation, so nothing is cached. A
+    shared stream stops generating once every reader has closed it.
+    Results and chunks are shared between the callers: read them, don't
+    modify them.
+    """
+
+    def __init__(self):
+        self._flights: Dict[bytes, _Flight] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def call(self, name: str, request, run: Callable[[], Any], stream: bool = False):
+        try:
+            key = pickle.dumps((name, request))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            key = None
+        with self._lock:
+            stats = self._stats.setdefault(name, dict.fromkeys(COUNTERS, 0))
+            stats["calls"] += 1
+            if key is None:
+                flight, leader = None, True
+            elif key in self._flights:
+                flight, leader = self._flights[key], False
+                stats["coalesced"] += 1
+                stats["coalesced_streams"] += bool(stream)
+            else:
+                flight, leader = _Flight(), True
+                self._flights[key] = flight
+            if flight is not None and stream:
+                if leader:
+                    try:
+                        flight.source = iter(run())  # streams start on the first next()
+                    except BaseException:
+                        del self._flights[key]
+                        raise
+                flight.readers += 1
+        if flight is None:
+            return run()
+        if stream:
+            return self._read(key, flight)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = run()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._end(key, flight)
+
+    def _end(self, key: bytes, flight: _Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.done.set()
+
+    def _read(self, key: bytes, flight: _Flight) -> Iterator:
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                    continue
+                with flight.fetch_lock:
+                    if position < len(flight.chunks):
+                        continue  # another reader fetched it meanwhile
+                    if flight.done.is_set():
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                    try:
+                        flight.chunks.append(next(flight.source))
+                    except StopIteration:
+                        self._end(key, flight)
+                        return
+                    except BaseException as e:
+                        flight.error = e
+                        self._end(key, flight)
+                        raise
+        finally:
+            with self._lock:
+                flight.readers -= 1
+                abandoned = not flight.readers and not flight.done.is_set()
+                if abandoned and self._flights.get(key) is flight:
+                    del self._flights[key]  # nobody can join a stream that is being closed
+            if abandoned:
+                with flight.fetch_lock:
+                    close = getattr(flight.source, "close", None)
+                    if close is not None:
+                        close()
+                flight.done.set()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
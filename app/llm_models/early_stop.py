@@ -0,0 +1,183 @@
+import threading
+from typing import Dict, Iterator, Optional
+
+# ======================
+# Early stopping
+# A watcher reads a stage's stream piece by piece and reports where its
+# artifact ends; the stream is closed right there, which stops decoding
+# (in this process, the pool or the model host) instead of running on to
+# max_tokens while the model rambles after the result:
+#   json - the first top-level object closes (bracket depth back to 0,
+#          brackets inside strings ignored; text before the first { is not
+#          tracked, so prose like "[JSON]:" cannot open the artifact)
+#   ir   - the <<=attrs=>> section is followed by a blank line
+#   cpp  - a leading ``` fence is closed
+# Every watcher also ends at a literal <|im_end|> in the text.
+# ======================
+IM_END = "<|im_end|>"
+COUNTERS = ("calls", "early_stops", "tokens", "tokens_cut")
+
+
+class _Watcher:
+    """Incremental: each piece is scanned once, with a short tail of the previous ones for split markers."""
+
+    KEEP = 16  # longer than any marker
+
+    def __init__(self):
+        self.tail = ""
+        self.seen = 0  # characters fed so far
+
+    def feed(self, piece: str) -> Optional[int]:
+        """Offset in ``piece`` where the artifact ends (negative: in an earlier piece), or None."""
+        new = len(self.tail)
+        window = self.tail + piece
+        base = self.seen - new  # position of window[0] in the whole output
+        found = self._scan(window, base, new)
+        marker = window.find(IM_END)
+        if marker != -1 and (found is None or marker < found):
+            found = marker
+        self.seen += len(piece)
+        self.tail = window[-self.KEEP:]
+        return None if found is None else found - new
+
+    def _scan(self, window: str, base: int, new: int) -> Optional[int]:
+        """End of the artifact as an index into ``window`` (``window[new:]`` is the new piece)."""
+        return None
+
+
+class JsonWatcher(_Watcher):
+    def __init__(self):
+        super().__init__()
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def _scan(self, window: str, base: int, new: int) -> Optional[int]:
+        for i in range(new, len(window)):
+            char = window[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.depth:
+                self.in_string = True
+            elif char == "{" or (char == "[" and self.depth):
+                # The Wokwi diagram (and the generator grammar's root) is an object.
+                self.depth += 1
+            elif char in "}]" and self.depth:
+                self.depth -= 1
+                if not self.depth:
+                    return i + 1
+        return None
+
+
+class IrWatcher(_Watcher):
+    HEADER = "<<=attrs=>>"
+
+    def __init__(self):
+        super().__init__()
+        self.body = None  # where the attrs section starts in the whole output
+
+    def _scan(self, window: str, base: int, new: int) -> Optional[int]:
+        if self.body is None:
+            header = window.find(self.HEADER)
+            if header == -1:
+                return None
+            self.body = base + header + len(self.HEADER)
+        # The blank line may start with the header's own line break.
+        blank = window.find("\n\n", max(0, self.body - base))
+        # The artifact keeps its last line break; the blank line and what follows go.
+        return None if blank == -1 else blank + 1
+
+
+class CppWatcher(_Watcher):
+    FENCE = "```"
+
+    def __init__(self):
+        super().__init__()
+        self.lead = ""  # the output up to its first non-blank characters
+        self.fenced = None
+        self.opening = 0  # where the opening fence starts in the whole output
+        self.body = None  # where the line after it starts
+
+    def _scan(self, window: str, base: int, new: int) -> Optional[int]:
+        if self.fenced is None:
+            self.lead += window[new:]
+            stripped = self.lead.lstrip()
+            if len(stripped) < len(self.FENCE):
+                return None
+            self.fenced = stripped.startswith(self.FENCE)
+            self.opening = len(self.lead) - len(stripped)
+            self.lead = ""
+        if not self.fenced:
+            return None  # raw code: only <|im_end|> ends it
+        if self.body is None:
+            line_end = window.find("\n", max(0, self.opening - base))
+            if line_end == -1:
+                return None
+            self.body = base + line_end + 1
+        close = window.find("\n" + self.FENCE, max(0, self.body - 1 - base))
+        return None if close == -1 else close + 1 + len(self.FENCE)
+
+
+WATCHERS = {"json": JsonWatcher, "ir": IrWatcher, "cpp": CppWatcher}
+
+
+def _partial_marker(text: str) -> int:
+    """Length of the longest end of ``text`` that <|im_end|> starts with."""
+    for n in range(min(len(text), len(IM_END) - 1), 0, -1):
+        if IM_END.startswith(text[-n:]):
+            return n
+    return 0
+
+_stats: Dict[str, Dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def stop_when_complete(name: str, kind: str, stream: Iterator[Dict], max_tokens: int) -> Iterator[Dict]:
+    """Pass ``stream``'s chunks on until the ``kind`` artifact is complete, then close it.
+
+    The chunk holding the end is trimmed to it. Text that may be the start
+    of a split <|im_end|> is held back until the next chunk shows.
+    """
+    watcher = WATCHERS[kind]()
+    tokens, stopped, held = 0, False, ""
+    try:
+        for chunk in stream:
+            tokens += 1
+            choice = chunk["choices"][0]
+            end = watcher.feed(choice["text"])
+            text = held + choice["text"]
+            if end is not None:
+                stopped = True
+                text = text[: max(0, len(held) + end)]
+                if text:
+                    yield {**chunk, "choices": [{**choice, "text": text, "finish_reason": "stop"}]}
+                break
+            keep = 0 if choice.get("finish_reason") else _partial_marker(text)
+            text, held = text[: len(text) - keep], text[len(text) - keep:]
+            if text or choice.get("finish_reason"):
+                yield {**chunk, "choices": [{**choice, "text": text}]}
+        else:
+            if held:
+                yield {"choices": [{"text": held, "index": 0, "logprobs": None, "finish_reason": None}]}
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+        with _lock:
+            stats = _stats.setdefault(name, dict.fromkeys(COUNTERS, 0))
+            stats["calls"] += 1
+            stats["tokens"] += tokens
+            if stopped:
+                stats["early_stops"] += 1
+                stats["tokens_cut"] += max(0, (max_tokens or 0) - tokens)
+
+
+def early_stop_stats() -> Dict[str, Dict[str, int]]:
+    """Per-model streams stopped at the end of their artifact, and the max_tokens they left undecoded."""
+    with _lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
@@ -0,0 +1,119 @@
+import json
+import re
+import threading
+from typing import Dict
+
+from app.config import settings
+
+# ======================
+# Output grammars (GBNF)
+# llama.cpp masks every token that cannot extend a valid sentence, and once
+# the root rule is complete only end-of-generation is left to sample, so the
+# stage stops exactly at the end of the structure.
+# ======================
+WOKWI_JSON_GBNF = r"""
+root        ::= "{" ws "\"parts\"" ws ":" ws parts ws "," ws "\"connections\"" ws ":" ws connections ws "}"
+parts       ::= "[" ws ( part ( ws "," ws part )* )? ws "]"
+part        ::= "{" ws "\"id\"" ws ":" ws string ws "," ws "\"type\"" ws ":" ws string ( ws "," ws member )* ws "}"
+connections ::= "[" ws ( connection ( ws "," ws connection )* )? ws "]"
+connection  ::= "[" ws string ws "," ws string ws "," ws string ws "," ws path ws "]"
+path        ::= "[" ws ( string ( ws "," ws string )* )? ws "]"
+member      ::= string ws ":" ws value
+value       ::= object | array | string | number | "true" | "false" | "null"
+object      ::= "{" ws ( member ( ws "," ws member )* )? ws "}"
+array       ::= "[" ws ( value ( ws "," ws value )* )? ws "]"
+string      ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" [0-9a-fA-F]{4} ) )* "\""
+number      ::= "-"? ( "0" | [1-9] [0-9]* ) ( "." [0-9]+ )? ( [eE] [-+]? [0-9]+ )?
+ws          ::= | " " | "\n" [ \t]{0,20}
+"""
+
+IR_GBNF = r"""
+root       ::= "<<=components=>>\n" component* "<<=connections=>>\n" connection* "<<=attrs=>>" ( "\n" attr )*
+component  ::= id ":" [a-z0-9-]+ "\n"
+connection ::= pin " " pin "\n"
+attr       ::= id " " [A-Za-z0-9_-]+ ":" [^\n]+
+pin        ::= id ":" [A-Za-z0-9_.+-]+
+id         ::= [A-Za-z0-9_-]+
+"""
+
+GRAMMARS = {"generator": WOKWI_JSON_GBNF, "compressor": IR_GBNF}
+COUNTERS = ("calls", "constrained", "completion_tokens", "truncated", "parsed")
+
+_IR_LINES = {
+    "<<=components=>>": re.compile(r"[\w-]+:[\w-]+"),
+    "<<=connections=>>": re.compile(r"[\w-]+:[\w.+-]+ [\w-]+:[\w.+-]+"),
+    "<<=attrs=>>": re.compile(r"[\w-]+ [\w-]+:.+"),
+}
+
+_grammars = {}
+_stats: Dict[str, Dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def _enabled(name: str) -> bool:
+    # The simulated models already emit valid output and take no grammar.
+    return name in settings.llm_grammar and name in GRAMMARS and settings.environment != "local"
+
+
+def grammar_for(name: str):
+    """The ``LlamaGrammar`` of stage ``name`` when LLM_GRAMMAR enables it, else None."""
+    if not _enabled(name):
+        return None
+    with _lock:
+        if name not in _grammars:
+            from llama_cpp import LlamaGrammar
+
+            _grammars[name] = LlamaGrammar.from_string(GRAMMARS[name], verbose=False)
+        return _grammars[name]
+
+
+# ======================
+# Parse checks
+# ======================
+def is_wokwi_json(text: str) -> bool:
+    try:
+        diagram = json.loads(text)
+    except ValueError:
+        return False
+    return (
+        isinstance(diagram, dict)
+        and isinstance(diagram.get("parts"), list)
+        and isinstance(diagram.get("connections"), list)
+    )
+
+
+def is_ir(text: str) -> bool:
+    """Headers in scaffold order, every line under them shaped like its section."""
+    section = None
+    headers = []
+    for line in text.strip().splitlines():
+        if line in _IR_LINES:
+            section = line
+            headers.append(line)
+        elif section is None or not _IR_LINES[section].fullmatch(line):
+            return False
+    return headers == list(_IR_LINES)
+
+
+PARSERS = {"generator": lambda text: is_wokwi_json(text.strip()), "compressor": is_ir}
+
+
+# ======================
+# Stats
+# ======================
+def record_output(name: str, text: str, completion_tokens: int, max_tokens: int):
+    """Count one finished stage output: its tokens, whether it hit ``max_tokens`` and whether it parses."""
+    parsed = PARSERS[name](text)
+    with _lock:
+        stats = _stats.setdefault(name, dict.fromkeys(COUNTERS, 0))
+        stats["calls"] += 1
+        stats["constrained"] += _enabled(name)
+        stats["completion_tokens"] += completion_tokens
+        stats["truncated"] += completion_tokens >= max_tokens
+        stats["parsed"] += parsed
+
+
+def output_stats() -> Dict[str, Dict[str, int]]:
+    """Per-stage output counters of this process."""
+    with _lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
@@ -0,0 +1,270 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, Iterator
+
+from app.config import settings
+from app.llm_models.speculative import speculative_stats
+
+# ======================
+# Model host
+# One long-lived process per model serves every worker on the machine over
+# a Unix socket in LLM_HOST_DIR, so worker count no longer multiplies model
+# RAM. Requests wait in FIFO order for one of LLM_HOST_SLOTS slots; a llama
+# slot is its own context (KV cache) over the same mmap'd weights, so slots
+# decode concurrently without another copy of the model. Messages are
+# pickled by multiprocessing.connection, one request per connection:
+#   client: ("call", (args, kwargs, prefix)) | ("attr", (name, args, kwargs)) | ("stats", None)
+#   host:   ("ok", value) | ("method", None) | ("chunk", chunk)... ("end", None) | ("error", exception)
+# ======================
+COUNTERS = ("requests", "streams", "errors", "waiting", "busy")
+
+
+def socket_path(host_dir: str, name: str) -> str:
+    return os.path.join(host_dir, f"{name}.sock")
+
+
+class ModelHost:
+    """Serves ``slots`` instances of one model to clients of ``HostedLlama``."""
+
+    def __init__(self, name: str, loader: Callable[[], Any], slots: int = 1, prefix_cache=None, coalescer=None):
+        self.name = name
+        self.slots = slots
+        self.prefix_cache = prefix_cache
+        self.coalescer = coalescer
+        self._free: "queue.Queue[Any]" = queue.Queue()
+        for _ in range(slots):
+            self._free.put(loader())
+        self._stats = dict.fromkeys(COUNTERS, 0)
+        self._stats["queue_seconds"] = 0.0
+        self._lock = threading.Lock()
+
+    def serve(self, path: str):
+        if os.path.exists(path):
+            os.unlink(path)  # left over from a host that did not shut down cleanly
+        with Listener(path, family="AF_UNIX") as listener:
+            os.chmod(path, 0o600)  # requests are pickles: only this user may connect
+            print(f"[INFO] Hosting model '{self.name}' ({self.slots} slots) on {path}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    # ======================
+    # Requests
+    # ======================
+    @contextmanager
+    def _slot(self):
+        start = time.perf_counter()
+        self._count("waiting", 1)
+        llm = self._free.get()
+        with self._lock:
+            self._stats["waiting"] -= 1
+            self._stats["busy"] += 1
+            self._stats["requests"] += 1
+            self._stats["queue_seconds"] += time.perf_counter() - start
+        try:
+            yield llm
+        finally:
+            self._free.put(llm)
+            self._count("busy", -1)
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                op, payload = conn.recv()
+                if op == "call":
+                    self._call(conn, *payload)
+                elif op == "attr":
+                    conn.send(self._attr(*payload))
+                elif op == "stats":
+                    conn.send(("ok", self.stats()))
+                else:
+                    raise ValueError(f"Unknown model host request '{op}'")
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                pass  # the client went away, e.g. a stream that was not read to the end
+            except Exception as e:
+                self._count("errors")
+                try:
+                    conn.send(("error", e))
+                except OSError:
+                    pass
+                except Exception:  # the exception does not pickle
+                    conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+
+    def _call(self, conn, args, kwargs, prefix: str):
+        stream = bool(kwargs.get("stream"))
+        run = partial(self._generate, args, kwargs, prefix)
+        if self.coalescer is not None:
+            # Identical requests from any worker share one generation and one slot.
+            result = self.coalescer.call(self.name, (args, kwargs, prefix), run, stream)
+        else:
+            result = run()
+        if not stream:
+            conn.send(("ok", result))
+            return
+        self._count("streams")
+        try:
+            for chunk in result:
+                conn.send(("chunk", chunk))
+        finally:
+            close = getattr(result, "close", None)
+            if close is not None:
+                close()  # stops generation when the client disconnected
+        conn.send(("end", None))
+
+    def _generate(self, args, kwargs, prefix: str):
+        if kwargs.get("stream"):
+            return self._stream(args, kwargs, prefix)
+        with self._slot() as llm:
+            self._prime(llm, prefix, args, kwargs)
+            return llm(*args, **kwargs)
+
+    def _stream(self, args, kwargs, prefix: str) -> Iterator:
+        # The slot is taken on the first next() and held until the stream ends or is closed.
+        with self._slot() as llm:
+            self._prime(llm, prefix, args, kwargs)
+            yield from llm(*args, **kwargs)
+
+    def _prime(self, llm, prefix: str, args, kwargs):
+        if self.prefix_cache is not None:
+            prompt = args[0] if args else kwargs.get("prompt", "")
+            self.prefix_cache.prime(self.name, llm, prefix, prompt)
+
+    def _attr(self, attr: str, args, kwargs):
+        with self._slot() as llm:
+            value = getattr(llm, attr)
+            if args is not None:
+                return "ok", value(*args, **kwargs)
+            return ("method", None) if callable(value) else ("ok", value)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            host = dict(self._stats, slots=self.slots)
+        prefill = self.prefix_cache.stats() if self.prefix_cache is not None else {}
+        coalesced = self.coalescer.stats() if self.coalescer is not None else {}
+        return {"host": host, "prefill": prefill, "speculative": speculative_stats(), "coalesced": coalesced}
+
+
+class HostedLlama:
+    """Callable stand-in for a ``Llama`` served by a ``ModelHost`` process.
+
+    Same calling convention as ``PooledLlama``: ``prefix=`` is primed by the
+    host's prefix cache, identical concurrent calls from any worker are
+    coalesced by the host, a streamed call connects on its first ``next()``
+    and closing the stream early stops generation on the host. Exceptions
+    raised by the model are re-raised here.
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+
+    def _connect(self):
+        try:
+            return Client(self.path, family="AF_UNIX")
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise ConnectionError(
+                f"No model host for '{self.name}' at {self.path}; start it with `python -m app.llm_models.host`"
+            ) from e
+
+    def _exchange(self, op: str, payload):
+        with self._connect() as conn:
+            conn.send((op, payload))
+            kind, value = conn.recv()
+        if kind == "error":
+            raise value
+        return kind, value
+
+    def _request(self, op: str, payload) -> Any:
+        return self._exchange(op, payload)[1]
+
+    def __call__(self, *args, prefix: str = "", **kwargs):
+        if kwargs.get("stream"):
+            return self._stream(prefix, args, kwargs)
+        return self._request("call", (args, kwargs, prefix))
+
+    def _stream(self, prefix: str, args, kwargs) -> Iterator:
+        with self._connect() as conn:
+            conn.send(("call", (args, kwargs, prefix)))
+            while True:
+                kind, value = conn.recv()
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+
+    def stats(self) -> Dict:
+        """Host-wide queue, prefix-cache and speculative counters of this model."""
+        return self._request("stats", None)
+
+    def __getattr__(self, attr: str):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        kind, value = self._exchange("attr", (attr, None, None))
+        if kind == "method":
+            return lambda *args, **kwargs: self._request("attr", (attr, args, kwargs))
+        return value
+
+    def __repr__(self) -> str:
+        return f"HostedLlama({self.name!r})"
+
+
+# ======================
+# Entry point
+#
+#   LLM_HOST_DIR=/run/swan-llm python -m app.llm_models.host --models coder,compressor,generator
+#
+# Workers and the API started with the same LLM_HOST_DIR use the hosts.
+# With ENVIRONMENT=local the hosts serve the simulated models.
+# ======================
+def serve_model(name: str, slots: int):
+    from app.llm_models.shared_llms import coalescer, model_loader, prefix_cache
+
+    host = ModelHost(name, model_loader(name), slots, prefix_cache, coalescer)
+    host.serve(socket_path(settings.llm_host_dir, name))
+
+
+def main():
+    from app.llm_models.shared_llms import MODEL_FILES
+
+    parser = argparse.ArgumentParser(description="Serve the pipeline models to every worker over Unix sockets.")
+    parser.add_argument("--models", default=",".join(MODEL_FILES),
+                        help=f"Comma-separated subset of {', '.join(MODEL_FILES)}.")
+    parser.add_argument("--slots", type=int, default=settings.llm_host_slots,
+                        help="Concurrent requests per model (one KV cache each).")
+    args = parser.parse_args()
+    if not settings.llm_host_dir:
+        parser.error("set LLM_HOST_DIR to the directory for the model sockets")
+    os.makedirs(settings.llm_host_dir, mode=0o700, exist_ok=True)
+
+    spawn = multiprocessing.get_context("spawn")
+    procs = [
+        spawn.Process(target=serve_model, args=(name, args.slots), name=f"llm-host-{name}")
+        for name in (m.strip() for m in args.models.split(",") if m.strip())
+    ]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import gc
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator
+
+import psutil
+
+
+@dataclass
+class _Entry:
+    name: str
+    loader: Callable[[], Any]
+    estimate_bytes: int
+    model: Any = None
+    loading: bool = False
+    in_use: int = 0
+    last_used: float = 0.0
+    loads: int = 0
+    evictions: int = 0
+    load_seconds: float = 0.0
+    resident_bytes: int = 0
+
+    @property
+    def size(self) -> int:
+        """Bytes charged against the budget: measured once loaded, estimated before."""
+        return max(self.estimate_bytes, self.resident_bytes)
+
+
+class ModelPool:
+    """Loads models on first use and keeps them within a RAM budget.
+
+    Models are registered with a loader and a size estimate (e.g. the GGUF
+    file size). ``acquire`` loads a model the first time it is asked for;
+    when the load would push the loaded set over ``budget_bytes``, idle
+    models (no ``acquire`` without a matching ``release``) are evicted least
+    recently used first. If only busy models are left it waits up to
+    ``wait_seconds`` for one to become idle. A budget of 0 means unlimited.
+    """
+
+    def __init__(self, budget_bytes: int = 0, wait_seconds: float = 30.0):
+        self.budget_bytes = budget_bytes
+        self.wait_seconds = wait_seconds
+        self._entries: Dict[str, _Entry] = {}
+        self._cond = threading.Condition()
+        # Loads run one at a time so each RSS delta belongs to a single model.
+        self._load_lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any], estimate_bytes: int = 0):
+        with self._cond:
+            self._entries[name] = _Entry(name, loader, estimate_bytes)
+
+    # ======================
+    # Budget
+    # ======================
+    def _charged(self) -> int:
+        return sum(e.size for e in self._entries.values() if e.model is not None or e.loading)
+
+    def _fits(self, entry: _Entry) -> bool:
+        return not self.budget_bytes or self._charged() + entry.size <= self.budget_bytes
+
+    def _evict(self, entry: _Entry):
+        model, entry.model = entry.model, None
+        entry.evictions += 1
+        close = getattr(model, "close", None)
+        if close is not None:
+            close()
+        del model
+        gc.collect()
+        print(f"[INFO] Evicted model '{entry.name}' from the pool")
+
+    def _make_room(self, entry: _Entry) -> bool:
+        """Evict idle models, least recently used first, until entry fits."""
+        idle = sorted(
+            (e for e in self._entries.values() if e.model is not None and not e.in_use and e is not entry),
+            key=lambda e: e.last_used,
+        )
+        for victim in idle:
+            if self._fits(entry):
+                break
+            self._evict(victim)
+        return self._fits(entry)
+
+    # ======================
+    # Acquire / Release
+    # ======================
+    def _load(self, entry: _Entry):
+        process = psutil.Process()
+        with self._load_lock:
+            rss_before = process.memory_info().rss
+            start = time.perf_counter()
+            model = entry.loader()
+            entry.load_seconds = time.perf_counter() - start
+            entry.resident_bytes = max(0, process.memory_info().rss - rss_before)
+        entry.loads += 1
+        print(f"[INFO] Loaded model '{entry.name}' in {entry.load_seconds:.2f}s "
+              f"(+{entry.resident_bytes / 2**20:.0f} MiB resident)")
+        return model
+
+    def acquire(self, name: str) -> Any:
+        """Return the loaded model, loading it (and evicting others) if needed."""
+        deadline = time.monotonic() + self.wait_seconds
+        with self._cond:
+            entry = self._entries[name]
+            while entry.model is None:
+                if entry.loading:
+                    self._cond.wait()
+                    continue
+                if self.budget_bytes and entry.size > self.budget_bytes:
+                    raise MemoryError(
+                        f"Model '{name}' needs ~{entry.size / 2**20:.0f} MiB, "
+                        f"more than the whole pool budget of {self.budget_bytes / 2**20:.0f} MiB"
+                    )
+                if self._make_room(entry):
+                    entry.loading = True
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    busy = [e.name for e in self._entries.values() if e.in_use]
+                    raise TimeoutError(f"No room to load model '{name}'; busy models: {busy}")
+                self._cond.wait(remaining)
+            else:
+                entry.in_use += 1
+                entry.last_used = time.monotonic()
+                return entry.model
+
+        try:
+            model = self._load(entry)
+        except BaseException:
+            with self._cond:
+                entry.loading = False
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            entry.model = model
+            entry.loading = False
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            self._cond.notify_all()
+            return model
+
+    def release(self, name: str):
+        with self._cond:
+            entry = self._entries[name]
+            entry.in_use = max(0, entry.in_use - 1)
+            entry.last_used = time.monotonic()
+            self._cond.notify_all()
+
+    def evict(self, name: str) -> bool:
+        """Drop an idle model now; False if it is not loaded or still in use."""
+        with self._cond:
+            entry = self._entries[name]
+            if entry.model is None or entry.in_use:
+                return False
+            self._evict(entry)
+            return True
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._cond:
+            return {
+                e.name: {
+                    "loaded": e.model is not None,
+                    "in_use": e.in_use,
+                    "loads": e.loads,
+                    "evictions": e.evictions,
+                    "load_seconds": e.load_seconds,
+                    "resident_bytes": e.resident_bytes,
+                    "estimate_bytes": e.estimate_bytes,
+                }
+                for e in self._entries.values()
+            }
+
+
+class PooledLlama:
+    """Callable stand-in for a ``Llama`` that borrows the real model from a pool.
+
+    Calling it acquires the model for the duration of the call; a streamed
+    call holds it until the stream is exhausted or closed. A ``prefix=``
+    keyword names the static start of the prompt, which ``prefix_cache``
+    restores into the model's context first. With a ``coalescer``, identical
+    concurrent calls share one generation. Other attributes of the model
+    (``tokenize``, ``input_ids``, ...) are only safe to use while the pool
+    cannot evict it: read them inside ``with pooled.borrowed() as llm:``.
+    """
+
+    def __init__(self, pool: ModelPool, name: str, prefix_cache=None, coalescer=None):
+        self.pool = pool
+        self.name = name
+        self.prefix_cache = prefix_cache
+        self.coalescer = coalescer
+
+    def __call__(self, *args, prefix: str = "", **kwargs):
+        if self.coalescer is not None:
+            run = lambda: self._call(prefix, args, kwargs)
+            return self.coalescer.call(self.name, (args, kwargs, prefix), run, bool(kwargs.get("stream")))
+        return self._call(prefix, args, kwargs)
+
+    @contextmanager
+    def borrowed(self) -> Iterator[Any]:
+        """The loaded model, pinned in the pool until the block exits."""
+        llm = self.pool.acquire(self.name)
+        try:
+            yield llm
+        finally:
+            self.pool.release(self.name)
+
+    def _call(self, prefix: str, args, kwargs):
+        if kwargs.get("stream"):
+            return self._stream(prefix, args, kwargs)
+        with self.borrowed() as llm:
+            self._prime(llm, prefix, args, kwargs)
+            return llm(*args, **kwargs)
+
+    def _stream(self, prefix: str, args, kwargs) -> Iterator:
+        # Acquired on the first next() so an unconsumed stream never pins the model.
+        with self.borrowed() as llm:
+            self._prime(llm, prefix, args, kwargs)
+            yield from llm(*args, **kwargs)
+
+    def _prime(self, llm, prefix: str, args, kwargs):
+        if self.prefix_cache is not None:
+            prompt = args[0] if args else kwargs.get("prompt", "")
+            self.prefix_cache.prime(self.name, llm, prefix, prompt)
+
+    def __getattr__(self, attr: str):
+        # Not forwarded: once released, the pool may evict the model and free
+        # its context under whatever was returned (a bound method, input_ids).
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        raise AttributeError(f"PooledLlama has no attribute {attr!r}; use borrowed() to reach the loaded model")
+
+    def __repr__(self) -> str:
+        return f"PooledLlama({self.name!r})"
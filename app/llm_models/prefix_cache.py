@@ -0,0 +1,224 @@
+import ctypes
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from string import Formatter
+from typing import Dict, Optional
+
+import numpy as np
+
+SYSTEM_START = "<|im_start|>system\n"
+COUNTERS = ("calls", "prompt_tokens", "prefill_tokens_saved", "warm", "memory_hits", "disk_hits", "misses")
+
+# _capture/_restore reach into llama-cpp-python internals (the context
+# wrapper, input_ids, n_tokens), written against the release pinned in
+# requirements.txt. Any other release leaves prompts uncached rather than
+# risk a KV cache that no longer matches the tokens.
+LLAMA_CPP_VERSION = "0.3.16"
+_LLAMA_ATTRS = ("_ctx", "input_ids", "n_tokens", "tokenize", "eval", "reset", "model_path")
+_CTX_ATTRS = ("ctx", "kv_cache_seq_rm")
+_STATE_FUNCTIONS = ("llama_state_seq_get_size", "llama_state_seq_get_data", "llama_state_seq_set_data")
+
+
+def system_prefix(template: str) -> str:
+    """Chat-input text before the first placeholder of a system-message template.
+
+    Trailing whitespace is dropped since the services strip the formatted message.
+    """
+    literal = []
+    for text, field, _, _ in Formatter().parse(template):
+        literal.append(text)
+        if field is not None:
+            break
+    return SYSTEM_START + "".join(literal).rstrip()
+
+
+def _common_prefix(a, b) -> int:
+    n = min(len(a), len(b))
+    mismatch = np.flatnonzero(np.asarray(a[:n]) != np.asarray(b[:n]))
+    return int(mismatch[0]) if mismatch.size else n
+
+
+@dataclass
+class _State:
+    tokens: np.ndarray
+    data: bytes  # llama_state_seq_get_data of sequence 0: KV cells only, no logits
+
+
+def _unsupported(llm) -> Optional[str]:
+    """Why the KV state of ``llm`` cannot be captured and restored here, or None."""
+    try:
+        import llama_cpp
+    except ImportError:
+        return "llama_cpp is not installed"
+    version = getattr(llama_cpp, "__version__", "unknown")
+    if version != LLAMA_CPP_VERSION:
+        return f"llama-cpp-python {version} is not {LLAMA_CPP_VERSION}, the release it was written against"
+    missing = [attr for attr in _LLAMA_ATTRS if not hasattr(llm, attr)]
+    ctx = getattr(llm, "_ctx", None)
+    if ctx is not None:
+        missing += [f"_ctx.{attr}" for attr in _CTX_ATTRS if not hasattr(ctx, attr)]
+    missing += [f"llama_cpp.{fn}" for fn in _STATE_FUNCTIONS if not hasattr(llama_cpp, fn)]
+    return f"missing {', '.join(missing)}" if missing else None
+
+
+def _capture(llm, tokens) -> _State:
+    import llama_cpp
+
+    ctx = llm._ctx.ctx
+    size = llama_cpp.llama_state_seq_get_size(ctx, 0)
+    buffer = (ctypes.c_uint8 * size)()
+    n_bytes = llama_cpp.llama_state_seq_get_data(ctx, buffer, size, 0)
+    return _State(np.asarray(tokens, dtype=np.intc), ctypes.string_at(buffer, n_bytes))
+
+
+def _restore(llm, state: _State) -> bool:
+    import llama_cpp
+
+    llm._ctx.kv_cache_seq_rm(-1, 0, -1)
+    buffer = (ctypes.c_uint8 * len(state.data)).from_buffer_copy(state.data)
+    if not llama_cpp.llama_state_seq_set_data(llm._ctx.ctx, buffer, len(state.data), 0):
+        llm.reset()
+        return False
+    n_tokens = len(state.tokens)
+    llm.input_ids[:n_tokens] = state.tokens
+    llm.n_tokens = n_tokens
+    return True
+
+
+class PrefixCache:
+    """Evaluated KV state of static prompt prefixes, restored before each call.
+
+    Prompts are laid out as a static instruction block followed by the
+    variable part, so a model's context after ``prime`` already holds the
+    block and llama.cpp's own prefix matching only evaluates the rest. States
+    are kept per model file in an in-memory LRU of ``max_entries`` and, when
+    ``cache_dir`` is set, on disk so other workers and restarts skip the
+    first evaluation too.
+    """
+
+    def __init__(self, max_entries: int = 16, cache_dir: str = ""):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._states: "OrderedDict[str, _State]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._unsupported: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # ======================
+    # Storage
+    # ======================
+    @staticmethod
+    def _key(llm, prefix: str) -> str:
+        stat = os.stat(llm.model_path)
+        raw = f"{os.path.abspath(llm.model_path)}|{stat.st_size}|{stat.st_mtime_ns}|{prefix}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _get(self, key: str) -> Optional[_State]:
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+            return state
+
+    def _put(self, key: str, state: _State):
+        with self._lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+    def _read(self, key: str) -> Optional[_State]:
+        if not self.cache_dir:
+            return None
+        try:
+            with np.load(os.path.join(self.cache_dir, f"{key}.npz")) as saved:
+                return _State(saved["tokens"], saved["data"].tobytes())
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write(self, key: str, state: _State):
+        if not self.cache_dir:
+            return
+        path = os.path.join(self.cache_dir, f"{key}.npz")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, tokens=state.tokens, data=np.frombuffer(state.data, dtype=np.uint8))
+        os.replace(tmp_path, path)
+
+    # ======================
+    # Prime
+    # ======================
+    def _supported(self, name: str, llm) -> bool:
+        with self._lock:
+            if name not in self._unsupported:
+                reason = self._unsupported[name] = _unsupported(llm)
+                if reason is not None:
+                    print(f"[WARN] Prefix cache disabled for model '{name}': {reason}; its prompts run uncached")
+            return self._unsupported[name] is None
+
+    def prime(self, name: str, llm, prefix: str, prompt: str):
+        """Make ``llm``'s context start with ``prefix`` before ``prompt`` is evaluated.
+
+        Does nothing (the call runs uncached) when the llama-cpp-python
+        internals it relies on are not there.
+        """
+        if not self._supported(name, llm):
+            return
+        prompt_tokens = llm.tokenize(prompt.encode("utf-8"), special=True)
+        source = None
+        if prefix and prompt.startswith(prefix):
+            prefix_tokens = llm.tokenize(prefix.encode("utf-8"), special=True)
+            # BPE may merge across the boundary; only the part shared with the prompt is reusable.
+            # generate() always evaluates the last prompt token itself, hence [:-1].
+            prefix_tokens = prompt_tokens[: _common_prefix(prefix_tokens, prompt_tokens[:-1])]
+            if prefix_tokens:
+                source = self._load(llm, prefix, prefix_tokens)
+        saved = 0
+        if source not in (None, "misses"):
+            saved = _common_prefix(llm.input_ids[: llm.n_tokens], prompt_tokens[:-1])
+
+        with self._lock:
+            stats = self._stats.setdefault(name, dict.fromkeys(COUNTERS, 0))
+            stats["calls"] += 1
+            stats["prompt_tokens"] += len(prompt_tokens)
+            stats["prefill_tokens_saved"] += saved
+            if source is not None:
+                stats[source] += 1
+
+    def _load(self, llm, prefix: str, prefix_tokens) -> str:
+        if _common_prefix(llm.input_ids[: llm.n_tokens], prefix_tokens) == len(prefix_tokens):
+            return "warm"
+        key = self._key(llm, prefix)
+        for source, lookup in (("memory_hits", self._get), ("disk_hits", self._read)):
+            state = lookup(key)
+            if state is not None and np.array_equal(state.tokens, prefix_tokens) and _restore(llm, state):
+                if source == "disk_hits":
+                    self._put(key, state)
+                return source
+
+        llm.reset()
+        llm.eval(prefix_tokens)
+        state = _capture(llm, prefix_tokens)
+        self._put(key, state)
+        self._write(key, state)
+        return "misses"
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+def stats_delta(before: Dict, after: Dict) -> Dict[str, Dict[str, int]]:
+    """Per-model counters accumulated between two ``stats()`` snapshots."""
+    delta = {}
+    for name, stats in after.items():
+        previous = before.get(name, {})
+        counters = {key: value - previous.get(key, 0) for key, value in stats.items()}
+        if counters["calls"]:
+            delta[name] = counters
+    return delta
@@ -0,0 +1,72 @@
+import argparse
+import ctypes
+import os
+from pathlib import Path
+
+from app.llm_models.shared_llms import MODEL_FILES, SHIPPED_QUANTS, model_path
+
+# ===========================================
+# Create quantized GGUF variants from the shipped model files.
+#
+#   python -m app.llm_models.quantize --models coder,generator --quants Q8_0,Q4_K_M
+#
+# Each variant is written where shared_llms expects it, so LLM_QUANT /
+# LLM_QUANTS can select it. Existing files are kept unless --force is given.
+# ===========================================
+QUANTS = ("F32", "BF16", "F16", "Q8_0", "Q6_K", "Q5_K_M", "Q4_K_M", "Q4_0")
+
+
+def _ftype(quant: str) -> int:
+    import llama_cpp
+
+    if quant == "F32":
+        return llama_cpp.LLAMA_FTYPE_ALL_F32
+    return getattr(llama_cpp, f"LLAMA_FTYPE_MOSTLY_{quant}")
+
+
+def quantize(name: str, quant: str, threads: int = 0, force: bool = False) -> Path:
+    import llama_cpp
+
+    source = Path(model_path(name, SHIPPED_QUANTS[name]))
+    target = Path(model_path(name, quant))
+    if target.exists() and not force:
+        print(f"[INFO] {target} already exists")
+        return target
+    if not source.exists():
+        raise FileNotFoundError(f"Shipped model file {source} not found")
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    params = llama_cpp.llama_model_quantize_default_params()
+    params.ftype = _ftype(quant)
+    params.nthread = threads
+    print(f"[INFO] Quantizing {source} -> {target} ({quant})...")
+    status = llama_cpp.llama_model_quantize(
+        str(source).encode("utf-8"), str(tmp_path).encode("utf-8"), ctypes.byref(params)
+    )
+    if status != 0:
+        tmp_path.unlink(missing_ok=True)
+        raise RuntimeError(f"llama_model_quantize failed for {name} {quant} (status {status})")
+    os.replace(tmp_path, target)
+    print(f"[✅ DONE] {target} ({target.stat().st_size / 2**30:.2f} GiB)")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create quantized GGUF variants of the pipeline models.")
+    parser.add_argument("--models", default="coder,compressor,generator,baseline",
+                        help=f"Comma-separated subset of {', '.join(MODEL_FILES)}.")
+    parser.add_argument("--quants", default="Q8_0,Q4_K_M", help=f"Comma-separated subset of {', '.join(QUANTS)}.")
+    parser.add_argument("--threads", type=int, default=0, help="0 = all cores.")
+    parser.add_argument("--force", action="store_true", help="Overwrite existing variants.")
+    args = parser.parse_args()
+
+    for name in (m.strip() for m in args.models.split(",") if m.strip()):
+        for quant in (q.strip() for q in args.quants.split(",") if q.strip()):
+            if quant not in QUANTS:
+                raise ValueError(f"Unknown quantization '{quant}'. Expected one of {QUANTS}.")
+            quantize(name, quant, args.threads, args.force)
+
+
+if __name__ == "__main__":
+    main()
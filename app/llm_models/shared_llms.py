@@ -1,62 +1,247 @@
-from llama_cpp import Llama
+import os
+from functools import lru_cache, partial
+
 from app.config import settings
-from app.llm_models.simulated_llms import (
-    coder_llm,
-    compressor_llm,
-    generator_llm,
-    base_llm as simulated_base_llm,
-    baseline_llm as simulated_baseline_llm,
-)
+from app.llm_models.cassette import Cassette, RecordingLlama, replay_models
+from app.llm_models.coalesce import Coalescer
+from app.llm_models.early_stop import stop_when_complete
+from app.llm_models.host import HostedLlama, socket_path
+from app.llm_models.pool import ModelPool, PooledLlama
+from app.llm_models.prefix_cache import PrefixCache
+from app.llm_models.speculative import make_draft, speculative_stats
+from app.llm_models.stage_cache import StageCache
+from app.llm_models import simulated_llms
+from app.utils.threads import current_plan
+
+# ======================
+# Model files
+# Each quantization of a model lives next to the shipped file, named the way
+# unsloth exports them; `python -m app.llm_models.quantize` creates missing ones.
+# ======================
+MODEL_FILES = {
+    "coder": "model_files/coder_{quant}/unsloth.{quant}.gguf",
+    "compressor": "model_files/compressor_{quant}/unsloth.{quant}.gguf",
+    "generator": "model_files/generator_{quant}/unsloth.{quant}.gguf",
+    "baseline": "model_files/baseline_{quant}/unsloth.{quant}.gguf",
+    "base": "model_files/qwen/unsloth.{quant}.gguf",
+}
+SHIPPED_QUANTS = {"coder": "F32", "compressor": "F32", "generator": "F32", "baseline": "F32", "base": "BF16"}
+N_CTX = 2048
+
+
+def model_quant(name: str) -> str:
+    """Configured quantization of a model: LLM_QUANTS entry, else LLM_QUANT, else the shipped one."""
+    return settings.llm_quants.get(name) or settings.llm_quant or SHIPPED_QUANTS[name]
+
+
+def model_path(name: str, quant: str = None) -> str:
+    return MODEL_FILES[name].format(quant=quant or model_quant(name))
+
 
-if settings.environment == "local":
-    coder_llm_2048 = coder_llm
-    compressor_llm_2048 = compressor_llm
-    generator_llm_2048 = generator_llm
-    base_llm = simulated_base_llm
-    baseline_llm = simulated_baseline_llm
-
-else:
-    coder_llm_2048 = Llama(
-        model_path="model_files/coder_F32/unsloth.F32.gguf",
-        n_ctx=2048,
+def load_llama(model_path: str, **overrides):
+    """Open a GGUF file with the settings every pipeline model uses."""
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(
+            f"Model file {model_path} not found; create it with `python -m app.llm_models.quantize`"
+        )
+    from llama_cpp import Llama
+
+    plan = current_plan()
+    params = dict(
+        n_ctx=N_CTX,
+        n_threads=plan.llm_threads,
+        n_threads_batch=plan.llm_threads_batch,
+        n_batch=plan.llm_batch,
         verbose=False,
         use_mmap=True,
-        use_mlock=True,
+        use_mlock=settings.llm_use_mlock,
         n_gpu_layers=0,  # set >0 if using GPU
     )
+    params.update(overrides)
+    return Llama(model_path=model_path, **params)
 
-    compressor_llm_2048 = Llama(
-        model_path="model_files/compressor_F32/unsloth.F32.gguf",
-        n_ctx=2048,
-        verbose=False,
-        use_mmap=True,
-        use_mlock=True,
-        n_gpu_layers=0,
-    )
 
-    generator_llm_2048 = Llama(
-        model_path="model_files/generator_F32/unsloth.F32.gguf",
-        n_ctx=2048,
-        verbose=False,
-        use_mmap=True,
-        use_mlock=True,
-        n_gpu_layers=0,
-    )
+def load_model(name: str, quant: str = None, speculative: str = None):
+    """Open a pipeline model with its speculative proposer (LLM_SPECULATIVE unless given; "" = off)."""
+    mode = settings.llm_speculative.get(name, "") if speculative is None else speculative
+    overrides = {}
+    if mode:
+        overrides["draft_model"] = make_draft(
+            name, mode, settings.llm_spec_tokens, settings.llm_spec_ngram,
+            load_draft_llm=lambda: load_llama(model_path(settings.llm_draft_model)),
+        )
+        # Verification reads logits at every drafted position. Llama turns this on for a
+        # draft_model itself but sizes its score buffer from the argument.
+        overrides["logits_all"] = True
+    return load_llama(model_path(name, quant), **overrides)
 
-    baseline_llm = Llama(
-        model_path="model_files/baseline_F32/unsloth.F32.gguf",
-        n_ctx=2048,
-        verbose=False,
-        use_mmap=True,
-        use_mlock=True,
-        n_gpu_layers=0,
-    )
 
-    base_llm = Llama(
-        model_path="model_files/qwen/unsloth.BF16.gguf",
-        n_ctx=2048,
-        verbose=False,
-        use_mmap=True,
-        use_mlock=True,
-        n_gpu_layers=0,
-    )
+@lru_cache(maxsize=None)
+def _replay_models():
+    return replay_models(settings.llm_cassette, settings.llm_replay_load_factor)
+
+
+def _simulated_model(name: str):
+    if settings.llm_cassette_mode == "replay":
+        replay = _replay_models().get(name)
+        if replay is not None:
+            return replay
+        print(f"[INFO] No calls of '{name}' in {settings.llm_cassette}; using the canned response")
+    return getattr(simulated_llms, f"{name}_llm")
+
+
+def model_identity(name: str) -> str:
+    """What a model's outputs depend on: the model file (path, size, mtime), or the simulation locally."""
+    if settings.environment == "local":
+        if settings.llm_cassette_mode == "replay" and os.path.exists(settings.llm_cassette):
+            stat = os.stat(settings.llm_cassette)
+            return f"replay:{name}|{os.path.abspath(settings.llm_cassette)}|{stat.st_size}|{stat.st_mtime_ns}"
+        return f"simulated:{name}"
+    path = model_path(name)
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def model_loader(name: str):
+    """Opens model ``name``: with ENVIRONMENT=local the simulated model (replayed from
+    LLM_CASSETTE with LLM_CASSETTE_MODE=replay), else the GGUF."""
+    if settings.environment == "local":
+        return partial(_simulated_model, name)
+    return partial(load_model, name)
+
+
+# ======================
+# Pool
+# Nothing is loaded at import time: each model is loaded by the first
+# pipeline call that needs it and may be evicted again to stay within
+# LLM_POOL_BUDGET_MB, so a worker serving only `baseline` never maps the
+# chained models.
+# ======================
+pool = ModelPool(
+    budget_bytes=settings.llm_pool_budget_mb * 2**20,
+    wait_seconds=settings.llm_pool_wait_seconds,
+)
+for _name in MODEL_FILES:
+    _estimate = 0
+    if settings.environment != "local":
+        _paths = [model_path(_name)]
+        if settings.llm_speculative.get(_name) == "draft":
+            _paths.append(model_path(settings.llm_draft_model))  # loaded with, and owned by, this model
+        # The GGUF size is what a mlock'ed, mmap'd model keeps resident.
+        _estimate = sum(os.path.getsize(p) for p in _paths if os.path.exists(p))
+    pool.register(_name, model_loader(_name), _estimate)
+
+# Simulated models have no KV state to cache.
+prefix_cache = (
+    PrefixCache(settings.llm_prefix_cache_entries, settings.llm_prefix_cache_dir)
+    if settings.llm_prefix_cache and settings.environment != "local"
+    else None
+)
+
+# Identical concurrent calls share one generation (in the model host with LLM_HOST_DIR).
+coalescer = Coalescer() if settings.llm_coalesce else None
+
+
+cassette = Cassette(settings.llm_cassette) if settings.llm_cassette_mode == "record" else None
+
+# Finished stage outputs, shared by every worker on the host and kept across restarts.
+stage_cache = (
+    StageCache(settings.stage_cache_dir, settings.stage_cache_size_limit, model_identity)
+    if settings.stage_cache_dir
+    else None
+)
+
+
+def stage_call(llm, prompt: str, scope: str = "", until: str = None, **kwargs):
+    """``llm(prompt, **kwargs)`` through the stage cache (STAGE_CACHE_DIR) when there is one.
+
+    ``scope`` adds whatever else the output depends on to the cache key, e.g. the RAG index
+    generation. A stream with ``until`` (json | ir | cpp) ends as soon as that artifact is complete.
+    """
+    def run():
+        result = llm(prompt, **kwargs)
+        if until and kwargs.get("stream"):
+            result = stop_when_complete(llm.name, until, result, kwargs.get("max_tokens"))
+        return result
+
+    if stage_cache is None:
+        return run()
+    return stage_cache.call(llm.name, prompt, dict(kwargs, until=until), run, scope)
+
+
+def _llm(name: str):
+    # With LLM_HOST_DIR the models live in `python -m app.llm_models.host` processes.
+    if settings.llm_host_dir:
+        llm = HostedLlama(name, socket_path(settings.llm_host_dir, name))
+    else:
+        llm = PooledLlama(pool, name, prefix_cache, coalescer)
+    # Recorded where the pipeline calls, so host queueing is part of the timing.
+    return RecordingLlama(llm, name, cassette) if cassette is not None else llm
+
+
+coder_llm_2048 = _llm("coder")
+compressor_llm_2048 = _llm("compressor")
+generator_llm_2048 = _llm("generator")
+baseline_llm = _llm("baseline")
+base_llm = _llm("base")
+_llms = {"coder": coder_llm_2048, "compressor": compressor_llm_2048, "generator": generator_llm_2048,
+         "baseline": baseline_llm, "base": base_llm}
+
+
+def _host_stats() -> dict:
+    """Stats of every running model host; models without one are left out."""
+    stats = {}
+    for name, llm in _llms.items():
+        try:
+            stats[name] = llm.stats()
+        except ConnectionError:
+            continue
+    return stats
+
+
+def _merged_host_stats(key: str) -> dict:
+    merged = {}
+    for host_stats in _host_stats().values():
+        merged.update(host_stats.get(key, {}))
+    return merged
+
+
+def llm_pool_stats():
+    """Per-model quantization, load state, load time and resident size in this process
+    (with model hosts: each host's slots, queue and request counters)."""
+    if settings.llm_host_dir:
+        stats = {name: host_stats["host"] for name, host_stats in _host_stats().items()}
+    else:
+        stats = pool.stats()
+    for name, model_stats in stats.items():
+        model_stats["quant"] = model_quant(name)
+        model_stats["speculative"] = settings.llm_speculative.get(name, "")
+    return stats
+
+
+def prefill_stats():
+    """Per-model prompt tokens and prefill tokens saved by the prefix cache in this process,
+    or host-wide with model hosts."""
+    if settings.llm_host_dir:
+        return _merged_host_stats("prefill")
+    return prefix_cache.stats() if prefix_cache is not None else {}
+
+
+def draft_stats():
+    """Per-model speculative counters in this process, or host-wide with model hosts."""
+    if settings.llm_host_dir:
+        return _merged_host_stats("speculative")
+    return speculative_stats()
+
+
+def coalesce_stats():
+    """Per-model calls and calls that joined an identical in-flight one, in this process
+    or host-wide with model hosts."""
+    if settings.llm_host_dir:
+        return _merged_host_stats("coalesced")
+    return coalescer.stats() if coalescer is not None else {}
+
+
+def stage_cache_stats():
+    """Per-model stage calls served from the stage cache, with the tokens and seconds saved."""
+    return stage_cache.stats() if stage_cache is not None else {}
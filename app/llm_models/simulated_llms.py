@@ -129,7 +129,7 @@ class SimulatedLlama:
         self.model_name = model_name
         self.response_text = SIMULATED_RESPONSES.get(model_name, "[Simulation Missing]")
 
-    def __call__(self, prompt: str, max_tokens=1024, stream=False, stop=None):
+    def __call__(self, prompt: str, max_tokens=1024, stream=False, stop=None, grammar=None):
         if not stream:
             return {
                 "choices": [
@@ -0,0 +1,85 @@
+import threading
+from typing import Callable, Dict
+
+import numpy as np
+
+# ======================
+# Speculative decoding
+# llama.cpp verifies every drafted token in one batch and keeps the prefix
+# the target model agrees with, so output is unchanged and each accepted
+# token saves a sequential decode step. Proposers:
+#   lookup  copy the continuation of the latest n-gram seen earlier in the
+#           context (the generator copies IR ids, the compressor copies code)
+#   draft   greedy tokens from a small model sharing the tokenizer
+# ======================
+MODES = ("lookup", "draft")
+COUNTERS = ("calls", "proposed", "accepted")
+
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+class DraftLlama:
+    """Proposes the next ``num_pred_tokens`` greedy tokens of a second ``Llama``."""
+
+    def __init__(self, llm, num_pred_tokens: int):
+        self.llm = llm
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids: np.ndarray, **kwargs) -> np.ndarray:
+        draft = []
+        # generate() reuses the draft model's KV for the common prefix, so
+        # only the tokens accepted since the last call are evaluated.
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, temp=0.0, reset=True):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.asarray(draft, dtype=np.intc)
+
+
+class CountingDraft:
+    """``LlamaDraftModel`` wrapper counting proposed and accepted tokens per model.
+
+    After verification the sequence grows by the accepted drafts plus one
+    sampled token, which is how acceptance is read off the next call. A
+    generation's last draft is never verified and is not counted.
+    """
+
+    def __init__(self, name: str, proposer: Callable[[np.ndarray], np.ndarray]):
+        self.name = name
+        self.proposer = proposer
+        self._last_length = 0
+        self._last_proposed = 0
+
+    def __call__(self, input_ids: np.ndarray, **kwargs) -> np.ndarray:
+        grown = len(input_ids) - self._last_length - 1
+        verified = 0 <= grown <= self._last_proposed  # otherwise a new generation started
+        with _stats_lock:
+            stats = _stats.setdefault(self.name, dict.fromkeys(COUNTERS, 0))
+            stats["calls"] += 1
+            if verified:
+                stats["proposed"] += self._last_proposed
+                stats["accepted"] += grown
+        draft = self.proposer(input_ids)
+        self._last_length, self._last_proposed = len(input_ids), len(draft)
+        return draft
+
+
+def make_draft(name: str, mode: str, num_pred_tokens: int, max_ngram: int,
+               load_draft_llm: Callable = None) -> CountingDraft:
+    """The ``draft_model`` for model ``name``; ``load_draft_llm`` opens the draft model (mode "draft")."""
+    if mode == "lookup":
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        proposer = LlamaPromptLookupDecoding(max_ngram_size=max_ngram, num_pred_tokens=num_pred_tokens)
+    elif mode == "draft":
+        proposer = DraftLlama(load_draft_llm(), num_pred_tokens)
+    else:
+        raise ValueError(f"Unknown speculative mode '{mode}' for '{name}'. Expected one of {MODES}.")
+    return CountingDraft(name, proposer)
+
+
+def speculative_stats() -> Dict[str, Dict[str, int]]:
+    """Per-model draft calls, proposed and accepted tokens in this process."""
+    with _stats_lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List
+
+COUNTERS = ("calls", "hits", "misses", "bypassed", "tokens_saved")
+# Call parameters that change the output; with the prompt and the model file they make the key.
+# ``until`` is the early-stop watcher (app/llm_models/early_stop.py).
+KEY_PARAMS = ("max_tokens", "temperature", "top_p", "top_k", "min_p", "repeat_penalty", "stop", "seed", "until")
+
+_bypass: ContextVar[bool] = ContextVar("stage_cache_bypass", default=False)
+
+
+@contextmanager
+def bypassed(bypass: bool = True):
+    """Stage calls inside neither read nor write the cache (honest latency measurements)."""
+    token = _bypass.set(bypass)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def _chunk(text: str, finish_reason=None) -> Dict:
+    return {"choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}]}
+
+
+class StageCache:
+    """Persistent, content-addressed results of LLM stage calls.
+
+    A result is stored under the hash of the model file identity (path,
+    size and mtime of the GGUF; the simulated model locally), the rendered
+    prompt, the output-shaping parameters, whether a grammar constrains the
+    output and a caller-given ``scope`` (RAG stages pass the index
+    generation). Entries live in a ``diskcache`` directory shared by every
+    worker on the host; the least recently used are evicted beyond
+    ``size_limit`` bytes. Only calls that ran to the end are stored; a hit
+    returns the stored output at once (a stream replays its stored chunks).
+    With sampling, a hit repeats the one stored sample.
+    """
+
+    def __init__(self, cache_dir: str, size_limit: int, model_identity: Callable[[str], str]):
+        import diskcache
+
+        self._disk = diskcache.Cache(cache_dir, size_limit=size_limit, eviction_policy="least-recently-used")
+        self._model_identity = model_identity
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def key(self, name: str, prompt: str, kwargs: Dict, scope: str = "") -> str:
+        params = {key: kwargs[key] for key in KEY_PARAMS if key in kwargs}
+        raw = json.dumps(
+            [self._model_identity(name), prompt, params, kwargs.get("grammar") is not None, scope],
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str, **deltas):
+        with self._lock:
+            stats = self._stats.setdefault(name, dict.fromkeys(COUNTERS, 0) | {"seconds_saved": 0.0})
+            stats["calls"] += 1
+            for key, n in deltas.items():
+                stats[key] += n
+
+    def call(self, name: str, prompt: str, kwargs: Dict, run: Callable[[], Any], scope: str = ""):
+        """The result of ``run()``, the call of model ``name`` with ``prompt`` and ``kwargs``,
+        served from the cache when this exact call ran before."""
+        if _bypass.get():
+            self._count(name, bypassed=1)
+            return run()
+        key = self.key(name, prompt, kwargs, scope)
+        entry = self._disk.get(key)
+        if entry is not None:
+            self._count(name, hits=1, tokens_saved=entry["tokens"], seconds_saved=entry["seconds"])
+            if kwargs.get("stream"):
+                return self._replay(entry)
+            return {
+                "object": "text_completion",
+                "model": name,
+                "choices": [{"text": "".join(entry["chunks"]), "index": 0, "logprobs": None,
+                             "finish_reason": entry["finish_reason"]}],
+                "usage": {"completion_tokens": entry["tokens"]},
+            }
+        self._count(name, misses=1)
+        if kwargs.get("stream"):
+            return self._store_stream(key, run())
+        start = time.perf_counter()
+        response = run()
+        choice = response.get("choices", [{}])[0]
+        self._put(key, [choice.get("text", "")], response.get("usage", {}).get("completion_tokens", 0),
+                  choice.get("finish_reason"), time.perf_counter() - start)
+        return response
+
+    def _replay(self, entry: Dict) -> Iterator[Dict]:
+        chunks: List[str] = entry["chunks"]
+        for i, text in enumerate(chunks):
+            yield _chunk(text, entry["finish_reason"] if i == len(chunks) - 1 else None)
+
+    def _store_stream(self, key: str, stream) -> Iterator[Dict]:
+        start = time.perf_counter()
+        texts, finish_reason = [], None
+        for chunk in stream:
+            choice = chunk["choices"][0]
+            texts.append(choice["text"])
+            finish_reason = choice.get("finish_reason") or finish_reason
+            yield chunk
+        self._put(key, texts, len(texts), finish_reason, time.perf_counter() - start)
+
+    def _put(self, key: str, chunks: List[str], tokens: int, finish_reason, seconds: float):
+        # A non-streamed result is one chunk; ``tokens`` is what a hit saves either way.
+        self._disk.set(key, {"chunks": chunks, "tokens": tokens, "finish_reason": finish_reason, "seconds": seconds})
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
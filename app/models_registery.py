@@ -7,3 +7,12 @@ MODEL_REGISTRY = {
     "rag_chained_k1t2": lambda prompt: rag_chained_service.run_pipeline(prompt, top_k=1, distance_threshold=0.2),
     "rag_chained_k1t5": lambda prompt: rag_chained_service.run_pipeline(prompt, top_k=1, distance_threshold=0.5),
 }
+
+# Async pipelines for direct mode (PIPELINE_MODE=direct, POST /direct/{model})
+DIRECT_REGISTRY = {
+    "baseline": lambda prompt: baseline_service.run_pipeline_async(prompt),
+    "chained": lambda prompt: chained_service.run_pipeline_async(prompt),
+    "rag_chained_k3t5": lambda prompt: rag_chained_service.run_pipeline_async(prompt, top_k=3, distance_threshold=0.5),
+    "rag_chained_k1t2": lambda prompt: rag_chained_service.run_pipeline_async(prompt, top_k=1, distance_threshold=0.2),
+    "rag_chained_k1t5": lambda prompt: rag_chained_service.run_pipeline_async(prompt, top_k=1, distance_threshold=0.5),
+}
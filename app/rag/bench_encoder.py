@@ -0,0 +1,95 @@
+import argparse
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.rag.embed import DATA_PATH, iter_chunks
+from app.rag.encoder import BACKENDS, encode, load_encoder
+from app.rag.nodes import chunk_to_nodes
+
+# ===========================================
+# Parity / latency / throughput benchmark for the RAG encoder backends.
+#
+#   python -m app.rag.bench_encoder --backends torch,onnx --threads 2,4
+#
+# Every backend encodes the same node texts from the dataset. Parity is the
+# cosine between its vectors and the torch ones (both are unit vectors); the
+# run exits non-zero if any backend's minimum falls below --min-cosine, so it
+# can gate switching RAG_EMBED_BACKEND. Latency is one query per encode call,
+# as the RAG stages issue them; throughput is a bulk encode of every text.
+# ===========================================
+
+
+def node_texts(limit: int) -> List[str]:
+    texts: List[str] = []
+    for idx, chunk in enumerate(iter_chunks(DATA_PATH)):
+        texts.extend(text for _, _, _, text in chunk_to_nodes(chunk, idx) if text)
+        if len(texts) >= limit:
+            break
+    return texts[:limit]
+
+
+def run_backend(backend: str, threads: int, texts: List[str], queries: List[str],
+                batch_size: int) -> Dict:
+    start = time.perf_counter()
+    model = load_encoder(backend, threads)
+    load_s = time.perf_counter() - start
+
+    encode(model, queries[:2], batch_size=1)  # warm-up
+    latencies = []
+    for text in queries:
+        t0 = time.perf_counter()
+        encode(model, [text], batch_size=1)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    vectors = encode(model, texts, batch_size=batch_size)
+    bulk_s = time.perf_counter() - t0
+    return {
+        "vectors": vectors,
+        "load_s": load_s,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "texts_per_s": len(texts) / bulk_s if bulk_s else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG encoder backends against torch.")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--threads", default="0", help="Comma-separated intra-op thread counts.")
+    parser.add_argument("--texts", type=int, default=2000, help="Node texts for parity and throughput.")
+    parser.add_argument("--queries", type=int, default=100, help="Single-text encodes for latency.")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args()
+
+    texts = node_texts(args.texts)
+    queries = texts[: args.queries]
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    thread_counts = [int(t) for t in args.threads.split(",")]
+    print(f"[INFO] {len(texts)} node texts from {DATA_PATH}")
+
+    reference = run_backend("torch", thread_counts[0], texts, queries, args.batch_size)["vectors"]
+    failed = False
+    print(f"{'backend':>8} {'threads':>7} {'load_s':>7} {'p50_ms':>8} {'p99_ms':>8} "
+          f"{'texts/s':>9} {'cos_mean':>9} {'cos_min':>8}")
+    for backend in backends:
+        for threads in thread_counts:
+            row = run_backend(backend, threads, texts, queries, args.batch_size)
+            cosine = (row["vectors"] * reference).sum(axis=1)
+            failed |= bool(cosine.min() < args.min_cosine)
+            print(f"{backend:>8} {threads:>7} {row['load_s']:>7.2f} {row['p50_ms']:>8.2f} "
+                  f"{row['p99_ms']:>8.2f} {row['texts_per_s']:>9.1f} {cosine.mean():>9.5f} "
+                  f"{cosine.min():>8.5f}")
+
+    if failed:
+        print(f"[ERROR] A backend fell below the parity floor (cosine {args.min_cosine})")
+        sys.exit(1)
+    print(f"[✅ DONE] Every backend stays above cosine {args.min_cosine} of torch")
+
+
+if __name__ == "__main__":
+    main()
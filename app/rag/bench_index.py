@@ -0,0 +1,94 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from app.rag.index import INDEX_TYPES, build_index, decode_vectors, search
+
+# ===========================================
+# Recall / latency benchmark for the RAG index types.
+#
+#   python -m app.rag.bench_index --sizes 10000,100000,300000 --top-k 5
+#
+# Every index type is compared against an exact flat index built over the
+# same vectors. Recall@k is the share of the exact top-k node ids that the
+# candidate index also returns; latency is measured one query at a time,
+# which is how the RAG stages call it.
+# ===========================================
+DIM = 384  # all-MiniLM-L6-v2
+EMBED_FILE = Path(__file__).resolve().parent.parent / "embeddings" / "node_embeddings.npy"
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def synthetic_vectors(n: int, rng: np.random.Generator, n_clusters: int = 256) -> np.ndarray:
+    """Clustered unit vectors; feedback chunks come in families of similar circuits."""
+    centers = _unit(rng.standard_normal((n_clusters, DIM)))
+    labels = rng.integers(0, n_clusters, size=n)
+    return _unit(centers[labels] + 0.05 * rng.standard_normal((n, DIM)))
+
+
+def real_vectors(n: int, rng: np.random.Generator) -> np.ndarray:
+    """Resample the saved node embeddings with small noise to reach n vectors."""
+    base = np.load(EMBED_FILE, mmap_mode="r")
+    picks = rng.integers(0, base.shape[0], size=n)
+    return _unit(decode_vectors(base[picks]) + 0.01 * rng.standard_normal((n, base.shape[1])))
+
+
+def run_case(corpus: np.ndarray, queries: np.ndarray, index_type: str,
+             truth: np.ndarray, top_k: int) -> Dict:
+    start = time.perf_counter()
+    index = build_index(corpus, index_type)
+    build_s = time.perf_counter() - start
+
+    latencies: List[float] = []
+    found = np.empty((queries.shape[0], top_k), dtype=np.int64)
+    for i in range(queries.shape[0]):
+        t0 = time.perf_counter()
+        _, ids = search(index, queries[i : i + 1], top_k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found[i] = ids[0]
+
+    hits = sum(len(set(found[i]) & set(truth[i])) for i in range(queries.shape[0]))
+    return {
+        "type": index_type,
+        "build_s": build_s,
+        "recall": hits / truth.size,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG index recall and latency.")
+    parser.add_argument("--sizes", default="10000,50000,100000,300000",
+                        help="Comma-separated node counts.")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--source", choices=["synthetic", "embeddings"], default="synthetic")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    make = real_vectors if args.source == "embeddings" else synthetic_vectors
+    types = [t.strip() for t in args.types.split(",") if t.strip()]
+
+    print(f"{'nodes':>8} {'type':>9} {'build_s':>8} {'recall@k':>9} {'p50_ms':>8} {'p99_ms':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        vectors = make(size + args.queries, rng)
+        corpus, queries = vectors[:size], vectors[size:]
+        _, truth = search(build_index(corpus, "flat"), queries, args.top_k)
+
+        for index_type in types:
+            row = run_case(corpus, queries, index_type, truth, args.top_k)
+            print(f"{size:>8} {row['type']:>9} {row['build_s']:>8.2f} {row['recall']:>9.3f} "
+                  f"{row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
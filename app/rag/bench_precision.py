@@ -0,0 +1,116 @@
+import argparse
+from typing import Dict, List
+
+import numpy as np
+import faiss
+
+from app.config import settings
+from app.rag.bench_index import real_vectors, synthetic_vectors
+from app.rag.index import (
+    INDEX_TYPES,
+    PRECISIONS,
+    RESCORE_OVERFETCH,
+    build_index,
+    encode_vectors,
+    rescore,
+    search,
+)
+
+# ===========================================
+# Memory / accuracy benchmark for the RAG vector precisions.
+#
+#   python -m app.rag.bench_precision --sizes 10000,100000 --thresholds 0.2,0.5
+#
+# For every precision this reports the size of the serialized index and of
+# the saved embeddings per million nodes, and how its results differ from an
+# exact float32 flat index over the same vectors:
+#   recall@k  share of the exact top-k node ids also returned
+#   dist_err  mean |reported score - exact squared L2| of the returned hits
+#   match@t   accepted-hit overlap at distance_threshold t: |both| / |either|
+#             over the hits scoring <= t in the exact or compressed results
+# Indexes are built from the saved (already converted) vectors, as compaction
+# does. "raw" rows use the index scores as they are; for pq the "rescored" row
+# re-scores over-fetched hits from the saved vectors, as app/rag/run.py does.
+# ===========================================
+MIB = 2**20
+
+
+def near_queries(corpus: np.ndarray, n: int, rng: np.random.Generator) -> np.ndarray:
+    """Perturbed corpus vectors, so hit distances span the 0.2 - 0.5 thresholds in use."""
+    picks = rng.integers(0, corpus.shape[0], size=n)
+    scale = rng.uniform(0.0, 0.05, size=(n, 1))
+    vectors = corpus[picks] + scale * rng.standard_normal((n, corpus.shape[1]))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def exact_distances(corpus: np.ndarray, queries: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    diff = corpus[np.where(indices >= 0, indices, 0)] - queries[:, None, :]
+    return np.where(indices >= 0, np.einsum("ijk,ijk->ij", diff, diff), np.inf)
+
+
+def compare(corpus: np.ndarray, queries: np.ndarray, distances: np.ndarray, indices: np.ndarray,
+            truth_d: np.ndarray, truth_i: np.ndarray, thresholds: List[float]) -> Dict:
+    found = indices >= 0
+    hits = sum(len(set(indices[i]) & set(truth_i[i])) for i in range(queries.shape[0]))
+    errors = np.abs(distances - exact_distances(corpus, queries, indices))[found]
+    row = {"recall": hits / truth_i.size, "dist_err": float(errors.mean()) if errors.size else 0.0}
+    for t in thresholds:
+        both = either = 0
+        for i in range(queries.shape[0]):
+            expected = set(truth_i[i][truth_d[i] <= t])
+            accepted = set(indices[i][found[i] & (distances[i] <= t)])
+            both += len(expected & accepted)
+            either += len(expected | accepted)
+        row[t] = both / either if either else 1.0
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG vector precisions against float32.")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated node counts.")
+    parser.add_argument("--precisions", default=",".join(PRECISIONS))
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--thresholds", default="0.2,0.5")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--source", choices=["synthetic", "embeddings"], default="synthetic")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    make = real_vectors if args.source == "embeddings" else synthetic_vectors
+    precisions = [p.strip() for p in args.precisions.split(",") if p.strip()]
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    k = args.top_k
+
+    print(f"[INFO] index type '{args.index_type}', PQ sub-quantizers {settings.rag_pq_m}, top_k {k}")
+    header = f"{'nodes':>8} {'precision':>9} {'mode':>8} {'index_MiB/M':>11} {'saved_MiB/M':>11} " \
+             f"{'recall@k':>8} {'dist_err':>8}"
+    print(header + "".join(f" {'match@' + str(t):>9}" for t in thresholds))
+    for size in (int(s) for s in args.sizes.split(",")):
+        corpus = make(size, rng)
+        queries = near_queries(corpus, args.queries, rng)
+        truth_d, truth_i = search(build_index(corpus, "flat", "float32"), queries, k)
+
+        for precision in precisions:
+            saved = encode_vectors(corpus, precision)
+            index = build_index(saved, args.index_type, precision)
+            per_million = 1e6 / size / MIB
+            index_mib = faiss.serialize_index(index).nbytes * per_million
+            saved_mib = saved.nbytes * per_million
+
+            runs = [("raw", search(index, queries, k))]
+            if precision == "pq":
+                _, fetched = search(index, queries, RESCORE_OVERFETCH * k)
+                distances, indices = rescore(saved, queries, fetched)
+                runs.append(("rescored", (distances[:, :k], indices[:, :k])))
+
+            for mode, (distances, indices) in runs:
+                row = compare(corpus, queries, distances, indices, truth_d, truth_i, thresholds)
+                print(f"{size:>8} {precision:>9} {mode:>8} {index_mib:>11.1f} {saved_mib:>11.1f} "
+                      f"{row['recall']:>8.3f} {row['dist_err']:>8.4f}"
+                      + "".join(f" {row[t]:>9.3f}" for t in thresholds))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
+import argparse
 import json
-from typing import List, Dict, Tuple
-from sentence_transformers import SentenceTransformer
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
 import numpy as np
 from pathlib import Path
 
+from app.config import settings
+from app.rag.encoder import BACKENDS, EMBEDDING_MODEL, load_encoder
+from app.rag.index import INDEX_TYPES, PRECISIONS, build_index, decode_vectors, index_path, save_index
+from app.rag.nodes import chunk_to_nodes, text_hash
+from app.rag.store import SegmentStore
+
 # ===========================================
 # CONFIGURATION
 # ===========================================
@@ -12,95 +19,167 @@ DATA_PATH = BASE_DIR / "data" / "dataset.json"
 OUTPUT_DIR = BASE_DIR / "embeddings"
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
-EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 OUTPUT_EMBED_FILE = OUTPUT_DIR / "node_embeddings.npy"
 OUTPUT_META_FILE = OUTPUT_DIR / "node_metadata.json"
 
+READ_BLOCK_SIZE = 1 << 20  # characters read per step while streaming the dataset
+_SEPARATOR = re.compile(r"\s*(?:,\s*)?")  # between array elements
+
 # ===========================================
-# LOAD CHUNKS FROM JSON
+# STREAM CHUNKS FROM JSON
+# The dataset is a JSON array; decode it one element at a time so the
+# bulky Wokwi JSON of every example is never held in memory at once.
 # ===========================================
-def load_chunks(json_path: Path) -> List[Dict]:
+def iter_chunks(json_path: Path, block_size: int = READ_BLOCK_SIZE) -> Iterator[Dict]:
+    decoder = json.JSONDecoder()
     with open(json_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        buffer = f.read(block_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{json_path} does not contain a JSON array")
+        pos = 1
+        eof = False
+        while True:
+            # Decode in place; the buffer is only trimmed when more is read.
+            pos = _SEPARATOR.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return
+            try:
+                chunk, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(block_size)
+                eof = not more
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield chunk
 
 # ===========================================
-# CONVERT CHUNK TO GRAPH NODES
-# Each chunk becomes 5 nodes:
-# - Prompt
-# - Code
-# - Parts
-# - Output (connections)
-# - Circuit_Space
+# REUSE PREVIOUS EMBEDDINGS
+# Node vectors are keyed by a hash of (model, text), so unchanged nodes keep
+# their vector even if chunks were reordered.
 # ===========================================
-def chunk_to_nodes(chunk: Dict, chunk_idx: int) -> List[Tuple[str, str, str, str]]:
-    chunk_id = f"chunk_{chunk_idx}"
-    nodes = []
-
-    # Prompt node
-    prompt = chunk.get("prompt", "")
-    nodes.append((f"{chunk_id}_prompt", "Prompt", chunk_id, prompt))
-
-    # Code node
-    code = chunk.get("code", "")
-    nodes.append((f"{chunk_id}_code", "Code", chunk_id, code))
-
-    # Parts node
-    parts = chunk.get("output", {}).get("parts", [])
-    parts_text = ", ".join(p.get("type", "") for p in parts)
-    nodes.append((f"{chunk_id}_parts", "Parts", chunk_id, parts_text))
+def load_previous() -> Tuple[Optional[np.ndarray], Dict[str, int]]:
+    if not (OUTPUT_EMBED_FILE.exists() and OUTPUT_META_FILE.exists()):
+        return None, {}
+    with open(OUTPUT_META_FILE, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    rows = {row["text_hash"]: i for i, row in enumerate(metadata) if "text_hash" in row}
+    return np.load(OUTPUT_EMBED_FILE, mmap_mode="r"), rows
 
-    # Output node (connections)
-    connections = chunk.get("output", {}).get("connections", [])
-    conn_text = "\n".join(" → ".join(conn[:2]) for conn in connections if len(conn) >= 2)
-    nodes.append((f"{chunk_id}_output", "Output", chunk_id, conn_text))
-
-    # Circuit_Space node
-    circuit_space = chunk.get("circuit_space_representation", "")
-    nodes.append((f"{chunk_id}_circuit", "Circuit_Space", chunk_id, circuit_space))
-
-    return nodes
+# ===========================================
+# EMBED NEW / CHANGED NODES
+# ===========================================
+def embed_texts(texts: List[str], backend: str = None, threads: int = None,
+                batch_size: int = None, workers: int = 1) -> np.ndarray:
+    model = load_encoder(backend, threads)
+    batch_size = batch_size or settings.rag_embed_batch_size
+    options = dict(batch_size=batch_size, normalize_embeddings=True, show_progress_bar=True)
+    if workers > 1:
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * workers)
+        try:
+            embeddings = model.encode(texts, pool=pool, **options)
+        finally:
+            model.stop_multi_process_pool(pool)
+    else:
+        embeddings = model.encode(texts, **options)
+    return np.asarray(embeddings, dtype=np.float32)
 
 # ===========================================
-# EMBED ALL NODES
+# BUILD / TRAIN THE SEARCH INDEX
 # ===========================================
-def embed_nodes(all_nodes: List[Tuple[str, str, str, str]],
-                model_name: str = EMBEDDING_MODEL_NAME) -> np.ndarray:
-    model = SentenceTransformer(model_name)
-    texts = [node[3] for node in all_nodes]
-    embeddings = model.encode(texts, show_progress_bar=True)
-    return np.array(embeddings)
+def write_index(embeddings: np.ndarray, index_type: str, precision: str):
+    index_file = index_path(OUTPUT_DIR, index_type, precision)
+    print(f"[INFO] Building '{index_type}' ({precision}) index over {embeddings.shape[0]} nodes...")
+    save_index(build_index(embeddings, index_type, precision), index_file)
+    print(f"[✅ DONE] FAISS index written to '{index_file}'")
 
 # ===========================================
 # MAIN PIPELINE
 # ===========================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Embed dataset nodes and build the RAG index.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=settings.rag_index_type)
+    parser.add_argument("--precision", choices=PRECISIONS, default=settings.rag_vector_precision,
+                        help="Precision of the saved embeddings and the index codes.")
+    parser.add_argument(
+        "--index-only",
+        action="store_true",
+        help="Rebuild the index from the existing embeddings without re-encoding.",
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default=settings.rag_embed_backend)
+    parser.add_argument("--threads", type=int, default=settings.rag_embed_threads,
+                        help="Intra-op threads per encoder; 0 keeps the runtime default.")
+    parser.add_argument("--batch-size", type=int, default=settings.rag_embed_batch_size)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Encoder processes; >1 starts a SentenceTransformer multi-process pool.")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-encode every node instead of reusing unchanged vectors "
+                             "(e.g. after switching --backend).")
+    return parser.parse_args()
+
+
 def main():
-    print("[INFO] Loading data...")
+    args = parse_args()
+    if args.index_only:
+        if not OUTPUT_EMBED_FILE.exists():
+            raise FileNotFoundError(f"Embeddings not found at {OUTPUT_EMBED_FILE}")
+        write_index(np.load(OUTPUT_EMBED_FILE, mmap_mode="r"), args.index_type, args.precision)
+        return
+
+    print("[INFO] Streaming data...")
     if not DATA_PATH.exists():
         raise FileNotFoundError(f"Dataset not found at {DATA_PATH}")
 
-    chunks = load_chunks(DATA_PATH)
-
-    print(f"[INFO] Processing {len(chunks)} chunks into graph nodes...")
-    all_nodes = []
-    for idx, chunk in enumerate(chunks):
-        all_nodes.extend(chunk_to_nodes(chunk, idx))
-
-    print(f"[INFO] Total nodes to embed: {len(all_nodes)}")
-
-    print("[INFO] Generating embeddings...")
-    embeddings = embed_nodes(all_nodes)
-
-    np.save(OUTPUT_EMBED_FILE, embeddings)
-
-    metadata = [
-        {"node_id": n[0], "type": n[1], "chunk_id": n[2]}
-        for n in all_nodes
-    ]
-    with open(OUTPUT_META_FILE, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2)
-
-    print(f"[✅ DONE] Saved {len(all_nodes)} node embeddings to '{OUTPUT_EMBED_FILE}'")
+    previous, previous_rows = (None, {}) if args.full else load_previous()
+
+    metadata = []
+    missing: Dict[str, str] = {}
+    n_chunks = 0
+    for idx, chunk in enumerate(iter_chunks(DATA_PATH)):
+        n_chunks += 1
+        for node_id, node_type, chunk_id, text in chunk_to_nodes(chunk, idx):
+            h = text_hash(text, EMBEDDING_MODEL)
+            metadata.append({"node_id": node_id, "type": node_type, "chunk_id": chunk_id, "text_hash": h})
+            if h not in previous_rows:
+                missing.setdefault(h, text)
+
+    reused = sum(1 for row in metadata if row["text_hash"] in previous_rows)
+    print(f"[INFO] {n_chunks} chunks -> {len(metadata)} nodes "
+          f"({reused} reused, {len(missing)} unique texts to embed)")
+    if not metadata:
+        raise ValueError(f"No chunks found in {DATA_PATH}")
+
+    new_embeddings = None
+    if missing:
+        print("[INFO] Generating embeddings...")
+        new_embeddings = embed_texts(list(missing.values()), backend=args.backend, threads=args.threads,
+                                     batch_size=args.batch_size, workers=args.workers)
+    new_rows = {h: i for i, h in enumerate(missing)}
+
+    dim = new_embeddings.shape[1] if new_embeddings is not None else previous.shape[1]
+    embeddings = np.empty((len(metadata), dim), dtype=np.float32)
+    hashes = [row["text_hash"] for row in metadata]
+    from_new = np.array([h in new_rows for h in hashes], dtype=bool)
+    if from_new.any():
+        embeddings[from_new] = new_embeddings[[new_rows[h] for h, new in zip(hashes, from_new) if new]]
+    if (~from_new).any():
+        rows = [previous_rows[h] for h, new in zip(hashes, from_new) if not new]
+        embeddings[~from_new] = decode_vectors(previous[rows])
+
+    # Written through the store so running workers never map a half-written file.
+    index_file = index_path(OUTPUT_DIR, args.index_type, args.precision)
+    store = SegmentStore(OUTPUT_DIR, OUTPUT_EMBED_FILE, OUTPUT_META_FILE, DATA_PATH,
+                         index_file, precision=args.precision)
+    print(f"[INFO] Building '{args.index_type}' ({args.precision}) index over {embeddings.shape[0]} nodes...")
+    index = build_index(embeddings, args.index_type, args.precision)
+    # The dataset is streamed a second time into the chunk store the workers read.
+    store.write_base(embeddings, metadata, index, iter_chunks(DATA_PATH))
+
+    print(f"[✅ DONE] Saved {len(metadata)} node embeddings to '{OUTPUT_EMBED_FILE}'")
     print(f"[✅ DONE] Metadata written to '{OUTPUT_META_FILE}'")
+    print(f"[✅ DONE] FAISS index written to '{index_file}'")
 
 if __name__ == "__main__":
     main()
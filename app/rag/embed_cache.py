@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Content-hash keyed cache of query embeddings.
+
+    Tier 1 is a per-process LRU. Tier 2 is an optional ``diskcache`` directory
+    shared by every worker on the host. Keys hash the embedding model name
+    together with the text, so switching models never returns stale vectors.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 2048,
+                 disk_dir: Optional[str] = None, disk_size_limit: int = 2**30):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_dir:
+            import diskcache
+
+            self._disk = diskcache.Cache(disk_dir, size_limit=disk_size_limit)
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+
+    def key(self, text: str) -> str:
+        payload = f"{self.model_name}\0{text}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    # ======================
+    # Tiers
+    # ======================
+    def _get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+        if self._disk is not None:
+            raw = self._disk.get(key)
+            if raw is not None:
+                vector = np.frombuffer(raw, dtype=np.float32)
+                self._remember(key, vector)
+                with self._lock:
+                    self.disk_hits += 1
+                return vector
+        return None
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _put(self, key: str, vector: np.ndarray):
+        self._remember(key, vector)
+        if self._disk is not None:
+            self._disk.set(key, vector.tobytes())
+
+    # ======================
+    # Public
+    # ======================
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return float32 embeddings for texts, encoding only the cache misses in one batch."""
+        keys = [self.key(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vector = self._get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                found[key] = vector
+
+        if missing:
+            start = time.perf_counter()
+            vectors = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            elapsed = time.perf_counter() - start
+            for key, vector in zip(missing, vectors):
+                self._put(key, vector)
+                found[key] = vector
+            with self._lock:
+                self.misses += len(missing)
+                self.encode_seconds += elapsed
+
+        return np.stack([found[key] for key in keys])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            per_encode = self.encode_seconds / self.misses if self.misses else 0.0
+            return {
+                "model": self.model_name,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "encode_seconds": self.encode_seconds,
+                # Estimated from the mean per-text encode time of the misses.
+                "encode_seconds_saved": hits * per_encode,
+            }
@@ -0,0 +1,119 @@
+import argparse
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from app.config import settings
+from app.utils.threads import current_plan
+
+# ======================
+# Config
+# ======================
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+BACKENDS = ("torch", "onnx")
+# Dynamic int8 quantization targets understood by sentence-transformers.
+QUANTIZE_TARGETS = ("arm64", "avx2", "avx512", "avx512_vnni")
+
+
+def encoder_id(backend: str = None) -> str:
+    """Name of the vectors a backend produces; keys the query-embedding cache."""
+    backend = backend or settings.rag_embed_backend
+    if backend == "torch":
+        return EMBEDDING_MODEL
+    return f"{EMBEDDING_MODEL}@{backend}:{settings.rag_embed_onnx_file or 'model.onnx'}"
+
+
+# ======================
+# Load / Encode
+# ======================
+def _session_options(threads: int):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    return options
+
+
+def load_encoder(backend: str = None, threads: int = None) -> SentenceTransformer:
+    """Load the RAG sentence encoder on the configured backend.
+
+    ``onnx`` runs the model exported by ``python -m app.rag.encoder`` in ONNX
+    Runtime, from RAG_EMBED_MODEL_DIR only (nothing is downloaded).
+    ``threads`` caps intra-op threads (default: the process's thread budget);
+    0 keeps the runtime default.
+    """
+    backend = backend or settings.rag_embed_backend
+    threads = current_plan().torch_threads if threads is None else threads
+    if backend == "torch":
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        return SentenceTransformer(EMBEDDING_MODEL)
+    if backend == "onnx":
+        if not settings.rag_embed_model_dir:
+            raise ValueError(
+                "RAG_EMBED_BACKEND=onnx needs RAG_EMBED_MODEL_DIR; "
+                "create it with `python -m app.rag.encoder <dir> --quantize avx2`"
+            )
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        if settings.rag_embed_onnx_file:
+            model_kwargs["file_name"] = settings.rag_embed_onnx_file
+        if threads:
+            model_kwargs["session_options"] = _session_options(threads)
+        return SentenceTransformer(
+            settings.rag_embed_model_dir,
+            device="cpu",
+            backend="onnx",
+            local_files_only=True,
+            model_kwargs=model_kwargs,
+        )
+    raise ValueError(f"Unknown RAG embedding backend '{backend}'. Expected one of {BACKENDS}.")
+
+
+def encode(model: SentenceTransformer, texts: List[str], batch_size: int = None) -> np.ndarray:
+    """Normalized float32 embeddings, in batches of RAG_EMBED_BATCH_SIZE by default."""
+    return np.asarray(
+        model.encode(
+            texts,
+            batch_size=batch_size or settings.rag_embed_batch_size,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ),
+        dtype=np.float32,
+    )
+
+
+# ======================
+# Export
+# ======================
+def export(target: Path, quantize: str = None):
+    """Export the encoder to ONNX under target, optionally with an int8 copy."""
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    # Converts the PyTorch weights; this is the one step that may download the model.
+    model = SentenceTransformer(EMBEDDING_MODEL, device="cpu", backend="onnx")
+    model.save_pretrained(str(target))
+    print(f"[✅ DONE] ONNX encoder written to '{target}'")
+    onnx_file = ""
+    if quantize:
+        export_dynamic_quantized_onnx_model(model, quantize, str(target))
+        onnx_file = f"onnx/model_qint8_{quantize}.onnx"
+        print(f"[✅ DONE] int8 encoder written to '{target / onnx_file}'")
+
+    print("[INFO] Use it with:")
+    print("  RAG_EMBED_BACKEND=onnx")
+    print(f"  RAG_EMBED_MODEL_DIR={target.resolve()}")
+    print(f"  RAG_EMBED_ONNX_FILE={onnx_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the RAG encoder for the onnx backend.")
+    parser.add_argument("target", type=Path, help="Directory to write the exported model to.")
+    parser.add_argument("--quantize", choices=QUANTIZE_TARGETS,
+                        help="Also write a dynamically quantized int8 model for this CPU target.")
+    args = parser.parse_args()
+    export(args.target, args.quantize)
@@ -0,0 +1,209 @@
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+import faiss
+
+from app.config import settings
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "cosine")
+PRECISIONS = ("float32", "float16", "int8", "pq")
+
+# Read-only memory mapping lets every process on a host share one page-cache
+# copy of the index. IO_FLAG_MMAP_IFC maps flat code arrays (FAISS >= 1.11);
+# older builds only know the generic mmap flag.
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# IVF training wants ~39 points per centroid before FAISS warns.
+_MIN_POINTS_PER_CENTROID = 39
+# 8-bit PQ trains 256 centroids per sub-quantizer.
+_PQ_NBITS = 8
+
+# FAISS codec of each precision (the part after "IVF<n>," / "HNSW<m>," in a factory string).
+_CODECS = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+# Saved embeddings are unit vectors, so int8 storage scales components in [-1, 1] by 127.
+_INT8_SCALE = 127.0
+
+# PQ scores are coarse: fetch this many times k candidates before re-scoring them exactly.
+RESCORE_OVERFETCH = 8
+
+
+def index_path(embed_dir: Path, index_type: str = None, precision: str = None) -> Path:
+    """Each index type and precision gets its own file so switching never loads the wrong one."""
+    index_type = index_type or settings.rag_index_type
+    precision = precision or settings.rag_vector_precision
+    suffix = "" if precision == "float32" else f".{precision}"
+    return embed_dir / f"node_index.{index_type}{suffix}.faiss"
+
+
+# ======================
+# Storage precision
+# ======================
+def encode_vectors(vectors: np.ndarray, precision: str = None) -> np.ndarray:
+    """Convert float32 unit vectors to the on-disk dtype of the given precision.
+
+    PQ codes cannot be decoded back exactly, so the pq precision keeps float16
+    vectors on disk for rebuilds, compaction and re-scoring.
+    """
+    precision = precision or settings.rag_vector_precision
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if precision == "float32":
+        return vectors
+    if precision in ("float16", "pq"):
+        return vectors.astype(np.float16)
+    if precision == "int8":
+        return np.clip(np.rint(vectors * _INT8_SCALE), -127, 127).astype(np.int8)
+    raise ValueError(f"Unknown RAG vector precision '{precision}'. Expected one of {PRECISIONS}.")
+
+
+def decode_vectors(stored: np.ndarray) -> np.ndarray:
+    """Float32 view (or copy) of vectors saved in any precision."""
+    if stored.dtype == np.int8:
+        return stored.astype(np.float32) / _INT8_SCALE
+    return np.asarray(stored, dtype=np.float32)
+
+
+# ======================
+# Factory
+# ======================
+def _ivf_nlist(n_vectors: int) -> int:
+    if settings.rag_ivf_nlist > 0:
+        return settings.rag_ivf_nlist
+    nlist = int(4 * math.sqrt(n_vectors))
+    return max(1, min(nlist, n_vectors // _MIN_POINTS_PER_CENTROID))
+
+
+def _codec(dim: int, n_vectors: int, precision: str) -> str:
+    if precision == "pq":
+        if dim % settings.rag_pq_m:
+            raise ValueError(f"RAG_PQ_M={settings.rag_pq_m} does not divide the embedding size {dim}")
+        if n_vectors < _MIN_POINTS_PER_CENTROID * 2 ** _PQ_NBITS:
+            # Too few nodes to train the PQ codebooks; int8 is the next smallest codec.
+            print(f"[INFO] {n_vectors} nodes are too few to train PQ, using int8 codes")
+            return _CODECS["int8"]
+        return f"PQ{settings.rag_pq_m}x{_PQ_NBITS}"
+    if precision not in _CODECS:
+        raise ValueError(f"Unknown RAG vector precision '{precision}'. Expected one of {PRECISIONS}.")
+    return _CODECS[precision]
+
+
+def create_index(dim: int, n_vectors: int, index_type: str = None, precision: str = None):
+    """Create an empty (possibly untrained) index of the requested type and precision."""
+    index_type = index_type or settings.rag_index_type
+    precision = precision or settings.rag_vector_precision
+    if precision == "float32":
+        if index_type == "flat":
+            return faiss.IndexFlatL2(dim)
+        if index_type == "cosine":
+            return faiss.IndexFlatIP(dim)
+    codec = _codec(dim, n_vectors, precision)
+
+    if index_type == "flat":
+        return faiss.index_factory(dim, codec, faiss.METRIC_L2)
+    if index_type == "ivf_flat":
+        return faiss.index_factory(dim, f"IVF{_ivf_nlist(n_vectors)},{codec}", faiss.METRIC_L2)
+    if index_type == "hnsw":
+        index = faiss.index_factory(dim, f"HNSW{settings.rag_hnsw_m},{codec}", faiss.METRIC_L2)
+        index.hnsw.efConstruction = settings.rag_hnsw_ef_construction
+        return index
+    if index_type == "cosine":
+        return faiss.index_factory(dim, codec, faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown RAG index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+
+
+def configure_search(index):
+    """Apply the configured search-time knobs (nprobe / efSearch) to a loaded index."""
+    if hasattr(index, "nprobe"):
+        index.nprobe = settings.rag_ivf_nprobe
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = settings.rag_hnsw_ef_search
+    return index
+
+
+def _prepare(vectors: np.ndarray, index) -> np.ndarray:
+    vectors = np.array(vectors, dtype=np.float32, order="C")
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+# ======================
+# Build / Persist
+# ======================
+def build_index(embeddings: np.ndarray, index_type: str = None, precision: str = None):
+    """Build (and train, if the type needs it) an index over the given node embeddings."""
+    index = create_index(embeddings.shape[1], embeddings.shape[0], index_type, precision)
+    vectors = _prepare(decode_vectors(embeddings), index)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return configure_search(index)
+
+
+def add_vectors(index, vectors: np.ndarray):
+    """Add new node vectors to an already trained index."""
+    index.add(_prepare(vectors, index))
+
+
+def save_index(index, path: Path):
+    """Serialize the index atomically so concurrent readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    faiss.write_index(index, str(tmp_path))
+    os.replace(tmp_path, path)
+
+
+# ======================
+# Load / Search
+# ======================
+def index_is_stale(index_path: Path, embed_path: Path) -> bool:
+    """True when the serialized index is missing or older than the embeddings file."""
+    if not index_path.exists():
+        return True
+    return embed_path.stat().st_mtime > index_path.stat().st_mtime
+
+
+def load_index(index_path: Path, embed_path: Path, mmap: bool = True,
+               index_type: str = None, precision: str = None):
+    """Open the serialized index, rebuilding it first if the embeddings changed."""
+    if index_is_stale(index_path, embed_path):
+        print(f"[INFO] Rebuilding stale FAISS index at {index_path}")
+        embeddings = np.load(embed_path, mmap_mode="r")
+        save_index(build_index(embeddings, index_type, precision), index_path)
+    if mmap:
+        return configure_search(faiss.read_index(str(index_path), MMAP_FLAGS))
+    return configure_search(faiss.read_index(str(index_path)))
+
+
+def search(index, vectors: np.ndarray, k: int):
+    """Search the index; distances are always squared L2 between unit vectors.
+
+    Inner-product (cosine) indexes return similarities, which are mapped to
+    ``2 - 2 * cos`` so ``distance_threshold`` means the same for every type.
+    """
+    distances, indices = index.search(_prepare(vectors, index), k)
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        distances = 2.0 - 2.0 * distances
+    return distances, indices
+
+
+def needs_rescore(precision: str = None) -> bool:
+    """Only PQ distances are coarse enough to move hits across a distance_threshold."""
+    return settings.rag_rescore and (precision or settings.rag_vector_precision) == "pq"
+
+
+def rescore(embeddings: np.ndarray, query_vectors: np.ndarray, indices: np.ndarray):
+    """Exact squared L2 of each hit against the saved vectors, re-sorted per row.
+
+    PQ codes only approximate distances; re-scoring the few fetched hits from
+    the float16 copy on disk keeps ``distance_threshold`` as exact as float32.
+    """
+    found = indices >= 0
+    safe = np.where(found, indices, 0)
+    vectors = decode_vectors(embeddings[safe.ravel()]).reshape(*safe.shape, -1)
+    diff = vectors - np.asarray(query_vectors, dtype=np.float32)[:, None, :]
+    distances = np.where(found, np.einsum("ijk,ijk->ij", diff, diff), np.inf).astype(np.float32)
+    order = np.argsort(distances, axis=1, kind="stable")
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
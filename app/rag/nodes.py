@@ -0,0 +1,68 @@
+import hashlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# Every chunk becomes one node per type, in this order.
+NODE_TYPES = ("Prompt", "Code", "Parts", "Output", "Circuit_Space")
+# node_id of a node is f"chunk_{idx}_{suffix}", suffix matching its type.
+NODE_ID_SUFFIXES = ("prompt", "code", "parts", "output", "circuit")
+
+Node = Tuple[str, str, str, str]  # (node_id, type, chunk_id, text)
+
+
+# ======================
+# Chunk → Nodes
+# ======================
+def chunk_to_nodes(chunk: Dict, chunk_idx: int) -> List[Node]:
+    """Convert a single chunk to 5 node representations."""
+    chunk_id = f"chunk_{chunk_idx}"
+
+    # Parts
+    parts = chunk.get("output", {}).get("parts", [])
+    parts_text = ", ".join(p.get("type", "") for p in parts)
+
+    # Connections; endpoints are not always strings in hand-written examples
+    conns = chunk.get("output", {}).get("connections", [])
+    conn_text = "\n".join(
+        " → ".join(map(str, c[:2])) for c in conns if isinstance(c, list) and len(c) >= 2
+    )
+
+    texts = (
+        chunk.get("prompt", ""),
+        chunk.get("code", ""),
+        parts_text,
+        conn_text,
+        chunk.get("circuit_space_representation", ""),
+    )
+    return [
+        (f"{chunk_id}_{suffix}", node_type, chunk_id, text)
+        for node_type, suffix, text in zip(NODE_TYPES, NODE_ID_SUFFIXES, texts)
+    ]
+
+
+# ======================
+# Columnar metadata
+# ======================
+def chunk_indices(meta: List[Dict]) -> np.ndarray:
+    """Parse the integer chunk index of every node; -1 where the id is malformed."""
+    out = np.full(len(meta), -1, dtype=np.int32)
+    for i, node_meta in enumerate(meta):
+        try:
+            out[i] = int(node_meta["chunk_id"].split("_")[-1])
+        except (KeyError, ValueError):
+            pass
+    return out
+
+
+def type_codes(meta: List[Dict]) -> np.ndarray:
+    """Encode each node's type as its position in NODE_TYPES (unknown types last)."""
+    lookup = {name: code for code, name in enumerate(NODE_TYPES)}
+    return np.array(
+        [lookup.get(m.get("type"), len(NODE_TYPES)) for m in meta], dtype=np.uint8
+    )
+
+
+def text_hash(text: str, model_name: str) -> str:
+    """Content hash of a node text under a given embedding model."""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
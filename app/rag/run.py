@@ -1,10 +1,36 @@
-import json
-from typing import List, Dict, Tuple, Optional
+import itertools
+import math
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Any, List, Dict, Iterable, Tuple, Optional
 from pathlib import Path
 
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+
+from app.config import settings
+from app.rag.embed_cache import EmbeddingCache
+from app.rag.encoder import EMBEDDING_MODEL, encode, encoder_id, load_encoder
+from app.rag.index import (
+    RESCORE_OVERFETCH,
+    add_vectors,
+    create_index,
+    index_path,
+    load_index,
+    needs_rescore,
+    rescore,
+    search,
+)
+from app.rag.nodes import (
+    NODE_ID_SUFFIXES,
+    NODE_TYPES,
+    chunk_indices,
+    chunk_to_nodes,
+    text_hash,
+    type_codes,
+)
+from app.rag.store import ChunkFile, SegmentStore
 
 # ======================
 # Config
@@ -17,12 +43,15 @@ EMBED_DIR.mkdir(parents=True, exist_ok=True)
 # Files
 EMBED_FILE = EMBED_DIR / "node_embeddings.npy"
 META_FILE = EMBED_DIR / "node_metadata.json"
+INDEX_FILE = index_path(EMBED_DIR)
 DATA_FILE = DATA_DIR / "dataset.json"
+store = SegmentStore(EMBED_DIR, EMBED_FILE, META_FILE, DATA_FILE, INDEX_FILE)
 
 # Model
-EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 TOP_K = 5
 DISTANCE_THRESHOLD = 0.4
+MAX_FETCH = 256  # upper bound on nodes fetched per query while widening k
+INGEST_BATCH_SIZE = 256  # chunks per encode call / segment in bulk ingestion
 
 
 # ======================
@@ -35,173 +64,480 @@ def _ensure_files_exist():
             raise FileNotFoundError(f"Missing required file: {path}")
 
 
-def _load_data():
-    """Load all core assets: embeddings, metadata, and dataset chunks."""
-    _ensure_files_exist()
-    embeddings = np.load(EMBED_FILE).astype(np.float32)
-    with open(META_FILE, "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
-    return embeddings, metadata, chunks
+# ======================
+# Internal: Versioned Snapshot
+# ======================
+@dataclass(frozen=True)
+class _Snapshot:
+    """Everything a query reads, replaced as a whole so readers never see a mix.
+
+    ``generation`` is the last store segment applied; ``merged_through`` is
+    the last segment already contained in the base files this snapshot mapped
+    and ``base`` their commit number.
+    ``embeddings`` is the mmap'd base file, only read to re-score the hits of
+    a PQ index.
+
+    Per-node metadata is columnar: the base columns are mmap'd from the store,
+    the delta ones cover nodes ingested since. Chunk bodies are read from the
+    mmap'd chunk file on demand; ``chunk_overlay`` holds chunks written since
+    the last compaction, which take precedence.
+    """
+
+    generation: int
+    merged_through: int
+    base: int
+    index: Any
+    delta_index: Any
+    embeddings: np.ndarray
+    rescore: bool
+    base_chunk_idx: np.ndarray
+    base_type_codes: np.ndarray
+    delta_chunk_idx: np.ndarray
+    delta_type_codes: np.ndarray
+    chunk_file: ChunkFile
+    chunk_overlay: Dict[int, Dict]
+    total_chunks: int
+
+    @property
+    def total_nodes(self) -> int:
+        return self.index.ntotal + self.delta_index.ntotal
+
+    def node_columns(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(chunk index, type code) of the given non-negative node ids."""
+        base_n = len(self.base_chunk_idx)
+        if not len(self.delta_chunk_idx):
+            return self.base_chunk_idx[ids], self.base_type_codes[ids]
+        if not base_n:
+            return self.delta_chunk_idx[ids], self.delta_type_codes[ids]
+        in_base = ids < base_n
+        base_ids = np.where(in_base, ids, 0)
+        delta_ids = np.where(in_base, 0, ids - base_n)
+        return (
+            np.where(in_base, self.base_chunk_idx[base_ids], self.delta_chunk_idx[delta_ids]),
+            np.where(in_base, self.base_type_codes[base_ids], self.delta_type_codes[delta_ids]),
+        )
 
+    def chunk(self, chunk_idx: int) -> Dict:
+        chunk = self.chunk_overlay.get(chunk_idx)
+        if chunk is not None:
+            return chunk
+        if chunk_idx < len(self.chunk_file):
+            return self.chunk_file.get(chunk_idx)
+        return {}  # gap left by an out-of-range chunk_idx
 
-def _save_embeddings(embeds: np.ndarray):
-    """Persist numpy embeddings to disk."""
-    np.save(EMBED_FILE, embeds.astype(np.float32))
 
+# ======================
+# Internal: Hit Resolution
+# ======================
+def _type_filter(node_types: Optional[Iterable[str]]) -> np.ndarray:
+    """Boolean lookup table over type codes for the requested node types."""
+    if node_types is None:
+        return np.ones(len(NODE_TYPES) + 1, dtype=bool)
+    requested = set(node_types)
+    unknown = requested - set(NODE_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown node types {sorted(unknown)}. Expected a subset of {NODE_TYPES}.")
+    return np.array([name in requested for name in NODE_TYPES] + [False])
+
+
+def _first_hits(hit_chunks: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """Mask of hits that are valid and the first (closest) hit of their chunk in each row."""
+    hit_chunks = np.where(valid, hit_chunks, -1)
+    same = hit_chunks[:, :, None] == hit_chunks[:, None, :]
+    # A hit is a repeat if any earlier column in the same row has the same chunk.
+    repeat = np.tril(same, k=-1).any(axis=2)
+    return valid & ~repeat
+
+
+def _select_hits(snap: _Snapshot, distances: np.ndarray, indices: np.ndarray,
+                 distance_threshold: float, allowed: np.ndarray):
+    """Resolve raw FAISS results to (keep mask, chunk index per hit, type code per hit)."""
+    # FAISS pads with -1 when the index holds fewer than k vectors.
+    found = indices >= 0
+    hit_chunks, hit_codes = snap.node_columns(np.where(found, indices, 0))
+    hit_chunks = np.where(found, hit_chunks, -1)
+    valid = (
+        found
+        & allowed[hit_codes]
+        & (distances <= distance_threshold)
+        & (hit_chunks >= 0)
+        & (hit_chunks < snap.total_chunks)
+    )
+    return _first_hits(hit_chunks, valid), hit_chunks, hit_codes
 
-def _save_json(path: Path, obj):
-    """Write a JSON file safely."""
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2, ensure_ascii=False)
+
+def _search_all(snap: _Snapshot, query_vectors: np.ndarray, k: int):
+    """Search the base index and the in-memory delta index and merge by distance."""
+    results = []
+    base_total = snap.index.ntotal
+    if base_total:
+        if snap.rescore:
+            _, indices = search(snap.index, query_vectors, min(k * RESCORE_OVERFETCH, base_total))
+            distances, indices = rescore(snap.embeddings, query_vectors, indices)
+            results.append((distances[:, :k], indices[:, :k]))
+        else:
+            results.append(search(snap.index, query_vectors, min(k, base_total)))
+    if snap.delta_index.ntotal:
+        distances, indices = search(snap.delta_index, query_vectors, min(k, snap.delta_index.ntotal))
+        # Delta node ids continue after the base ones, matching the metadata order.
+        results.append((distances, np.where(indices >= 0, indices + base_total, -1)))
+    if len(results) == 1:
+        return results[0]
+
+    distances = np.concatenate([r[0] for r in results], axis=1)
+    indices = np.concatenate([r[1] for r in results], axis=1)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def _search_distinct(snap: _Snapshot, query_vectors: np.ndarray, top_k: int,
+                     distance_threshold: float, allowed: np.ndarray) -> List[Tuple]:
+    """Search with a growing k until every row has top_k distinct chunks or nothing more can match."""
+    rows: List[Tuple] = [None] * len(query_vectors)
+    cap = min(snap.total_nodes, max(MAX_FETCH, top_k))
+    if cap == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return [(empty, empty, empty, empty, np.empty(0, dtype=bool))] * len(query_vectors)
+
+    # Start wide enough that a filtered search can plausibly fill top_k in one go.
+    n_allowed = max(1, int(allowed[: len(NODE_TYPES)].sum()))
+    fetch = min(cap, top_k * math.ceil(len(NODE_TYPES) / n_allowed))
+    pending = np.arange(len(query_vectors))
+    while pending.size:
+        distances, indices = _search_all(snap, query_vectors[pending], fetch)
+        keep, hit_chunks, hit_codes = _select_hits(snap, distances, indices, distance_threshold, allowed)
+
+        # Hits come back sorted, so once the farthest one is past the threshold
+        # (or FAISS ran out of nodes) a larger k cannot add anything.
+        enough = keep.sum(axis=1) >= top_k
+        exhausted = (distances[:, -1] > distance_threshold) | (indices[:, -1] < 0)
+        done = enough | exhausted | (fetch >= cap)
+        for j in np.flatnonzero(done):
+            row_keep = keep[j] & (np.cumsum(keep[j]) <= top_k)
+            rows[pending[j]] = (distances[j], hit_chunks[j], hit_codes[j], row_keep)
+
+        pending = pending[~done]
+        fetch = min(cap, fetch * 2)
+    return rows
 
 
 # ======================
-# Internal: Build Index
+# Internal: Snapshot Loading / Refresh
 # ======================
-def _build_index(embeddings: np.ndarray):
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-    return index
+def _load_snapshot() -> _Snapshot:
+    """Load the base assets and replay every delta segment written since the last compaction."""
+    _ensure_files_exist()
+    # Held so a compaction cannot swap the base files between the reads below.
+    with store.lock:
+        store.recover()
+        state = store.read_state()
+        embeddings, base_chunk_idx, base_type_codes, chunk_file = store.open_base()
+        index = load_index(INDEX_FILE, EMBED_FILE)
+        segments = [store.read_segment(seq) for seq in store.list_segments()]
+
+    base = _Snapshot(
+        generation=state["merged_through"],
+        merged_through=state["merged_through"],
+        base=state["base"],
+        index=index,
+        # Vectors ingested since the last compaction are searched exactly in memory.
+        delta_index=create_index(embeddings.shape[1], 0, "flat", "float32"),
+        embeddings=embeddings,
+        rescore=needs_rescore(),
+        base_chunk_idx=base_chunk_idx,
+        base_type_codes=base_type_codes,
+        delta_chunk_idx=np.empty(0, dtype=np.int32),
+        delta_type_codes=np.empty(0, dtype=np.uint8),
+        chunk_file=chunk_file,
+        chunk_overlay={},
+        total_chunks=len(chunk_file),
+    )
+    return _extend_snapshot(base, state["generation"], segments)
+
+
+def _extend_snapshot(snap: _Snapshot, generation: int,
+                     segments: List[Tuple[np.ndarray, List[Dict], List[Tuple[int, Dict]]]]) -> _Snapshot:
+    """Copy-on-write: a new snapshot with the given segments appended to the delta."""
+    delta_index = faiss.clone_index(snap.delta_index)
+    overlay = dict(snap.chunk_overlay)
+    new_meta: List[Dict] = []
+    for vectors, rows, updates in segments:
+        add_vectors(delta_index, vectors)
+        new_meta.extend(rows)
+        for chunk_idx, chunk in updates:
+            overlay[chunk_idx] = chunk
+
+    return replace(
+        snap,
+        generation=generation,
+        delta_index=delta_index,
+        delta_chunk_idx=np.concatenate([snap.delta_chunk_idx, chunk_indices(new_meta)]),
+        delta_type_codes=np.concatenate([snap.delta_type_codes, type_codes(new_meta)]),
+        chunk_overlay=overlay,
+        total_chunks=max([snap.total_chunks, *(chunk_idx + 1 for chunk_idx in overlay)]),
+    )
+
+
+def _reload_in_background():
+    """Adopt a freshly compacted base without blocking queries on the old snapshot."""
+    global _state
+    try:
+        snap = _load_snapshot()
+        with _refresh_lock:
+            _state = snap
+    finally:
+        _reloading.release()
+
+
+def _refresh(force: bool = False) -> _Snapshot:
+    """Bring this process up to the store generation and return the current snapshot.
+
+    Cheap when nothing changed: one small state-file read, at most every
+    RAG_RELOAD_INTERVAL seconds. New segments are applied incrementally; new
+    base files (a rebuild, or a compaction that merged segments this process
+    has not seen) trigger a full reload, in the background unless ``force``
+    is set.
+    """
+    global _state, _last_check
+    snap = _state
+    now = time.monotonic()
+    if not force and now - _last_check < settings.rag_reload_interval:
+        return snap
+    _last_check = now
+
+    state = store.read_state()
+    if (state["generation"] == snap.generation and state["merged_through"] <= snap.merged_through
+            and state["base"] == snap.base):
+        return snap
+
+    with _refresh_lock:
+        snap = _state
+        if state["merged_through"] > snap.generation or (
+            state["base"] != snap.base and state["merged_through"] <= snap.merged_through
+        ):
+            # Segments this snapshot never applied were folded into a new base, or the base was rebuilt.
+            if force:
+                _state = _load_snapshot()
+            elif _reloading.acquire(blocking=False):
+                threading.Thread(target=_reload_in_background, name="rag-reload", daemon=True).start()
+            return _state
+
+        seqs = store.list_segments(after=snap.generation)
+        if seqs:
+            try:
+                segments = [store.read_segment(seq) for seq in seqs]
+            except FileNotFoundError:
+                # Compacted away between listing and reading; catch up on the next check.
+                return snap
+            _state = _extend_snapshot(snap, seqs[-1], segments)
+        if state["merged_through"] > snap.merged_through and _reloading.acquire(blocking=False):
+            threading.Thread(target=_reload_in_background, name="rag-reload", daemon=True).start()
+        return _state
 
 
 # ======================
-# Internal: Chunk → Nodes
+# Runtime Initialization
 # ======================
-def _chunk_to_nodes(chunk: Dict, chunk_idx: int) -> List[Tuple[str, str, str, str]]:
-    """Convert a single chunk to 5 node representations."""
-    chunk_id = f"chunk_{chunk_idx}"
-    nodes: List[Tuple[str, str, str, str]] = [
-        (f"{chunk_id}_prompt", "Prompt", chunk_id, chunk.get("prompt", "")),
-        (f"{chunk_id}_code", "Code", chunk_id, chunk.get("code", "")),
-    ]
-
-    # Parts
-    parts = chunk.get("output", {}).get("parts", [])
-    parts_text = ", ".join(p.get("type", "") for p in parts)
-    nodes.append((f"{chunk_id}_parts", "Parts", chunk_id, parts_text))
+_refresh_lock = threading.Lock()
+_reloading = threading.Lock()
+_state = _load_snapshot()
+_last_check = time.monotonic()
+model = load_encoder()
+embedding_cache = EmbeddingCache(
+    encoder_id(),
+    max_entries=settings.rag_embed_cache_size,
+    disk_dir=settings.rag_embed_cache_dir or None,
+    disk_size_limit=settings.rag_embed_cache_disk_limit,
+)
 
-    # Connections
-    conns = chunk.get("output", {}).get("connections", [])
-    conn_text = "\n".join(
-        " → ".join(map(str, c[:2])) for c in conns if isinstance(c, list) and len(c) >= 2
-    )
-    nodes.append((f"{chunk_id}_output", "Output", chunk_id, conn_text))
 
-    # Circuit space
-    circuit = chunk.get("circuit_space_representation", "")
-    nodes.append((f"{chunk_id}_circuit", "Circuit_Space", chunk_id, circuit))
-    return nodes
+def _encode_queries(texts: List[str]) -> np.ndarray:
+    return embedding_cache.encode(texts, lambda missing: encode(model, missing))
 
 
 # ======================
-# Runtime Initialization
+# Public: Query Functions
 # ======================
-embeddings, metadata, chunks = _load_data()
-index = _build_index(embeddings)
-model = SentenceTransformer(EMBEDDING_MODEL)
+def query_many(
+    texts: List[str],
+    top_k: int = TOP_K,
+    distance_threshold: float = DISTANCE_THRESHOLD,
+    node_types: Optional[Iterable[str]] = None,
+) -> List[List[Dict]]:
+    """Search up to top_k distinct chunks for several texts with one encode batch.
+
+    ``node_types`` restricts matches to a subset of NODE_TYPES; the search
+    over-fetches and widens k until enough distinct chunks are found.
+    """
+    if not texts:
+        return []
+
+    allowed = _type_filter(node_types)
+    query_vectors = _encode_queries(list(texts))
+    snap = _refresh()
+
+    results: List[List[Dict]] = []
+    fetched: Dict[int, Dict] = {}  # chunk bodies are parsed once per call
+    for distances, hit_chunks, hit_codes, keep in _search_distinct(
+        snap, query_vectors, top_k, distance_threshold, allowed
+    ):
+        row_results = []
+        for col in np.flatnonzero(keep):
+            chunk_idx, code = int(hit_chunks[col]), int(hit_codes[col])
+            if chunk_idx not in fetched:
+                fetched[chunk_idx] = snap.chunk(chunk_idx)
+            ch = fetched[chunk_idx]
+            row_results.append(
+                {
+                    "matched_node": NODE_TYPES[code],
+                    "node_id": f"chunk_{chunk_idx}_{NODE_ID_SUFFIXES[code]}",
+                    "chunk_id": f"chunk_{chunk_idx}",
+                    "score": float(distances[col]),
+                    "prompt": ch.get("prompt", ""),
+                    "code": ch.get("code", ""),
+                    "output": ch.get("output", {}),
+                    "circuit_space": ch.get("circuit_space_representation", ""),
+                }
+            )
+        results.append(row_results)
+    return results
+
+
+def query(
+    text: str,
+    top_k: int = TOP_K,
+    distance_threshold: float = DISTANCE_THRESHOLD,
+    node_types: Optional[Iterable[str]] = None,
+) -> List[Dict]:
+    """Search most relevant chunks; scores are squared L2 between unit vectors (2 - 2 * cosine)."""
+    return query_many(
+        [text], top_k=top_k, distance_threshold=distance_threshold, node_types=node_types
+    )[0]
+
+
+def store_generation() -> int:
+    """Store generation this process currently serves."""
+    return _state.generation
+
+
+def embedding_cache_stats() -> Dict:
+    """Hit/miss counters of the query-embedding cache in this process."""
+    return embedding_cache.stats()
 
 
 # ======================
-# Public: Query Function
+# Internal: Ingestion
 # ======================
-def query(text: str, top_k: int = TOP_K, distance_threshold: float = DISTANCE_THRESHOLD) -> List[Dict]:
-    """Search most relevant chunks using FAISS + cosine proximity."""
-    query_vector = model.encode([text])[0].astype(np.float32).reshape(1, -1)
-    distances, indices = index.search(query_vector, top_k)
-
-    results = []
-    seen_chunk_ids = set()
-
-    for i, idx in enumerate(indices[0]):
-        distance = float(distances[0][i])
-        if distance > distance_threshold:
-            continue
-
-        node_meta = metadata[idx]
-        chunk_id = node_meta["chunk_id"]
-        node_type = node_meta["type"]
-        node_id = node_meta["node_id"]
-
-        if chunk_id in seen_chunk_ids:
-            continue
-        seen_chunk_ids.add(chunk_id)
-
-        try:
-            chunk_idx = int(chunk_id.split("_")[-1])
-        except ValueError:
-            continue
-        if not (0 <= chunk_idx < len(chunks)):
-            continue
-
-        ch = chunks[chunk_idx]
-        results.append(
+def _ingest_batch(batch: List[Tuple[Optional[int], Dict]]) -> List[int]:
+    """Embed, persist and index (chunk_idx or None, chunk) pairs; returns the chunk indices used.
+
+    Encoding happens before taking the store lock. Under the lock the process
+    first catches up with other writers, so appended chunks get indices that
+    no other process has handed out.
+    """
+    global _state
+
+    texts = [node[3] for _, chunk in batch for node in chunk_to_nodes(chunk, 0)]
+    new_embeds = encode(model, texts)
+
+    with store.lock:
+        snap = _refresh(force=True)
+        next_idx = snap.total_chunks
+        updates: List[Tuple[int, Dict]] = []
+        for chunk_idx, chunk in batch:
+            if chunk_idx is None:
+                chunk_idx = next_idx
+            next_idx = max(next_idx, chunk_idx + 1)
+            updates.append((chunk_idx, chunk))
+
+        nodes_meta = [
             {
-                "matched_node": node_type,
                 "node_id": node_id,
-                "chunk_id": chunk_id,
-                "score": distance,
-                "prompt": ch.get("prompt", ""),
-                "code": ch.get("code", ""),
-                "output": ch.get("output", {}),
-                "circuit_space": ch.get("circuit_space_representation", ""),
+                "type": node_type,
+                "chunk_id": ch_id,
+                "text_hash": text_hash(text, EMBEDDING_MODEL),
             }
-        )
+            for chunk_idx, chunk in updates
+            for node_id, node_type, ch_id, text in chunk_to_nodes(chunk, chunk_idx)
+        ]
 
-    return results
+        # Persist only the delta; the base files are left to compaction
+        seq = store.write_segment(new_embeds, nodes_meta, updates)
+        with _refresh_lock:
+            _state = _extend_snapshot(_state, seq, [(new_embeds, nodes_meta, updates)])
+    return [chunk_idx for chunk_idx, _ in updates]
 
 
 # ======================
-# Public: Ingest New Chunk
+# Public: Ingest New Chunks
 # ======================
 def ingest_feedback_chunk(chunk: Dict, chunk_idx: Optional[int] = None) -> Dict:
-    """Append or overwrite a single feedback chunk and update embeddings/index."""
-    global embeddings, metadata, chunks, index, model
-
-    if chunk_idx is None:
-        chunk_idx = len(chunks)
-    chunk_id = f"chunk_{chunk_idx}"
-
-    # Build nodes & embeddings
-    nodes = _chunk_to_nodes(chunk, chunk_idx)
-    texts = [n[3] for n in nodes]
-    new_embeds = model.encode(texts, show_progress_bar=False).astype(np.float32)
-
-    # Update in-memory
-    embeddings = np.vstack([embeddings, new_embeds])
-    for node_id, node_type, ch_id, _ in nodes:
-        metadata.append({"node_id": node_id, "type": node_type, "chunk_id": ch_id})
-
-    if chunk_idx == len(chunks):
-        chunks.append(chunk)
-    elif 0 <= chunk_idx < len(chunks):
-        chunks[chunk_idx] = chunk
-    else:
-        while len(chunks) < chunk_idx:
-            chunks.append({})
-        chunks.append(chunk)
-
-    # Update FAISS
-    index.add(new_embeds)
-
-    # Persist all data
-    _save_embeddings(embeddings)
-    _save_json(META_FILE, metadata)
-    _save_json(DATA_FILE, chunks)
+    """Append or overwrite a single feedback chunk as a new delta segment."""
+    [chunk_idx] = _ingest_batch([(chunk_idx, chunk)])
+    store.compact_in_background(settings.rag_compact_segments)
 
+    snap = _state
     return {
         "status": "ok",
-        "chunk_id": chunk_id,
+        "chunk_id": f"chunk_{chunk_idx}",
         "chunk_index": chunk_idx,
-        "new_nodes_added": len(nodes),
-        "total_nodes": int(embeddings.shape[0]),
-        "total_chunks": len(chunks),
+        "new_nodes_added": len(NODE_TYPES),
+        "total_nodes": snap.total_nodes,
+        "total_chunks": snap.total_chunks,
+        "generation": snap.generation,
     }
 
 
+def ingest_feedback_chunks(new_chunks: Iterable[Dict], batch_size: int = INGEST_BATCH_SIZE,
+                           compact: bool = True) -> Dict:
+    """Append many chunks: one encode call, one segment and one index add per batch.
+
+    ``new_chunks`` may be any iterable (e.g. a JSONL stream); it is consumed
+    batch by batch so memory stays bounded by ``batch_size``. A caller
+    ingesting one upload in several calls passes ``compact=False`` and calls
+    ``finish_bulk_ingest`` once at the end.
+    """
+    start = time.perf_counter()
+    first_idx = None
+    chunks_added = 0
+
+    iterator = iter(new_chunks)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            break
+        indices = _ingest_batch([(None, ch) for ch in batch])
+        if first_idx is None:
+            first_idx = indices[0]
+        chunks_added += len(batch)
+
+    if compact:
+        store.compact_in_background(settings.rag_compact_segments)
+
+    snap = _state
+    nodes_added = chunks_added * len(NODE_TYPES)
+    elapsed = time.perf_counter() - start
+    return {
+        "status": "ok",
+        "chunks_added": chunks_added,
+        "nodes_added": nodes_added,
+        "first_chunk_index": first_idx,
+        "seconds": elapsed,
+        "chunks_per_s": chunks_added / elapsed if elapsed else 0.0,
+        "nodes_per_s": nodes_added / elapsed if elapsed else 0.0,
+        "total_nodes": snap.total_nodes,
+        "total_chunks": snap.total_chunks,
+        "generation": snap.generation,
+    }
+
+
+def finish_bulk_ingest() -> Dict:
+    """Start a compaction if segments piled up; the index totals after the ingest."""
+    store.compact_in_background(settings.rag_compact_segments)
+    snap = _state
+    return {"total_nodes": snap.total_nodes, "total_chunks": snap.total_chunks, "generation": snap.generation}
+
+
 # ======================
 # Utility: Context Filter
 # ======================
@@ -0,0 +1,382 @@
+import json
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import faiss
+from filelock import FileLock, Timeout
+
+from app.config import settings
+from app.rag.index import build_index, decode_vectors, encode_vectors, index_path
+from app.rag.nodes import chunk_indices, type_codes
+
+# ======================
+# Config
+# ======================
+BASE_DIR = Path(__file__).resolve().parent.parent  # app/
+EMBED_DIR = BASE_DIR / "embeddings"
+DATA_FILE = BASE_DIR / "data" / "dataset.json"
+SEGMENT_DIR_NAME = "segments"
+MANIFEST_NAME = "compaction.json"
+STATE_NAME = "store_state.json"
+LOCK_NAME = "store.lock"
+COMPACT_LOCK_NAME = "compact.lock"
+# Derived from the base metadata / dataset so query workers never parse them.
+CHUNK_IDX_NAME = "node_chunk_idx.npy"
+NODE_TYPES_NAME = "node_types.npy"
+CHUNKS_NAME = "chunks.jsonl"
+CHUNK_OFFSETS_NAME = "chunk_offsets.npy"
+
+ChunkUpdate = Tuple[int, Dict]
+
+
+def place_chunk(chunks: List[Dict], chunk_idx: int, chunk: Dict):
+    """Append or overwrite a chunk at chunk_idx, padding any gap with empty chunks."""
+    if 0 <= chunk_idx < len(chunks):
+        chunks[chunk_idx] = chunk
+        return
+    while len(chunks) < chunk_idx:
+        chunks.append({})
+    chunks.append(chunk)
+
+
+def _tmp(path: Path) -> Path:
+    return path.with_name(f"{path.name}.{os.getpid()}.tmp")
+
+
+def _write_json(path: Path, obj, indent: Optional[int] = None):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=indent, ensure_ascii=False)
+
+
+def _write_npy(path: Path, vectors: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, vectors)
+
+
+def _write_chunks(path: Path, offsets_path: Path, chunks: Iterable[Dict]):
+    """Write one JSON line per chunk plus the byte offset of every line."""
+    offsets = [0]
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            line = json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    _write_npy(offsets_path, np.array(offsets, dtype=np.int64))
+
+
+class ChunkFile:
+    """Read-only, memory-mapped chunk bodies; a chunk is only parsed when asked for."""
+
+    def __init__(self, path: Path, offsets_path: Path):
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        self._map = None
+        if self._offsets[-1] > 0:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, chunk_idx: int) -> Dict:
+        start, end = self._offsets[chunk_idx], self._offsets[chunk_idx + 1]
+        return json.loads(self._map[start:end])
+
+
+class SegmentStore:
+    """Append-only, versioned storage for ingested chunks.
+
+    The base files (embeddings .npy, metadata JSON, dataset JSON and the FAISS
+    index) are only ever replaced by compaction. Each ingest writes one small
+    delta segment: ``seg_<n>.npy`` with the new vectors and ``seg_<n>.json``
+    with their metadata rows and chunk updates. The JSON file is renamed into
+    place last and is the commit marker, so a crash mid-write leaves at most
+    an ignored ``.npy``.
+
+    ``store_state.json`` holds the store generation (the number of the last
+    committed segment, which only ever grows), ``merged_through`` (the last
+    segment folded into the base files) and ``base`` (bumped by every commit
+    of new base files, so readers notice a rebuild that merged nothing). A
+    rebuild from the dataset also advances the generation, as its contents
+    changed. Every write holds a host-wide file lock, so concurrent ingests
+    from several processes get distinct segment numbers and readers can poll
+    the state to pick up new segments and bases.
+
+    Compaction writes every new base file to a temp path, records the
+    temp -> final renames in a manifest, then applies them. A crash after
+    the manifest is written is rolled forward by ``recover()``; a crash
+    before it leaves the old base and segments untouched.
+
+    Base embeddings are saved in ``precision`` (see ``encode_vectors``);
+    segments stay float32 since they are small and short-lived. Next to the
+    base files the store keeps columnar node metadata (int32 chunk index and
+    uint8 type code per node) and an offset-indexed ``chunks.jsonl``, written
+    in the same commit, which query processes mmap instead of loading JSON.
+    """
+
+    def __init__(self, embed_dir: Path, embed_file: Path, meta_file: Path,
+                 data_file: Path, index_file: Path, precision: str = None):
+        self.precision = precision or settings.rag_vector_precision
+        self.embed_file = embed_file
+        self.meta_file = meta_file
+        self.data_file = data_file
+        self.index_file = index_file
+        self.segment_dir = embed_dir / SEGMENT_DIR_NAME
+        self.manifest_file = embed_dir / MANIFEST_NAME
+        self.state_file = embed_dir / STATE_NAME
+        self.chunk_idx_file = embed_dir / CHUNK_IDX_NAME
+        self.node_types_file = embed_dir / NODE_TYPES_NAME
+        self.chunks_file = embed_dir / CHUNKS_NAME
+        self.chunk_offsets_file = embed_dir / CHUNK_OFFSETS_NAME
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        # Reentrant within a thread, exclusive across threads and processes.
+        self.lock = FileLock(str(embed_dir / LOCK_NAME))
+        self._compact_lock = FileLock(str(embed_dir / COMPACT_LOCK_NAME))
+        self._compaction: Optional[threading.Thread] = None
+        self._compaction_start = threading.Lock()
+
+    # ======================
+    # Generation state
+    # ======================
+    def read_state(self) -> Dict[str, int]:
+        """Return {"generation", "merged_through", "base"}; cheap enough to poll per query."""
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        merged = int(state.get("merged_through", 0))
+        if "generation" not in state:
+            # Stores written before generations existed: derive it from the segments.
+            state["generation"] = max([merged, *self._segment_numbers()])
+        return {"generation": int(state["generation"]), "merged_through": merged, "base": int(state.get("base", 0))}
+
+    def _write_state(self, generation: int, merged_through: int, base: int):
+        tmp_path = _tmp(self.state_file)
+        _write_json(tmp_path, {"generation": generation, "merged_through": merged_through, "base": base})
+        os.replace(tmp_path, self.state_file)
+
+    # ======================
+    # Segments
+    # ======================
+    def _segment_paths(self, seq: int) -> Tuple[Path, Path]:
+        stem = self.segment_dir / f"seg_{seq:08d}"
+        return stem.with_suffix(".npy"), stem.with_suffix(".json")
+
+    def _segment_numbers(self) -> List[int]:
+        return [int(path.stem.split("_")[-1]) for path in self.segment_dir.glob("seg_*.json")]
+
+    def list_segments(self, after: int = 0) -> List[int]:
+        """Committed, not yet compacted segment numbers greater than ``after``, in write order."""
+        floor = max(after, self.read_state()["merged_through"])
+        return sorted(seq for seq in self._segment_numbers() if seq > floor)
+
+    def write_segment(self, vectors: np.ndarray, metadata_rows: List[Dict],
+                      chunk_updates: List[ChunkUpdate]) -> int:
+        """Durably append one delta segment and return its number (the new generation)."""
+        with self.lock:
+            state = self.read_state()
+            seq = state["generation"] + 1
+            npy_path, json_path = self._segment_paths(seq)
+
+            tmp_npy = _tmp(npy_path)
+            _write_npy(tmp_npy, np.asarray(vectors, dtype=np.float32))
+            os.replace(tmp_npy, npy_path)
+
+            tmp_json = _tmp(json_path)
+            _write_json(tmp_json, {"metadata": metadata_rows, "chunks": chunk_updates})
+            os.replace(tmp_json, json_path)
+
+            self._write_state(seq, state["merged_through"], state["base"])
+            return seq
+
+    def read_segment(self, seq: int) -> Tuple[np.ndarray, List[Dict], List[ChunkUpdate]]:
+        npy_path, json_path = self._segment_paths(seq)
+        with open(json_path, "r", encoding="utf-8") as f:
+            body = json.load(f)
+        updates = [(int(idx), chunk) for idx, chunk in body["chunks"]]
+        return np.load(npy_path), body["metadata"], updates
+
+    # ======================
+    # Base files
+    # ======================
+    def _derived_files(self) -> Tuple[Path, ...]:
+        return (self.chunk_idx_file, self.node_types_file, self.chunks_file, self.chunk_offsets_file)
+
+    def _write_derived(self, tmp: Dict[Path, Path], metadata: List[Dict], chunks: Iterable[Dict]):
+        _write_npy(tmp[self.chunk_idx_file], chunk_indices(metadata))
+        _write_npy(tmp[self.node_types_file], type_codes(metadata))
+        _write_chunks(tmp[self.chunks_file], tmp[self.chunk_offsets_file], chunks)
+
+    def _ensure_derived(self):
+        """Derive the columnar files for stores written before they existed."""
+        if all(path.exists() for path in self._derived_files()):
+            return
+        print(f"[INFO] Writing columnar node metadata and chunk store under {self.chunks_file.parent}")
+        _, metadata, chunks = self.load_base()
+        tmp = {path: _tmp(path) for path in self._derived_files()}
+        self._write_derived(tmp, metadata, chunks)
+        for final, tmp_path in tmp.items():
+            os.replace(tmp_path, final)
+
+    def load_base(self):
+        """Return (embeddings, metadata, chunks) from the base files, fully parsed.
+
+        Embeddings are mmap'd in their saved dtype; see ``decode_vectors``.
+        Used by compaction; query processes use ``open_base``.
+        """
+        embeddings = np.load(self.embed_file, mmap_mode="r")
+        with open(self.meta_file, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        with open(self.data_file, "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        return embeddings, metadata, chunks
+
+    def open_base(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, ChunkFile]:
+        """Return mmap'd (embeddings, node chunk indices, node type codes, chunk file)."""
+        with self.lock:
+            self._ensure_derived()
+            return (
+                np.load(self.embed_file, mmap_mode="r"),
+                np.load(self.chunk_idx_file, mmap_mode="r"),
+                np.load(self.node_types_file, mmap_mode="r"),
+                ChunkFile(self.chunks_file, self.chunk_offsets_file),
+            )
+
+    # ======================
+    # Compaction
+    # ======================
+    def recover(self):
+        """Finish a compaction that crashed after its manifest was written."""
+        with self.lock:
+            self._apply_manifest()
+
+    def _apply_manifest(self):
+        if not self.manifest_file.exists():
+            return
+        with open(self.manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        for tmp_path, final_path in manifest["replace"]:
+            if Path(tmp_path).exists():
+                os.replace(tmp_path, final_path)
+        state = self.read_state()
+        merged = max(state["merged_through"], manifest["merged_through"])
+        generation = max(state["generation"], manifest.get("generation", 0))
+        self._write_state(generation, merged, max(state["base"], manifest.get("base", 0)))
+        for seq in manifest["segments"]:
+            for path in self._segment_paths(seq):
+                path.unlink(missing_ok=True)
+        self.manifest_file.unlink()
+
+    def _commit_base(self, tmp: Dict[Path, Path], segments: List[int], merged_through: int,
+                     rebuilt: bool = False):
+        """Atomically (via the manifest) move prepared temp files over the base files.
+
+        ``rebuilt``: the base has new contents, not just merged segments, so the generation advances.
+        """
+        replace = [[str(tmp_path), str(final)] for final, tmp_path in tmp.items()]
+        with self.lock:
+            state = self.read_state()
+            tmp_manifest = _tmp(self.manifest_file)
+            _write_json(tmp_manifest, {
+                "replace": replace, "segments": segments, "merged_through": merged_through,
+                "generation": state["generation"] + rebuilt, "base": state["base"] + 1,
+            })
+            os.replace(tmp_manifest, self.manifest_file)
+            self._apply_manifest()
+
+    def write_base(self, embeddings: np.ndarray, metadata: List[Dict], index,
+                   chunks: Iterable[Dict]):
+        """Replace the base embeddings, metadata and index built from the dataset file.
+
+        ``chunks`` are the dataset chunks in order; they are streamed into the
+        chunk store, the dataset file itself is left as it is. Waits for a
+        running compaction, which would otherwise commit the old base over it.
+        """
+        with self._compact_lock:
+            self.recover()
+            tmp = {path: _tmp(path) for path in (
+                self.embed_file, self.meta_file, *self._derived_files(), self.index_file
+            )}
+            _write_npy(tmp[self.embed_file], encode_vectors(embeddings, self.precision))
+            _write_json(tmp[self.meta_file], metadata, indent=2)
+            self._write_derived(tmp, metadata, chunks)
+            faiss.write_index(index, str(tmp[self.index_file]))
+            self._commit_base(tmp, [], self.read_state()["merged_through"], rebuilt=True)
+
+    def pending_segments(self) -> int:
+        return len(self.list_segments())
+
+    def compact(self, wait: bool = True) -> Dict:
+        """Merge every committed segment into new base files and drop the segments."""
+        try:
+            self._compact_lock.acquire(timeout=-1 if wait else 0)
+        except Timeout:
+            return {"status": "busy", "segments": 0}
+        try:
+            self.recover()
+            seqs = self.list_segments()
+            if not seqs:
+                return {"status": "noop", "segments": 0}
+
+            embeddings, metadata, chunks = self.load_base()
+            parts = [decode_vectors(embeddings)]
+            for seq in seqs:
+                vectors, rows, updates = self.read_segment(seq)
+                parts.append(vectors)
+                metadata.extend(rows)
+                for chunk_idx, chunk in updates:
+                    place_chunk(chunks, chunk_idx, chunk)
+            merged = np.concatenate(parts)
+
+            # The index temp file is written after the embeddings one so the
+            # renamed index is never older than the embeddings it was built from.
+            tmp = {path: _tmp(path) for path in (
+                self.embed_file, self.meta_file, self.data_file, *self._derived_files(), self.index_file
+            )}
+            _write_npy(tmp[self.embed_file], encode_vectors(merged, self.precision))
+            _write_json(tmp[self.meta_file], metadata, indent=2)
+            _write_json(tmp[self.data_file], chunks, indent=2)
+            self._write_derived(tmp, metadata, chunks)
+            index = build_index(merged, precision=self.precision)
+            faiss.write_index(index, str(tmp[self.index_file]))
+            self._commit_base(tmp, seqs, seqs[-1])
+
+            return {"status": "ok", "segments": len(seqs), "total_nodes": int(merged.shape[0])}
+        finally:
+            self._compact_lock.release()
+
+    def compact_in_background(self, min_segments: int) -> Optional[threading.Thread]:
+        """Start a compaction thread once enough segments have accumulated.
+
+        At most one runs per store; None when it is still running (or there is
+        nothing to do yet). One running in another process makes it return busy.
+        """
+        with self._compaction_start:
+            if self._compaction is not None and self._compaction.is_alive():
+                return None
+            if self.pending_segments() < min_segments:
+                return None
+            self._compaction = threading.Thread(
+                target=self.compact, kwargs={"wait": False}, name="rag-compaction", daemon=True
+            )
+            self._compaction.start()
+            return self._compaction
+
+
+def default_store() -> SegmentStore:
+    return SegmentStore(
+        EMBED_DIR,
+        EMBED_DIR / "node_embeddings.npy",
+        EMBED_DIR / "node_metadata.json",
+        DATA_FILE,
+        index_path(EMBED_DIR),
+    )
+
+
+if __name__ == "__main__":
+    print(f"[INFO] Compacting RAG segments under {EMBED_DIR / SEGMENT_DIR_NAME}...")
+    print(default_store().compact())
@@ -1,16 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+import json
+import time
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from pathlib import Path
 
-from app.schemas import PromptRequest
+from app.schemas import FeedbackChunk, PromptRequest
 from app.celery_app import run_model
+from app.llm_models.stage_cache import bypassed
+from app.models_registery import DIRECT_REGISTRY
+from app.services import direct
 from app.db import SessionLocal
 from app.models import EvaluationJob, Prompt
 from app.config import settings
+from app.utils.task_events import TERMINAL_STAGES, TaskEventReader
 
 router = APIRouter()
 
+STREAM_BLOCK_MS = 15000  # keep-alive interval of idle event streams
+
 def get_db():
     db = SessionLocal()
     try:
@@ -39,7 +49,7 @@ def add_prompt(request: PromptRequest, db: Session = Depends(get_db)):
     task_ids = {}
     for model in model_names:
         # enqueue task
-        task = run_model.delay(prompt, model, prompt_record.id)
+        task = run_model.delay(prompt, model, prompt_record.id, request.bypass_cache)
 
         # persist job row with prompt_id
         job = EvaluationJob(
@@ -80,6 +90,121 @@ def get_status(task_id: str, db: Session = Depends(get_db)):
     }
 
 
+def _sse(event_id: str, event: dict) -> str:
+    stage = event.get("stage", "message")  # e.g. a RAG abort has a "status" instead
+    return f"id: {event_id}\nevent: {stage}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+def _job_exists(task_id: str) -> bool:
+    db = SessionLocal()
+    try:
+        return db.query(EvaluationJob).filter_by(task_id=task_id).first() is not None
+    finally:
+        db.close()
+
+
+def _finished_event(task_id: str):
+    """The terminal event of a job that finished without one in its stream (expired or never published)."""
+    db = SessionLocal()
+    try:
+        job = db.query(EvaluationJob).filter_by(task_id=task_id).first()
+        if job is None or job.state not in ("SUCCESS", "FAILURE"):
+            return None
+        if job.state == "SUCCESS":
+            return {"stage": "done", "state": job.state, "time_taken": job.time_taken}
+        return {"stage": "error", "state": job.state, "detail": (job.metrics or {}).get("error")}
+    finally:
+        db.close()
+
+
+@router.get("/stream/{task_id}")
+async def stream_task(task_id: str, request: Request, offset: str = "0"):
+    """Server-Sent Events of a task's pipeline stages and (batched) tokens.
+
+    Every event's id is its position in the task's stream; reconnect with the
+    Last-Event-ID header (or ``?offset=``) to resume after it.
+    """
+    # The lookups run in the threadpool: this handler is async, and a blocking
+    # query would hold up the event loop serving every other stream.
+    if not await run_in_threadpool(_job_exists, task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
+    last_id = request.headers.get("last-event-id") or offset
+
+    async def events():
+        nonlocal last_id
+        reader = TaskEventReader(task_id)
+        try:
+            while not await request.is_disconnected():
+                batch = await reader.read(last_id, STREAM_BLOCK_MS)
+                for event_id, event in batch:
+                    last_id = event_id
+                    yield _sse(event_id, event)
+                    if event.get("stage") in TERMINAL_STAGES:
+                        return
+                if not batch:
+                    finished = await run_in_threadpool(_finished_event, task_id)
+                    if finished is not None:
+                        yield _sse(last_id, finished)
+                        return
+                    yield ": keep-alive\n\n"
+        finally:
+            await reader.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/direct/{model_name}")
+async def run_direct(model_name: str, request: PromptRequest, stream: bool = False):
+    """Run one pipeline in this process (PIPELINE_MODE=direct), without the broker or a job record.
+
+    Returns the pipeline payload, or with ``?stream=true`` its events as
+    Server-Sent Events, ending with a "done" (or "error") event.
+    """
+    if settings.pipeline_mode != "direct":
+        raise HTTPException(status_code=404, detail="Direct mode is off; set PIPELINE_MODE=direct.")
+    func = DIRECT_REGISTRY.get(model_name)
+    if func is None:
+        raise HTTPException(status_code=404, detail=f"Model '{model_name}' is not registered.")
+    prompt = request.prompt
+    if not prompt or not prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt must not be empty.")
+
+    start = time.perf_counter()
+    if not stream:
+        with bypassed(request.bypass_cache):
+            payload = await direct.collect_payload(func(prompt))
+        return {**payload, "model": model_name, "time_taken": time.perf_counter() - start}
+
+    async def events():
+        n = 0
+        with bypassed(request.bypass_cache):
+            try:
+                result = func(prompt)
+                if not hasattr(result, "__aiter__"):  # a pipeline without stages
+                    result = _single(await result)
+                async for event in result:
+                    n += 1
+                    yield _sse(str(n), event)
+            except Exception as e:
+                yield _sse(str(n + 1), {"stage": "error", "detail": str(e)})
+                return
+        yield _sse(str(n + 1), {"stage": "done", "time_taken": time.perf_counter() - start})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _single(payload: dict):
+    yield {"stage": "result", **payload}
+
+
 @router.get("/results")
 def list_results(db: Session = Depends(get_db)):
     results = (
@@ -175,4 +300,103 @@ def download_result(task_id: str, db: Session = Depends(get_db)):
             return FileResponse(str(path), media_type="application/json", filename=path.name)
 
     # Otherwise return as a file download
-    return FileResponse(str(path), filename=path.name)
\ No newline at end of file
+    return FileResponse(str(path), filename=path.name)
+
+
+def _parse_chunk(item, position: int) -> dict:
+    try:
+        return FeedbackChunk.model_validate(item).model_dump()
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid chunk at position {position}: {e}")
+
+
+def _parse_line(line: bytes, position: int) -> dict:
+    try:
+        item = json.loads(line)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON on line {position + 1}.")
+    return _parse_chunk(item, position)
+
+
+async def _iter_jsonl(request: Request):
+    """Yield one parsed object per non-empty line of a streamed JSONL body."""
+    buffer = b""
+    position = 0
+    async for part in request.stream():
+        buffer += part
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield position, line
+                position += 1
+    if buffer.strip():
+        yield position, buffer
+
+
+@router.post("/rag/ingest")
+async def ingest_chunks(request: Request):
+    """Bulk-ingest RAG chunks from a JSON array or a streamed JSONL body."""
+    # Imported lazily: loading the embedding model and index is only worth it here.
+    from app.rag.run import INGEST_BATCH_SIZE, finish_bulk_ingest, ingest_feedback_chunks
+
+    start = time.perf_counter()
+    chunks_added = 0
+    nodes_added = 0
+    first_chunk_index = None
+
+    async def flush(batch):
+        nonlocal chunks_added, nodes_added, first_chunk_index
+        result = await run_in_threadpool(ingest_feedback_chunks, batch, INGEST_BATCH_SIZE, False)
+        chunks_added += result["chunks_added"]
+        nodes_added += result["nodes_added"]
+        if first_chunk_index is None:
+            first_chunk_index = result["first_chunk_index"]
+
+    totals = {}
+    try:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            try:
+                items = await request.json()
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Body is not valid JSON.")
+            if not isinstance(items, list):
+                raise HTTPException(status_code=400, detail="Expected a JSON array of chunks.")
+            chunks = [_parse_chunk(item, i) for i, item in enumerate(items)]
+            for i in range(0, len(chunks), INGEST_BATCH_SIZE):
+                await flush(chunks[i : i + INGEST_BATCH_SIZE])
+        else:
+            # Batches are ingested as the body streams in, so an error in a later
+            # line leaves the earlier batches in the index; the error says how many.
+            batch = []
+            async for position, line in _iter_jsonl(request):
+                try:
+                    batch.append(_parse_line(line, position))
+                except HTTPException as e:
+                    if chunks_added:
+                        e.detail = f"{e.detail} {chunks_added} chunks before it were already ingested."
+                    raise
+                if len(batch) >= INGEST_BATCH_SIZE:
+                    await flush(batch)
+                    batch = []
+            if batch:
+                await flush(batch)
+    finally:
+        # One compaction check per upload (even one cut short by a bad line), not per batch.
+        if chunks_added:
+            totals = await run_in_threadpool(finish_bulk_ingest)
+
+    if not chunks_added:
+        raise HTTPException(status_code=400, detail="No chunks to ingest.")
+
+    elapsed = time.perf_counter() - start
+    return {
+        "message": "Chunks ingested",
+        "chunks_added": chunks_added,
+        "nodes_added": nodes_added,
+        "first_chunk_index": first_chunk_index,
+        "seconds": elapsed,
+        "chunks_per_s": chunks_added / elapsed,
+        "nodes_per_s": nodes_added / elapsed,
+        **totals,
+    }
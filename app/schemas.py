@@ -1,5 +1,20 @@
-from pydantic import BaseModel
+from typing import Any, Dict
+
+from pydantic import BaseModel, ConfigDict
 
 
 class PromptRequest(BaseModel):
     prompt: str
+    # Run every stage for real, e.g. to measure latency; results are not cached either
+    bypass_cache: bool = False
+
+
+class FeedbackChunk(BaseModel):
+    """One RAG dataset example; unknown keys are kept as-is."""
+
+    model_config = ConfigDict(extra="allow")
+
+    prompt: str = ""
+    code: str = ""
+    output: Dict[str, Any] = {}
+    circuit_space_representation: str = ""
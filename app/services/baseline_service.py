@@ -1,11 +1,11 @@
 import time
 import re
-from app.llm_models.shared_llms import baseline_llm
+from app.llm_models.prefix_cache import system_prefix
+from app.llm_models.shared_llms import baseline_llm, stage_call
+from app.services import direct
 
 SYSTEM_PROMPT = (
     "You are an **expert IoT Systems Engineer and Embedded Architect** specializing in translating high-level human instructions into complete low-level hardware+software implementations.\n\n"
-    "**Input:**\n"
-    "  • **User Prompt:** {user_prompt}\n\n"
     "**Your Task:**\n"
     "1. **C++ Arduino Code Generation**\n"
     "   - Generate fully functional and industry-standard C++ Arduino code based on the user prompt.\n"
@@ -30,7 +30,9 @@ SYSTEM_PROMPT = (
     "  ```\n"
     "  ```json\n"
     "  // Wokwi JSON\n"
-    "  ```\n"
+    "  ```\n\n"
+    "**Input:**\n"
+    "  • **User Prompt:** {user_prompt}\n"
 )
 
 
@@ -70,17 +72,27 @@ def generate_code_and_json(llm, prompt: str) -> str:
         f"<|im_start|>system\n{message.strip()}\n<|im_end|>\n<|im_start|>assistant\n"
     )
 
-    output = llm(
+    output = stage_call(
+        llm,
         chat_input,
+        prefix=system_prefix(SYSTEM_PROMPT),
         max_tokens=1024,
     )
 
     return output.get("choices", [{}])[0].get("text", "").strip()
 
 
-def run_pipeline(user_prompt: str) -> str:
+def run_pipeline(user_prompt: str) -> dict:
     print("Generating code...")
     result = generate_code_and_json(baseline_llm, user_prompt)
     generated_code, generated_json = strip_assistant_output(result)
 
-    return generated_code, generated_json
+    return {"code": generated_code, "output": generated_json}
+
+
+async def run_pipeline_async(user_prompt: str) -> dict:
+    """``run_pipeline`` for direct mode: the model call runs in the pipeline pool."""
+    result = await direct.blocking("baseline", generate_code_and_json, baseline_llm, user_prompt)
+    generated_code, generated_json = strip_assistant_output(result)
+
+    return {"code": generated_code, "output": generated_json}
@@ -1,4 +1,7 @@
-from app.llm_models.shared_llms import coder_llm_2048, compressor_llm_2048, generator_llm_2048
+from app.llm_models.grammars import grammar_for, record_output
+from app.llm_models.prefix_cache import system_prefix
+from app.llm_models.shared_llms import coder_llm_2048, compressor_llm_2048, generator_llm_2048, stage_call
+from app.services import direct
 
 model = None
 tok = None
@@ -6,8 +9,6 @@ tok = None
 
 CODER_PROMPT = """You are an expert IoT code generation engine. Your sole purpose is to convert a user request into a single, complete, and functional block of code for the specified microcontroller.
 
-    **User Request:** <<< {user_prompt} >>>
-
     **KEY INSTRUCTIONS:**
     1.  **Complete Requirement Fulfillment:** Your code MUST implement every feature, sensor, and logic step mentioned in the user request.
     2.  **Library and API Precision (CRITICAL):** You MUST use the exact, correct libraries and function calls for the specified hardware and components. For example, use `Adafruit_BME280.h` for a BME280 sensor or `WiFi.h` for an ESP32. Do not use placeholder or generic libraries.
@@ -16,14 +17,15 @@ CODER_PROMPT = """You are an expert IoT code generation engine. Your sole purpos
     **OUTPUT MANDATE:**
     -   **Return ONLY raw source code.**
     -   Your response MUST NOT contain any explanations, comments, markdown, or any text other than the code itself.
-    -   The first line of your output must be the first line of the code (e.g., an `#include` statement). """
+    -   The first line of your output must be the first line of the code (e.g., an `#include` statement).
+
+    **User Request:** <<< {user_prompt} >>> """
 
+# No placeholders: the user prompt and the code are sent once, in the user message.
 COMPRESSOR_PROMPT = (
     "You are an **experienced Arduino Systems Engineer**.\n"
-    "Given:\n"
-    "  • User prompt: {user_prompt}\n"
-    "  • Arduino code:\n{code}\n\n"
-    "Generate a **compressed hardware spec** in *Wokwi* nomenclature using **_exactly_** "
+    "Given the user prompt and the Arduino code in the user message, "
+    "generate a **compressed hardware spec** in *Wokwi* nomenclature using **_exactly_** "
     "this scaffold (do not add / remove headers or blank lines):\n"
     "<<=components=>>\n"
     "<<=connections=>>\n"
@@ -34,6 +36,7 @@ COMPRESSOR_PROMPT = (
     "Capture every pin / wiring detail needed to reproduce the circuit, "
     "omit text that is not required for the diagram.\n "
 )
+COMPRESSOR_USER_BLOCK = "User prompt: {user_prompt}\n\nArduino code:\n{code}"
 
 EXAMPLE_JSON = (
     '{"parts":[{"id":"esp","type":"wokwi-esp8266"},'
@@ -58,49 +61,91 @@ GENERATOR_PROMPT = (
 )
 
 
-def generate_code(llm, prompt: str) -> str:
-    system_message = CODER_PROMPT.format(user_prompt=prompt.strip())
-    chat_input = f"<|im_start|>system\n{system_message.strip()}\n<|im_end|>\n<|im_start|>assistant\n"
+MAX_TOKENS = 1024
 
-    output = llm(
+
+def _stream_stage(llm, chat_input: str, prefix: str, stage: str, key: str, until: str, grammar_name: str = None):
+    """Stream one stage as {stage}_start / {stage}_progress / {stage}_done events.
+
+    Generation ends once the ``until`` artifact (cpp | ir | json) is complete.
+    """
+    pieces = []
+    yield {"stage": f"{stage}_start"}
+    for chunk in stage_call(
+        llm,
         chat_input,
-        max_tokens=1024,
+        until=until,
+        prefix=prefix,
+        max_tokens=MAX_TOKENS,
         stop=["<|im_end|>"],
-    )
-    return output.get("choices", [{}])[0].get("text", "").strip()
+        grammar=grammar_for(grammar_name) if grammar_name else None,
+        stream=True,
+    ):
+        token = chunk.get("choices", [{}])[0].get("text", "")
+        pieces.append(token)
+        yield {"stage": f"{stage}_progress", "token": token}
+    output = "".join(pieces).strip()
+    if grammar_name:
+        record_output(grammar_name, output, len(pieces), MAX_TOKENS)
+    yield {"stage": f"{stage}_done", key: output}
+
+
+def generate_code(llm, prompt: str):
+    system_message = CODER_PROMPT.format(user_prompt=prompt.strip())
+    chat_input = f"<|im_start|>system\n{system_message.strip()}\n<|im_end|>\n<|im_start|>assistant\n"
+    yield from _stream_stage(llm, chat_input, system_prefix(CODER_PROMPT), "code", "code", "cpp")
 
 
-def compress_to_ir(llm, prompt: str, code: str) -> str:
-    message = COMPRESSOR_PROMPT.format(user_prompt=prompt, code=code).strip()
-    user_block = f"{prompt}\n\n{code}"
+def compress_to_ir(llm, prompt: str, code: str):
+    system_block = f"<|im_start|>system\n{COMPRESSOR_PROMPT.strip()}\n<|im_end|>\n"
+    user_block = COMPRESSOR_USER_BLOCK.format(user_prompt=prompt, code=code)
     chat_input = (
-        f"<|im_start|>system\n{message}\n<|im_end|>\n"
+        f"{system_block}"
         f"<|im_start|>user\n{user_block}\n<|im_end|>\n"
         f"<|im_start|>assistant\n"
     )
-    response = llm(
-        chat_input,
-        max_tokens=1024,
-        stop=["<|im_end|>"],
-    )
-    return response.get("choices", [{}])[0].get("text", "").strip()
+    yield from _stream_stage(llm, chat_input, system_block, "ir", "ir", "ir", grammar_name="compressor")
 
 
-def generate_json(llm, specification: str) -> str:
+def generate_json(llm, specification: str):
     message = GENERATOR_PROMPT.format(specification=specification).strip()
     chat_input = f"<|im_start|>system\n{message}\n<|im_end|>\n<|im_start|>assistant\n"
     print(chat_input)
-    response = llm(
-        chat_input,
-        max_tokens=1024,
-        stop=["<|im_end|>"],
+    yield from _stream_stage(
+        llm, chat_input, system_prefix(GENERATOR_PROMPT), "json", "output", "json", grammar_name="generator"
     )
-    return response.get("choices", [{}])[0].get("text", "").strip()
 
 
 def run_pipeline(user_prompt: str):
-    code = generate_code(coder_llm_2048, user_prompt)
-    ir = compress_to_ir(compressor_llm_2048, user_prompt, code)
-    json_output = generate_json(generator_llm_2048, ir)
-
-    return code, ir, json_output
+    """Yields the stage events; the folded payload holds "code", "ir" and "output"."""
+    code = ""
+    for event in generate_code(coder_llm_2048, user_prompt):
+        yield event
+        if event["stage"] == "code_done":
+            code = event["code"]
+
+    ir = ""
+    for event in compress_to_ir(compressor_llm_2048, user_prompt, code):
+        yield event
+        if event["stage"] == "ir_done":
+            ir = event["ir"]
+
+    yield from generate_json(generator_llm_2048, ir)
+
+
+async def run_pipeline_async(user_prompt: str):
+    """``run_pipeline`` for direct mode: every stage streams from the pipeline pool."""
+    code = ""
+    async for event in direct.stream("coder", generate_code(coder_llm_2048, user_prompt)):
+        yield event
+        if event["stage"] == "code_done":
+            code = event["code"]
+
+    ir = ""
+    async for event in direct.stream("compressor", compress_to_ir(compressor_llm_2048, user_prompt, code)):
+        yield event
+        if event["stage"] == "ir_done":
+            ir = event["ir"]
+
+    async for event in direct.stream("generator", generate_json(generator_llm_2048, ir)):
+        yield event
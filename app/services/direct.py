@@ -0,0 +1,86 @@
+import asyncio
+import contextvars
+import inspect
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator
+
+from app.config import settings
+
+# ======================
+# Direct mode
+# With PIPELINE_MODE=direct the API process runs pipelines itself
+# (POST /direct/{model}) instead of queueing a Celery task, saving the
+# broker round-trips and task serialization of an interactive request. The
+# async pipelines run every blocking step (llama decoding, query encoding)
+# in one thread pool of DIRECT_WORKERS threads, and at most
+# DIRECT_MODEL_CONCURRENCY requests use a model at a time: a Llama decodes
+# one sequence (a model host one per slot). Requests waiting for a model
+# wait on the event loop, not in a thread.
+# ======================
+_DONE = object()
+_executor = ThreadPoolExecutor(max_workers=settings.direct_workers, thread_name_prefix="pipeline")
+_limits: Dict[str, asyncio.Semaphore] = {}
+
+
+def model_concurrency() -> int:
+    if settings.direct_model_concurrency:
+        return settings.direct_model_concurrency
+    return settings.llm_host_slots if settings.llm_host_dir else 1
+
+
+def _limit(name: str) -> asyncio.Semaphore:
+    if name not in _limits:
+        _limits[name] = asyncio.Semaphore(model_concurrency())
+    return _limits[name]
+
+
+def _submit(fn: Callable, *args) -> Future:
+    # The caller's context goes along, e.g. a stage-cache bypass.
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+async def blocking(name: str, fn: Callable, *args) -> Any:
+    """``fn(*args)`` in the pipeline pool, holding one of model ``name``'s slots."""
+    async with _limit(name):
+        return await asyncio.wrap_future(_submit(fn, *args))
+
+
+def _close_after(step: Future, events: Iterator):
+    try:
+        step.result()
+    except BaseException:
+        pass
+    events.close()
+
+
+async def stream(name: str, events: Iterator) -> AsyncIterator:
+    """The events of a blocking stage generator, each pulled in the pipeline pool.
+
+    Holds one of model ``name``'s slots until the stage ends. When the
+    consumer stops early (e.g. the client disconnected) the generator is
+    closed in the pool once its pending step returns, which ends decoding.
+    """
+    async with _limit(name):
+        step = None
+        try:
+            while True:
+                step = _submit(next, events, _DONE)
+                event = await asyncio.wrap_future(step)
+                if event is _DONE:
+                    step = None
+                    return
+                yield event
+        finally:
+            if step is not None:
+                await asyncio.wrap_future(_executor.submit(_close_after, step, events))
+
+
+async def collect_payload(result) -> Dict:
+    """Async counterpart of ``app.celery_app.collect_payload`` for the async pipelines."""
+    if inspect.isawaitable(result):
+        return await result
+    payload = {}
+    async for event in result:
+        if not event.get("stage", "").endswith("_progress"):
+            payload.update(event)
+    return payload
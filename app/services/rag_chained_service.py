@@ -1,76 +1,121 @@
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence, Set
+
 from app.inferences.coder_inference import generate as generate_code
 from app.inferences.compressor_inference import generate as compress
 from app.inferences.generator_inference import generate as generate_json
 
-from app.rag.run import query
+from app.rag.run import embedding_cache_stats, query, store_generation
+from app.services import direct
+
+# Direct mode: query encoding is limited like a model.
+ENCODER = "encoder"
+
+# Node types each stage's query text is comparable with: the user prompt
+# against dataset prompts, generated code against code, IR against the
+# circuit-space representation.
+CODER_NODE_TYPES = {"Prompt"}
+COMPRESSOR_NODE_TYPES = {"Code"}
+GENERATOR_NODE_TYPES = {"Circuit_Space"}
 
 
-def invoke(prompt, top_k, distance_threshold):
-    results = query(prompt, top_k=top_k, distance_threshold=distance_threshold)
+def invoke(prompt, top_k, distance_threshold, node_types=None):
+    results = query(
+        prompt, top_k=top_k, distance_threshold=distance_threshold, node_types=node_types
+    )
     # return results[1:] if len(results) > 1 else []
     return results if len(results) > 0 else []
 
 
+def cache_scope() -> str:
+    """Stage-cache scope of a RAG stage: its output depends on the index it retrieved from."""
+    return f"rag:{store_generation()}"
+
+
 def filter_rag_context(chunks, fields):
     return [{key: chunk[key] for key in fields if key in chunk} for chunk in chunks]
 
 
+# Above this distance the closest prompt in the dataset is no real example.
+ABORT_SCORE = 0.5
+
+
+def abort_event(coder_rag_context_raw) -> Optional[dict]:
+    """The abort event when retrieval for the first stage found nothing close enough, else None."""
+    best_score = min((item.get("score", 1.0) for item in coder_rag_context_raw), default=1.0)
+    if best_score <= ABORT_SCORE:
+        return None
+    return {
+        "status": "abort",
+        "reason": "No similar examples found in our dataset. Please try another query.",
+        "score": best_score,
+    }
+
+
+@dataclass(frozen=True)
+class _Stage:
+    model: str  # direct mode: the model limit the stage runs under
+    node_types: Set[str]  # retrieved with the previous output as the query
+    fields: Sequence[str]  # kept of each retrieved node
+    done: str  # the stage event carrying the output
+    output: str
+    # (user prompt, previous output, RAG context, cache scope) -> stage events
+    run: Callable
+
+
+# Each stage retrieves with the previous stage's output (the user prompt first).
+STAGES = (
+    _Stage("coder", CODER_NODE_TYPES, ("prompt", "code"), "code_done", "code",
+           lambda prompt, previous, context, scope: generate_code(prompt, context, scope)),
+    _Stage("compressor", COMPRESSOR_NODE_TYPES, ("prompt", "circuit_space"), "ir_done", "ir",
+           lambda prompt, code, context, scope: compress(prompt, code, context, scope)),
+    _Stage("generator", GENERATOR_NODE_TYPES, ("circuit_space", "output"), "json_done", "output",
+           lambda prompt, ir, context, scope: generate_json(ir, context, scope)),
+)
+
+
+def metrics_event() -> dict:
+    return {"stage": "rag_metrics", "embedding_cache": embedding_cache_stats()}
+
+
 def run_pipeline(user_prompt: str, top_k: int, distance_threshold: float):
-    prompt = user_prompt
+    previous = user_prompt
+    for n, stage in enumerate(STAGES, 1):
+        rag_context_raw = invoke(previous, top_k, distance_threshold, stage.node_types)
+        if n == 1 and (abort := abort_event(rag_context_raw)):
+            yield abort
+            return
+        rag_context = filter_rag_context(rag_context_raw, stage.fields)
+        yield {"stage": f"rag_stage_{n}_done", "context": rag_context}
 
-    # Coder RAG context
-    coder_rag_context_raw = invoke(
-        prompt, top_k=top_k, distance_threshold=distance_threshold
-    )
-    print(coder_rag_context_raw)
-    if coder_rag_context_raw:
-        best_score = min(item.get("score", 1.0) for item in coder_rag_context_raw)
-    else:
-        best_score = 1.0
-
-    # ABORT LOGIC
-    if best_score > 0.5:
-        yield {
-            "status": "abort",
-            "reason": "No similar examples found in our dataset. Please try another query.",
-            "score": best_score,
-        }
-        return
-
-    coder_rag_context = filter_rag_context(coder_rag_context_raw, ["prompt", "code"])
-    yield {"stage": "rag_stage_1_done", "context": coder_rag_context}
-
-    # Code generation (stream)
-    code = ""
-    for chunk in generate_code(prompt, coder_rag_context):
-        yield chunk
-        if chunk.get("stage") == "code_done":
-            code = chunk["code"]
-
-    # Compressor RAG context
-    compressor_rag_context_raw = invoke(
-        code, top_k=top_k, distance_threshold=distance_threshold
-    )
-    compressor_rag_context = filter_rag_context(
-        compressor_rag_context_raw, ["prompt", "circuit_space"]
-    )
-    # print(compressor_rag_context)
-    yield {"stage": "rag_stage_2_done", "context": compressor_rag_context}
-
-    # IR generation (stream)
-    ir = ""
-    for chunk in compress(prompt, code, compressor_rag_context):
-        yield chunk
-        if chunk.get("stage") == "ir_done":
-            ir = chunk["ir"]
-
-    # Generator RAG context
-    enriched_ir_raw = invoke(ir, top_k=top_k, distance_threshold=distance_threshold)
-    enriched_ir = filter_rag_context(enriched_ir_raw, ["circuit_space", "output"])
-    yield {"stage": "rag_stage_3_done", "context": enriched_ir}
-
-    # JSON generation (stream)
-    for chunk in generate_json(ir, enriched_ir):
-        yield chunk
-        if chunk.get("stage") == "json_done":
-            code = chunk["output"]
+        output = ""
+        for event in stage.run(user_prompt, previous, rag_context, cache_scope()):
+            yield event
+            if event.get("stage") == stage.done:
+                output = event[stage.output]
+        previous = output
+
+    yield metrics_event()
+
+
+async def run_pipeline_async(user_prompt: str, top_k: int, distance_threshold: float):
+    """``run_pipeline`` for direct mode: retrieval and stages run in the pipeline pool."""
+    previous = user_prompt
+    for n, stage in enumerate(STAGES, 1):
+        rag_context_raw = await direct.blocking(
+            ENCODER, invoke, previous, top_k, distance_threshold, stage.node_types
+        )
+        if n == 1 and (abort := abort_event(rag_context_raw)):
+            yield abort
+            return
+        rag_context = filter_rag_context(rag_context_raw, stage.fields)
+        yield {"stage": f"rag_stage_{n}_done", "context": rag_context}
+
+        output = ""
+        async for event in direct.stream(stage.model, stage.run(user_prompt, previous, rag_context, cache_scope())):
+            yield event
+            if event.get("stage") == stage.done:
+                output = event[stage.output]
+        previous = output
+
+    yield metrics_event()
@@ -0,0 +1,139 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.llm_models.bench_quant import PROMPTS
+
+# ===========================================
+# Sweep the host thread budget on a pipeline and suggest settings.
+#
+#   python -m app.utils.autotune --model chained --workers 1,2,4 --llm-threads 0,2,4 --batch 256,512
+#   python -m app.utils.autotune --model rag_chained_k1t5 --simulated --workers 1,2,4,8
+#
+# For every combination, WORKERS spawned processes are set up the way
+# Celery children are (WORKER_CONCURRENCY, child index, CPU_PIN_WORKERS) and
+# share a fixed prompt set after one untimed warm-up each. --simulated runs
+# with ENVIRONMENT=local: simulated LLMs, but the real RAG encoder and FAISS.
+# Reported per configuration:
+#   prompts/s  prompts finished / wall time across all workers
+#   p50/p95_s  per-prompt latency
+# 0 for a thread setting means "derived from the budget" (see app/utils/threads.py).
+# ===========================================
+
+
+def _run(func, prompt: str):
+    result = func(prompt)
+    if not isinstance(result, dict):
+        for _ in result:  # streamed pipelines do their work while being consumed
+            pass
+
+
+def _worker(index: int, model: str, prompts: List[str], barrier, queue):
+    try:
+        from app.models_registery import MODEL_REGISTRY
+        from app.utils.threads import apply
+
+        apply(index)
+        func = MODEL_REGISTRY[model]
+        _run(func, prompts[0])  # loads models / encoder outside the timed part
+        barrier.wait()
+        start = time.time()
+        latencies = []
+        for prompt in prompts:
+            t0 = time.perf_counter()
+            _run(func, prompt)
+            latencies.append(time.perf_counter() - t0)
+        queue.put((start, time.time(), latencies))
+    except BaseException as e:
+        barrier.abort()  # release the other workers instead of leaving them waiting
+        queue.put(f"worker {index}: {e!r}")
+        raise
+
+
+def run_config(model: str, env: Dict[str, str], workers: int, n_prompts: int) -> Dict:
+    """Spawned children inherit os.environ, so the settings are swapped in around their start."""
+    spawn = multiprocessing.get_context("spawn")
+    barrier, queue = spawn.Barrier(workers), spawn.Queue()
+    prompts = [PROMPTS[i % len(PROMPTS)] for i in range(max(n_prompts, workers))]
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        procs = [
+            spawn.Process(target=_worker, args=(i, model, prompts[i::workers], barrier, queue))
+            for i in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    results = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    errors = [r for r in results if isinstance(r, str)]
+    if errors:
+        raise RuntimeError(f"Autotune run failed: {errors[0]}")
+
+    latencies = [t for _, _, worker_latencies in results for t in worker_latencies]
+    wall = max(end for _, end, _ in results) - min(start for start, _, _ in results)
+    return {
+        "throughput": len(latencies) / wall,
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+    }
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep worker / thread settings and suggest the fastest.")
+    parser.add_argument("--model", default="chained", help="MODEL_REGISTRY entry to run.")
+    parser.add_argument("--simulated", action="store_true", help="Use the simulated LLMs (ENVIRONMENT=local).")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--llm-threads", default="0")
+    parser.add_argument("--llm-threads-batch", default="0")
+    parser.add_argument("--batch", default="512")
+    parser.add_argument("--pin", action="store_true", help="Pin each worker to its own cores.")
+    parser.add_argument("--prompts", type=int, default=8, help="Timed prompts per configuration.")
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'llm_thr':>7} {'llm_thr_b':>9} {'n_batch':>7} "
+          f"{'prompts/s':>9} {'p50_s':>7} {'p95_s':>7}")
+    best = None
+    sweep = itertools.product(
+        _ints(args.workers), _ints(args.llm_threads), _ints(args.llm_threads_batch), _ints(args.batch)
+    )
+    for workers, llm_threads, llm_threads_batch, batch in sweep:
+        env = {
+            "WORKER_CONCURRENCY": str(workers),
+            "LLM_THREADS": str(llm_threads),
+            "LLM_THREADS_BATCH": str(llm_threads_batch),
+            "LLM_BATCH": str(batch),
+            "CPU_PIN_WORKERS": str(args.pin).lower(),
+        }
+        if args.simulated:
+            env["ENVIRONMENT"] = "local"
+        row = run_config(args.model, env, workers, args.prompts)
+        print(f"{workers:>7} {llm_threads:>7} {llm_threads_batch:>9} {batch:>7} "
+              f"{row['throughput']:>9.2f} {row['p50']:>7.2f} {row['p95']:>7.2f}")
+        if best is None or row["throughput"] > best[1]["throughput"]:
+            best = (env, row)
+
+    env, row = best
+    env.pop("ENVIRONMENT", None)
+    print(f"[✅ DONE] Suggested ({row['throughput']:.2f} prompts/s): "
+          + " ".join(f"{key}={value}" for key, value in env.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+
+# ======================
+# Task events
+# Every run_model task appends its pipeline events to the Redis stream
+# task_events:<task_id>; GET /stream/<task_id> relays them as Server-Sent
+# Events. Stream entry ids are the SSE ids, so a client resumes after the
+# last id it saw. *_progress tokens are joined into one event per
+# TASK_EVENTS_BATCH_MS: {"stage": "code_progress", "text": "...", "tokens": n}.
+# A task's last event has stage "done" or "error".
+# ======================
+TERMINAL_STAGES = ("done", "error")
+
+
+def _key(task_id: str) -> str:
+    return f"task_events:{task_id}"
+
+
+def _url() -> str:
+    return settings.task_events_url or settings.broker_url
+
+
+class TaskEventPublisher:
+    """Appends a task's events to its Redis stream, batching progress tokens by time.
+
+    Publishing is best effort: when Redis fails the task keeps running and
+    only the live view is lost.
+    """
+
+    def __init__(self, task_id: str):
+        import redis
+
+        self.key = _key(task_id)
+        self.interval = settings.task_events_batch_ms / 1000
+        self._redis = redis.Redis.from_url(_url())
+        self._errors = (redis.RedisError,)
+        self._enabled = True
+        self._stage: Optional[str] = None
+        self._pieces: List[str] = []
+        self._last_flush = 0.0
+
+    def publish(self, event: Dict):
+        stage = event.get("stage", "")
+        if stage.endswith("_progress"):
+            if stage != self._stage:
+                self.flush()
+                self._stage = stage
+            self._pieces.append(event.get("token", ""))
+            if time.monotonic() - self._last_flush >= self.interval:
+                self.flush()  # so the first token of a quiet period goes out at once
+            return
+        self.flush()
+        self._append(event)
+
+    def flush(self):
+        if self._pieces:
+            self._append({"stage": self._stage, "text": "".join(self._pieces), "tokens": len(self._pieces)})
+            self._pieces = []
+        self._last_flush = time.monotonic()
+
+    def close(self, event: Dict):
+        """Publish the terminal ``done`` / ``error`` event."""
+        self.flush()
+        self._append(event)
+
+    def _append(self, event: Dict):
+        if not self._enabled:
+            return
+        try:
+            pipe = self._redis.pipeline()
+            pipe.xadd(self.key, {"event": json.dumps(event, default=str)},
+                      maxlen=settings.task_events_max_len, approximate=True)
+            pipe.expire(self.key, settings.task_events_ttl_seconds)
+            pipe.execute()
+        except self._errors as e:
+            self._enabled = False
+            print(f"[WARN] Task events for {self.key} disabled: {e}")
+
+
+class TaskEventReader:
+    """Async reader of one task's event stream, for the SSE route."""
+
+    def __init__(self, task_id: str):
+        import redis.asyncio
+
+        self.key = _key(task_id)
+        self._redis = redis.asyncio.Redis.from_url(_url())
+
+    async def read(self, after: str, block_ms: int) -> List[Tuple[str, Dict]]:
+        """Events after stream id ``after`` ("0" = from the start); waits up to ``block_ms`` for new ones."""
+        response = await self._redis.xread({self.key: after}, count=256, block=block_ms)
+        events = []
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                events.append((entry_id, json.loads(fields[b"event"])))
+        return events
+
+    async def close(self):
+        await self._redis.aclose()
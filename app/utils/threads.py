@@ -0,0 +1,87 @@
+import os
+import sys
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import psutil
+
+from app.config import settings
+
+
+@dataclass(frozen=True)
+class ThreadPlan:
+    cores: Tuple[int, ...]  # this process's share of the host cores
+    llm_threads: int  # llama.cpp generation (memory bound: one per physical core)
+    llm_threads_batch: int  # llama.cpp prompt eval (compute bound: every logical core)
+    llm_batch: int
+    torch_threads: int
+    faiss_threads: int
+
+
+def _available_cores() -> Tuple[int, ...]:
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    if settings.cpu_cores:
+        cores = cores[: settings.cpu_cores]
+    return tuple(cores)
+
+
+# Taken before any pinning so every worker splits the same set.
+HOST_CORES = _available_cores()
+_applied: Optional[ThreadPlan] = None
+
+
+def worker_count() -> int:
+    """Processes sharing HOST_CORES; Celery's prefork default is one per CPU."""
+    return settings.worker_concurrency or os.cpu_count() or 1
+
+
+def _threads_per_core() -> int:
+    physical = psutil.cpu_count(logical=False)
+    logical = psutil.cpu_count(logical=True)
+    return max(1, logical // physical) if physical and logical else 1
+
+
+def thread_plan(index: int = 0) -> ThreadPlan:
+    """Split the host cores evenly between the workers and size every pool to one share.
+
+    Worker ``index`` gets a disjoint slice of the cores; workers beyond the
+    number of slices wrap around. Stages run one after another inside a
+    worker, so llama.cpp, torch and FAISS each get the whole share.
+    Explicit LLM_THREADS / LLM_THREADS_BATCH / RAG_EMBED_THREADS win.
+    """
+    share = max(1, len(HOST_CORES) // worker_count())
+    start = index % max(1, len(HOST_CORES) // share) * share
+    cores = HOST_CORES[start : start + share]
+    return ThreadPlan(
+        cores=cores,
+        llm_threads=settings.llm_threads or max(1, share // _threads_per_core()),
+        llm_threads_batch=settings.llm_threads_batch or share,
+        llm_batch=settings.llm_batch,
+        torch_threads=settings.rag_embed_threads or share,
+        faiss_threads=share,
+    )
+
+
+def apply(index: int = 0) -> ThreadPlan:
+    """Size torch / FAISS pools (and optionally pin) for worker ``index`` of this host."""
+    global _applied
+    plan = thread_plan(index)
+    if settings.cpu_pin_workers and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, plan.cores)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(plan.torch_threads)
+    if "faiss" in sys.modules:
+        sys.modules["faiss"].omp_set_num_threads(plan.faiss_threads)
+    _applied = plan
+    pinned = f"pinned to {list(plan.cores)}" if settings.cpu_pin_workers else "unpinned"
+    print(f"[INFO] Worker {index}: llama.cpp {plan.llm_threads}/{plan.llm_threads_batch} threads "
+          f"(n_batch {plan.llm_batch}), torch {plan.torch_threads}, faiss {plan.faiss_threads}, {pinned}")
+    return plan
+
+
+def current_plan() -> ThreadPlan:
+    """The plan applied to this process, or worker 0's when none was."""
+    return _applied or thread_plan(0)